@@ -0,0 +1,68 @@
+# times compiled arithmetic with and without the overflow and bound checks,
+# run from the repository root: python -m benchmarks.checked_arithmetic
+import argparse
+import timeit
+
+import cffi
+
+from xpython import CompilerResult, code, types
+from xpython.backends import csource
+from xpython.compiler.namespace import NamespaceCompiler
+
+
+SOURCE = '''
+def checksum(data: 'buffer', rounds: 'int') -> 'int':
+    total = 0
+    r = 0
+    while r < rounds:
+        i = 0
+        while i < len(data):
+            total = (data[i] + total * 31) & 0xFFFFF
+            i = i + 1
+        r = r + 1
+    return total
+'''
+
+
+def build(checks):
+    types.OVERFLOW_CHECKS = checks
+    types.BOUND_CHECKS = checks
+    try:
+        context = csource.Context()
+        ffi = cffi.FFI()
+        compiler = NamespaceCompiler(
+            context, ffi, types.Types(context, ffi),
+            code.from_string(SOURCE).code)
+        compiler.emit_functions()
+
+        result = CompilerResult(
+            compiler.functions['checksum'], context.compile())
+    finally:
+        types.OVERFLOW_CHECKS = True
+        types.BOUND_CHECKS = True
+
+    return result.native('checksum')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=4096)
+    parser.add_argument('--rounds', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    options = parser.parse_args()
+
+    data = bytes(range(256)) * (options.size // 256 + 1)
+    data = data[:options.size]
+
+    functions = [('checked', build(True)), ('unchecked', build(False))]
+    assert len(set(f(data, 1) for _, f in functions)) == 1
+
+    for name, function in functions:
+        seconds = min(timeit.repeat(
+            lambda: function(data, options.rounds), number=1,
+            repeat=options.repeat))
+        print('{:10} {:8.3f}ms'.format(name, seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
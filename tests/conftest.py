@@ -0,0 +1,43 @@
+import cffi
+import pytest
+
+from xpython import CompilerResult, code
+from xpython.backends import csource
+from xpython.compiler.namespace import NamespaceCompiler
+from xpython.types import Types
+
+
+# compiles a namespace with the C source backend, which needs nothing but
+# the system compiler
+class Compiled:
+    def __init__(self, source, context=None):
+        self.context = context or csource.Context()
+        self.ffi = cffi.FFI()
+        self.types = Types(self.context, self.ffi)
+
+        self.compiler = NamespaceCompiler(
+            self.context, self.ffi, self.types, code.from_string(source).code)
+        self.compiler.emit_functions()
+        self.result = self.context.compile()
+
+    def compiler_result(self, name):
+        return CompilerResult(self.compiler.functions[name], self.result)
+
+    def cffi(self, name):
+        return self.compiler_result(name).cffi(name)
+
+    def native(self, name):
+        return self.compiler_result(name).native(name)
+
+    def check_error(self, name):
+        self.compiler_result(name).check_error()
+
+
+@pytest.fixture(autouse=True)
+def cache_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(csource, 'CACHE_DIRECTORY', str(tmp_path))
+
+
+@pytest.fixture
+def compile_source():
+    return Compiled
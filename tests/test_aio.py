@@ -0,0 +1,71 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import os
+
+import cffi
+
+from xpython import aio
+from xpython.backends import csource
+
+
+SOURCE = '''
+def seven() -> 'int':
+    return 7
+'''
+
+calls = []
+
+
+def factory():
+    calls.append(factory)
+    return csource.Context()
+
+
+def other():
+    calls.append(other)
+    return csource.Context()
+
+
+# the same name somewhere else
+other.__module__ = 'elsewhere'
+other.__qualname__ = factory.__qualname__
+
+
+def test_compile_async(tmp_path, monkeypatch):
+    monkeypatch.setattr(aio, 'LIBRARY_DIRECTORY', str(tmp_path))
+    del calls[:]
+
+    async def main():
+        with ThreadPoolExecutor(2) as pool:
+            return await asyncio.gather(*[
+                aio.compile_async(SOURCE, new_context, cffi.FFI(), pool)
+                for new_context in (factory, factory, other)])
+
+    results = asyncio.run(main())
+
+    # the same factory shares a compile, one of the same name doesn't
+    assert sorted(calls, key=id) == sorted([factory, other], key=id)
+    for result in results:
+        assert result['seven'].native('seven')() == 7
+
+    # libraries are renamed into place, no partial file is left
+    libraries = [n for n in os.listdir(str(tmp_path)) if n.endswith('.so')]
+    assert len(libraries) == 2
+
+
+def test_default_executor(tmp_path, monkeypatch):
+    monkeypatch.setattr(aio, 'LIBRARY_DIRECTORY', str(tmp_path))
+    monkeypatch.setattr(aio, 'executor', None)
+
+    async def main():
+        return await aio.compile_async(SOURCE, factory, cffi.FFI())
+
+    try:
+        result = asyncio.run(main())
+        # the factory and the compile ran in a worker process
+        assert isinstance(aio.executor, ProcessPoolExecutor)
+    finally:
+        if aio.executor is not None:
+            aio.executor.shutdown()
+
+    assert result['seven'].native('seven')() == 7
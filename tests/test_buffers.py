@@ -0,0 +1,132 @@
+import mmap
+
+import pytest
+
+from xpython import CffiBuffer
+from xpython.buffers import ADVICE, MappedBuffer
+
+
+SUM = '''
+def total(b: 'buffer') -> 'int':
+    i = 0
+    s = 0
+    while i < len(b):
+        s = s + b[i]
+        i = i + 1
+    return s
+'''
+
+
+def test_buffer_argument(compile_source):
+    compiled = compile_source(SUM)
+
+    total = compiled.native('total')
+    assert total(b'\x01\x02\x03') == 6
+    assert total(bytearray(b'\x05' * 10)) == 50
+    assert total(b'') == 0
+    with pytest.raises(TypeError):
+        total(3)
+
+    buffer = CffiBuffer(compiled.ffi, b'\x01\x02')
+    assert compiled.cffi('total')(buffer.cffi) == 3
+
+
+WRITES = '''
+def through_alias(buf: 'buffer') -> 'int':
+    b = buf
+    b[0] = byte(7)
+    return 0
+
+def through_slice(buf: 'buffer') -> 'int':
+    buf[2:].set_u32le(0, 258)
+    return 0
+'''
+
+
+def test_writes_reach_params(compile_source):
+    compiled = compile_source(WRITES)
+
+    data = bytearray(6)
+    compiled.native('through_alias')(data)
+    assert data[0] == 7
+
+    compiled.native('through_slice')(data)
+    assert data[2:] == b'\x02\x01\x00\x00'
+
+    # a writable buffer is asked for, bytes can't give one
+    with pytest.raises(BufferError):
+        compiled.native('through_alias')(b'\x00')
+
+
+DATA = bytes(i % 50 for i in range(3 * mmap.PAGESIZE))
+
+
+@pytest.fixture
+def data_file(tmp_path):
+    path = tmp_path / 'data'
+    path.write_bytes(DATA)
+
+    return str(path)
+
+
+def test_mapped_views(compile_source, data_file):
+    compiled = compile_source(SUM)
+    total = compiled.cffi('total')
+
+    with MappedBuffer(compiled.ffi, data_file) as buffer:
+        assert buffer.size == len(DATA)
+        assert total(buffer.cffi) == sum(DATA)
+
+        # views share the mapping, views of views stay in the parent
+        view = buffer.view(10, 20)
+        assert view.data == DATA[10:20]
+        assert view.view(2, 4).data == DATA[12:14]
+        assert total(view.cffi) == sum(DATA[10:20])
+
+        with pytest.raises(AssertionError):
+            buffer.view(0, len(DATA) + 1)
+
+
+def test_mapped_writes(compile_source, data_file):
+    compiled = compile_source(WRITES)
+
+    with open(data_file, 'r+b') as f:
+        buffer = MappedBuffer(compiled.ffi, f, writable=True, length=8)
+        assert buffer.size == 8
+
+        compiled.cffi('through_alias')(buffer.cffi)
+        buffer.flush()
+        buffer.close()
+
+    with open(data_file, 'rb') as f:
+        assert f.read(2) == b'\x07' + DATA[1:2]
+
+
+def test_mapped_advice(compile_source, data_file):
+    buffer = MappedBuffer(
+        compile_source(SUM).ffi, data_file, advice=('random',),
+        huge_pages=True)
+
+    # every name is taken, those the platform lacks do nothing
+    for name in ADVICE:
+        buffer.advise(name)
+    buffer.advise('normal', 1, mmap.PAGESIZE + 1)
+    buffer.prefetch(mmap.PAGESIZE, 2 * mmap.PAGESIZE)
+    buffer.prefetch(len(DATA), len(DATA))
+
+    with pytest.raises(AssertionError):
+        buffer.prefetch(0, len(DATA) + 1)
+
+    assert buffer.data == DATA
+    buffer.close()
+
+
+def test_mapped_close(compile_source, data_file):
+    buffer = MappedBuffer(compile_source(SUM).ffi, data_file)
+    assert buffer.cffi.size == len(DATA)
+
+    buffer.close()
+    assert buffer.map is None and buffer.base is None
+
+    # closing again does nothing
+    buffer.close()
@@ -0,0 +1,109 @@
+import importlib.machinery
+import importlib.util
+
+import cffi
+import pytest
+
+from xpython import code
+from xpython.backends import csource
+from xpython.compiler.module import ModuleCompiler
+
+
+COUNTS = '''
+Counter = py_struct('Counter', ('count', 'int'))
+
+
+class Count(Counter):
+    def __init__(self, count: 'int') -> 'void':
+        self.count = count
+
+    def __add__(self, other: 'int') -> 'int':
+        return self.count + other
+
+    def __getitem__(self, index: 'uint') -> 'uint':
+        return index
+
+    def __len__(self) -> 'int':
+        return self.count
+
+    def scaled(self, factor: 'int') -> 'int':
+        return self.count * factor
+
+
+module = PyModuleDef()
+count_type = PyObjectType()
+
+
+def PyInit_counts() -> 'opaque':
+    default(module)
+    module.m_name = cstr(b'counts')
+    m = PyModule_Create(module)
+    export_class(count_type, Count)
+    ready = PyType_Ready(count_type)
+    added = PyModule_AddObject(m, cstr(b'Count'), count_type)
+    return m
+'''
+
+
+class Reflected:
+    def __radd__(self, other):
+        return 'reflected'
+
+
+@pytest.fixture
+def counts():
+    context = csource.Context()
+    compiler = ModuleCompiler(
+        context, cffi.FFI(), code.from_string(COUNTS).code)
+    compiler.emit_functions()
+    result = context.compile()
+
+    loader = importlib.machinery.ExtensionFileLoader('counts', result.path)
+    return importlib.util.module_from_spec(
+        importlib.util.spec_from_loader('counts', loader))
+
+
+def test_add(counts):
+    count = counts.Count(5)
+    assert count + 2 == 7
+
+    # another type on the right is left to the reflected operation
+    assert count + Reflected() == 'reflected'
+    with pytest.raises(TypeError, match='unsupported operand'):
+        count + 'x'
+
+
+def test_unsigned_index(counts):
+    count = counts.Count(5)
+    assert count[3] == 3
+
+    # python adds the length to negative indexes, what is still negative
+    # doesn't fit the parameter
+    assert count[-1] == 4
+    with pytest.raises(OverflowError):
+        counts.Count(0)[-1]
+
+
+def test_method(counts):
+    count = counts.Count(5)
+    assert count.scaled(3) == 15
+
+    with pytest.raises(TypeError):
+        count.scaled()
+    with pytest.raises(TypeError):
+        count.scaled('x')
+
+
+def test_member(counts):
+    count = counts.Count(5)
+    assert count.count == 5
+
+    # the field is the one the compiled methods see
+    count.count = 8
+    assert count.scaled(2) == 16
+    assert count + 1 == 9
+
+
+def test_len(counts):
+    assert len(counts.Count(4)) == 4
+    assert len(counts.Count(0)) == 0
@@ -0,0 +1,22 @@
+from collections import OrderedDict
+import linecache
+
+from xpython import code
+
+
+def test_sources_are_bounded(monkeypatch):
+    monkeypatch.setattr(code, 'MAX_SOURCES', 2)
+    monkeypatch.setattr(code, 'sources', OrderedDict())
+
+    first, second = [
+        code.from_string('x = {}\n'.format(i)).code.co_filename
+        for i in range(2)]
+    assert code.get_line(first, 1) == 'x = 0\n'
+
+    # the first was used last, the second goes
+    third = code.from_string('x = 2\n').code.co_filename
+    assert list(code.sources) == [first, third]
+    assert code.get_source(second) is None
+    assert second not in linecache.cache
+
+    assert code.get_line(third, 1) == 'x = 2\n'
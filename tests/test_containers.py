@@ -0,0 +1,82 @@
+import pytest
+
+
+COLUMNS = '''
+Point = struct('Point', ('x', 'int'), ('y', 'int'))
+
+def x_of(points: Point.columns, i: 'default') -> 'int':
+    return points[i].x
+'''
+
+ELEMENTS = COLUMNS + '''
+def shift(points: Point.columns, dx: 'int') -> 'int':
+    i = 0
+    while i < len(points):
+        points[i].x = points[i].x + dx
+        i = i + 1
+    return i
+
+def y_at(points: Point.array, i: 'default') -> 'int':
+    return points[i].y
+
+def swap(points: Point.array, i: 'default') -> 'int':
+    x = points[i].x
+    points[i].x = points[i].y
+    points[i].y = x
+    return x
+'''
+
+STORED_ROW = COLUMNS + '''
+def stored(points: Point.columns, i: 'default') -> 'int':
+    row = points[i]
+    return row.x
+'''
+
+
+def test_column_fields(compile_source):
+    compiled = compile_source(COLUMNS)
+    assert 'x_of' in compiled.compiler.functions
+
+
+def test_stored_row(compile_source):
+    with pytest.raises(AssertionError, match="Rows of Point_columns"):
+        compile_source(STORED_ROW)
+
+
+def test_columns(compile_source):
+    compiled = compile_source(ELEMENTS)
+    ffi = compiled.ffi
+
+    xs = ffi.new('int[]', [1, 2, 3])
+    ys = ffi.new('int[]', [4, 5, 6])
+    points = ffi.new('Point_columns*')
+    points.size = 3
+    points.x = xs
+    points.y = ys
+
+    assert compiled.cffi('x_of')(points, 2) == 3
+    assert compiled.cffi('shift')(points, 10) == 3
+    assert list(xs) == [11, 12, 13]
+    assert list(ys) == [4, 5, 6]
+
+    compiled.cffi('x_of')(points, 3)
+    with pytest.raises(IndexError):
+        compiled.check_error('x_of')
+
+
+def test_array(compile_source):
+    compiled = compile_source(ELEMENTS)
+    ffi = compiled.ffi
+
+    data = ffi.new('Point[]', [(1, 4), (2, 5)])
+    points = ffi.new('Point_array*')
+    points.size = 2
+    points.data = data
+
+    assert compiled.cffi('y_at')(points, 1) == 5
+    assert compiled.cffi('swap')(points, 0) == 1
+    assert [(p.x, p.y) for p in data] == [(4, 1), (2, 5)]
+
+    compiled.cffi('y_at')(points, -1)
+    with pytest.raises(IndexError):
+        compiled.check_error('y_at')
@@ -0,0 +1,52 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+import cffi
+
+from xpython import CompilerResult, code
+from xpython.backends import csource
+from xpython.compiler.namespace import NamespaceCompiler
+from xpython.contexts import ContextPool
+
+
+def test_children(tmp_path):
+    pool = ContextPool(csource.Context(), cffi.FFI())
+    # the base is only declared, its code goes into every child
+    assert os.listdir(str(tmp_path)) == []
+
+    for value in (1, 2):
+        source = "def get() -> 'int':\n    return {}\n".format(value)
+        with pool.child() as (context, types):
+            compiler = NamespaceCompiler(
+                context, pool.ffi, types, code.from_string(source).code)
+            compiler.emit_functions()
+            result = CompilerResult(
+                compiler.functions['get'], context.compile())
+
+        assert result.native('get')() == value
+
+        # only the C-API a compile uses is declared in its unit
+        assert 'PyModule_Create2' not in result.result.source
+
+
+def test_threads():
+    pool = ContextPool(csource.Context(), cffi.FFI())
+
+    def compile_get(value):
+        source = "def get() -> 'int':\n    return {}\n".format(value)
+        with pool.child() as (context, types):
+            compiler = NamespaceCompiler(
+                context, pool.ffi, types, code.from_string(source).code)
+            compiler.emit_functions()
+            result = CompilerResult(
+                compiler.functions['get'], context.compile())
+
+        return result.native('get')()
+
+    values = list(range(24))
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert list(executor.map(compile_get, values)) == values
+
+    # children given back are emptied and handed out again
+    assert pool.children <= 4
+    assert len(pool.free) == pool.children
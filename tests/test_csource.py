@@ -0,0 +1,127 @@
+import ctypes
+import gc
+import os
+
+import pytest
+
+from xpython import CompilerResult, backends, ir
+from xpython.backends import csource, missing
+
+
+ARITHMETIC = '''
+def f(a: 'int', b: 'int') -> 'int':
+    x = a + 1
+    while x > 0:
+        if x == 5:
+            break
+        x = x - 1
+    return x * b
+
+def g(a: 'int') -> 'int':
+    return a << 3
+'''
+
+
+def test_interface():
+    assert missing(csource.Context()) == []
+    assert missing(ir.Context(csource.Context())) == []
+
+
+def test_cffi_call(compile_source):
+    compiled = compile_source(ARITHMETIC)
+
+    f = compiled.cffi('f')
+    assert f(10, 3) == 15
+    assert f(2, 3) == 0
+    assert compiled.cffi('g')(5) == 40
+
+
+def test_ir_context(compile_source):
+    context = ir.Context(csource.Context())
+    compiled = compile_source(ARITHMETIC, context)
+
+    assert compiled.cffi('f')(10, 3) == 15
+
+    report = context.manager.report().splitlines()
+    assert len(report) == len(context.manager.timings)
+    assert report[0].startswith('copy_propagation')
+
+
+def test_native_call(compile_source):
+    f = compile_source(ARITHMETIC).native('f')
+
+    assert f(10, 3) == 15
+    with pytest.raises(TypeError):
+        f(1)
+    with pytest.raises(OverflowError):
+        f(2 ** 40, 1)
+
+
+def test_libm_name(compile_source):
+    # the trampoline must call this remainder, not libm's
+    compiled = compile_source('''
+def remainder(a: 'int', b: 'int') -> 'int':
+    return a % b
+''')
+
+    assert compiled.native('remainder')(10, 3) == 1
+    assert compiled.cffi('remainder')(-7, 3) == 2
+
+
+def test_overflow(compile_source):
+    compiled = compile_source(ARITHMETIC)
+
+    assert compiled.cffi('f')(2 ** 31 - 1, 1) == 0
+    with pytest.raises(OverflowError):
+        compiled.check_error('f')
+    with pytest.raises(OverflowError):
+        compiled.native('g')(2 ** 30)
+
+
+def test_source_is_reproducible(compile_source):
+    first = compile_source(ARITHMETIC)
+    second = compile_source(ARITHMETIC)
+
+    assert first.context.source() == second.context.source()
+    assert first.result.path == second.result.path
+
+
+def test_temporary_directory(compile_source, monkeypatch):
+    monkeypatch.setattr(csource, 'CACHE_DIRECTORY', None)
+
+    first = compile_source(ARITHMETIC)
+    second = compile_source(ARITHMETIC.replace('<< 3', '<< 4'))
+
+    assert os.path.dirname(first.result.path) == \
+        os.path.dirname(second.result.path) == csource.get_directory()
+    assert second.cffi('g')(5) == 80
+
+
+def test_compile_to_file(compile_source, tmp_path):
+    compiled = compile_source(ARITHMETIC)
+
+    # output kinds as libgccjit numbers them
+    library = str(tmp_path / 'arithmetic.so')
+    compiled.context.compile_to_file(backends.DYNAMIC_LIBRARY, library)
+    assert ctypes.CDLL(library).g(5) == 40
+
+    assembler = str(tmp_path / 'arithmetic.s')
+    compiled.context.compile_to_file(backends.ASSEMBLER, assembler)
+    with open(assembler) as f:
+        assert 'g:' in f.read()
+
+    with pytest.raises(AssertionError):
+        compiled.context.compile_to_file('so', library)
+
+
+def test_native_keeps_library_alive(compile_source):
+    compiled = compile_source(ARITHMETIC)
+    f = CompilerResult(compiled.compiler.functions['f'], compiled.result) \
+        .native('f')
+    del compiled
+    gc.collect()
+
+    assert f(10, 3) == 15
+    with pytest.raises(TypeError):
+        f(1)
+    assert ctypes.pythonapi.PyCFunction_NewEx.argtypes is None
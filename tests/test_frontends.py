@@ -0,0 +1,124 @@
+import pytest
+
+from xpython import frontend
+from xpython.frontend import syntax
+
+
+CONDITIONAL = '''
+def pick(a: 'int', b: 'int') -> 'int':
+    return 3 if a < b else 4
+
+def assign(a: 'int', b: 'int') -> 'int':
+    x = a - b if a > b else b - a
+    return x + 1
+'''
+
+
+@pytest.fixture(params=['bytecode', 'ast'])
+def frontend_name(request, monkeypatch):
+    monkeypatch.setattr(frontend, 'FRONTEND', request.param)
+    return request.param
+
+
+def test_conditional_expression(compile_source, frontend_name):
+    compiled = compile_source(CONDITIONAL)
+
+    pick = compiled.native('pick')
+    assert pick(1, 2) == 3
+    assert pick(2, 1) == 4
+
+    assign = compiled.native('assign')
+    assert assign(5, 2) == 4
+    assert assign(2, 5) == 4
+    assert assign(3, 3) == 1
+
+
+LOOPS = '''
+def odd_sum(n: 'int') -> 'int':
+    total = 0
+    i = 0
+    while True:
+        i += 1
+        if i > n:
+            break
+        if i % 2 == 0:
+            continue
+        total += i
+    return total
+'''
+
+COUNTING = '''
+def scaled(b: 'buffer', factor: 'int') -> 'int':
+    i = 0
+    while i < len(b):
+        b[i] *= factor
+        i += 1
+    return i
+
+def last(n: 'int') -> 'int':
+    i = -1
+    for i in range(n):
+        pass
+    return i
+
+def countdown(n: 'int') -> 'int':
+    total = 0
+    for i in range(n, 0, -2):
+        total = total * 10 + i
+    return total
+
+def first_multiple(a: 'int', b: 'int', m: 'int') -> 'int':
+    for i in range(a + 1, b):
+        if i % m == 0:
+            break
+        else:
+            continue
+    return i
+
+def skipped(n: 'int') -> 'int':
+    found = 0
+    for i in range(n):
+        if i == 3:
+            continue
+        found += 1
+    else:
+        found += 100
+    return found
+'''
+
+
+def test_loops(compile_source, frontend_name):
+    compiled = compile_source(LOOPS)
+
+    assert compiled.native('odd_sum')(10) == 25
+    assert compiled.native('odd_sum')(0) == 0
+
+
+def test_ast_loops(compile_source, monkeypatch):
+    monkeypatch.setattr(frontend, 'FRONTEND', 'ast')
+    misses = syntax.parse.cache_info().misses
+    compiled = compile_source(COUNTING)
+
+    # from_string and the lowering share one parse
+    assert syntax.parse.cache_info().misses == misses + 1
+
+    # subscripts are loaded and stored again in place
+    data = bytearray(b'\x01\x02\x03')
+    assert compiled.native('scaled')(data, 3) == 3
+    assert data == bytearray(b'\x03\x06\x09')
+
+    # the variable ends on the last value and is left alone by a loop
+    # that doesn't run, as in python
+    last = compiled.native('last')
+    assert last(5) == 4
+    assert last(0) == -1
+
+    assert compiled.native('countdown')(5) == 531
+    assert compiled.native('countdown')(0) == 0
+
+    first_multiple = compiled.native('first_multiple')
+    assert first_multiple(3, 20, 7) == 7
+    assert first_multiple(3, 6, 7) == 5
+
+    assert compiled.native('skipped')(5) == 104
+    assert compiled.native('skipped')(0) == 100
@@ -0,0 +1,139 @@
+import zlib
+
+import pytest
+
+
+SEMANTICS = '''
+def shift(a: 'int', n: 'int') -> 'int':
+    return a << n
+
+def wide_shift(a: 'int', n: 'ssize') -> 'int':
+    return a >> n
+
+def modulo(a: 'int', b: 'int') -> 'int':
+    return a % b
+
+def floor_divide(a: 'int', b: 'int') -> 'int':
+    return a // b
+
+def mask(h: 'int') -> 'ssize':
+    return h & 0xFFFFFFFF
+
+def flag_shift(a: 'int', b: 'int') -> 'int':
+    return 1 << (a < b)
+'''
+
+INT_MIN = -2 ** 31
+
+
+@pytest.fixture
+def compiled(compile_source):
+    return compile_source(SEMANTICS)
+
+
+def test_shift(compiled):
+    shift = compiled.native('shift')
+    assert shift(0, 32) == 0
+    assert shift(0, 100) == 0
+    assert shift(3, 4) == 48
+    assert shift(-1, 31) == INT_MIN
+
+    wide_shift = compiled.native('wide_shift')
+    assert wide_shift(-8, 2 ** 32) == -1
+    assert wide_shift(8, 2 ** 32) == 0
+    assert wide_shift(8, 1) == 4
+
+    assert compiled.native('flag_shift')(1, 2) == 2
+    assert compiled.native('flag_shift')(2, 1) == 1
+
+
+@pytest.mark.parametrize('a, n', [(1, 32), (1, 31), (3, 30)])
+def test_shift_overflow(compiled, a, n):
+    with pytest.raises(OverflowError):
+        compiled.native('shift')(a, n)
+
+
+def test_modulo(compiled):
+    modulo = compiled.native('modulo')
+    assert modulo(INT_MIN, -1) == 0
+    assert modulo(7, -1) == 0
+    assert modulo(-7, 3) == 2
+    assert modulo(7, -3) == -2
+
+    with pytest.raises(OverflowError):
+        compiled.native('floor_divide')(INT_MIN, -1)
+
+
+def test_wide_constant(compiled):
+    mask = compiled.native('mask')
+    assert mask(-1) == 0xFFFFFFFF
+    assert mask(5) == 5
+
+
+MIXED = '''
+SUM_SOURCE
+
+BYTES = b'\\xb0\\x01'
+
+def mix(x: 'uint', i: 'default') -> 'uint':
+    return x ^ BYTES[i]
+
+def wide_left(a: 'ssize', b: 'int') -> 'ssize':
+    return a + b
+
+def wide_right(a: 'int', b: 'ssize') -> 'ssize':
+    return a + b
+
+def store_sum(b: 'buffer') -> 'int':
+    b[0] = b[1] + b[2]
+    return 0
+'''
+
+CRC = '''
+TABLE = {}
+
+def crc32(data: 'buffer') -> 'uint':
+    crc = uint(0xFFFFFFFF)
+    i = 0
+    while i < len(data):
+        crc = TABLE[(crc ^ data[i]) & 0xFF] ^ (crc >> 8)
+        i = i + 1
+    return crc ^ uint(0xFFFFFFFF)
+'''
+
+
+def crc_table():
+    table = []
+    for n in range(256):
+        for _ in range(8):
+            n = (n >> 1) ^ 0xEDB88320 if n & 1 else n >> 1
+        table.append(n)
+
+    return tuple(table)
+
+
+def test_mixed_widths(compile_source):
+    from test_buffers import SUM
+
+    compiled = compile_source(MIXED.replace('SUM_SOURCE', SUM))
+
+    # bytes add up in int, not in char
+    assert compiled.native('total')(b'abc') == 294
+
+    assert compiled.native('mix')(0x12345600, 0) == 0x123456b0
+    assert compiled.native('wide_left')(2 ** 40, 1) == 2 ** 40 + 1
+    assert compiled.native('wide_right')(1, 2 ** 40) == 2 ** 40 + 1
+
+    data = bytearray(b'\x00\x01\x02')
+    compiled.native('store_sum')(data)
+    assert data[0] == 3
+
+    with pytest.raises(OverflowError):
+        compiled.native('store_sum')(bytearray(b'\x00\x64\x64'))
+
+
+def test_crc_table(compile_source):
+    compiled = compile_source(CRC.format(crc_table()))
+
+    data = b'123456789' + bytes(range(256))
+    assert compiled.native('crc32')(data) == zlib.crc32(data)
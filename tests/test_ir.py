@@ -0,0 +1,169 @@
+import textwrap
+
+from xpython import ir
+from xpython.backends import csource
+from xpython.ir import passes
+
+
+# each pass runs alone over a function built through the context api, the
+# dump shows what it changed
+
+
+def dedent(text):
+    return textwrap.dedent(text).strip('\n')
+
+
+class Struct:
+    def __init__(self, context):
+        self.n = context.field('int', 'n')
+        self.pointer = context.pointer_type(
+            context.struct_type('S', [self.n]))
+
+
+def optimized(context):
+    context.optimize()
+    dump = context.dump()
+
+    # what the passes leave still builds
+    context.compile()
+
+    return dump
+
+
+def test_copy_propagation():
+    context = ir.Context(csource.Context(), [passes.copy_propagation])
+    a = context.param('int', 'a')
+    function = context.exported_function('int', 'f', [a])
+    t = context.local(function, 'int', 't')
+
+    block = context.block(function)
+    block.add_assignment(t, a)
+    block.end_with_return(context.binary('+', 'int', t, t))
+
+    assert optimized(context) == dedent('''
+        exported_function f(a):
+          block0:
+            return (a + a)
+    ''')
+
+
+def shared_loads(store_field):
+    context = ir.Context(csource.Context(), [passes.common_subexpressions])
+    struct = Struct(context)
+    p = context.param(struct.pointer, 'p')
+    d = context.param(context.pointer_type('int'), 'd')
+    function = context.exported_function('int', 'f', [p, d])
+    x = context.local(function, 'int', 'x')
+    y = context.local(function, 'int', 'y')
+
+    block = context.block(function)
+    block.add_assignment(x, context.dereference_field(p, struct.n))
+    if store_field:
+        block.add_assignment(
+            context.dereference_field(p, struct.n), context.integer(0))
+    else:
+        block.add_assignment(
+            context.array_access(d, context.integer(0)), x)
+    block.add_assignment(y, context.dereference_field(p, struct.n))
+    block.end_with_return(context.binary('+', 'int', x, y))
+
+    return optimized(context)
+
+
+def test_common_subexpressions():
+    # stores into array data are assumed not to alias struct fields
+    assert shared_loads(False) == dedent('''
+        exported_function f(p, d):
+          block0:
+            cse0 = p->n
+            x = cse0
+            d[0] = x
+            y = cse0
+            return (x + y)
+    ''')
+
+
+def test_field_store_invalidates():
+    assert shared_loads(True) == dedent('''
+        exported_function f(p, d):
+          block0:
+            x = p->n
+            p->n = 0
+            y = p->n
+            return (x + y)
+    ''')
+
+
+def test_loop_invariant_code_motion():
+    context = ir.Context(
+        csource.Context(), [passes.loop_invariant_code_motion])
+    struct = Struct(context)
+    p = context.param(struct.pointer, 'p')
+    function = context.exported_function('int', 'f', [p])
+    i = context.local(function, 'int', 'i')
+    limit = context.binary(
+        '*', 'int', context.dereference_field(p, struct.n),
+        context.integer(2))
+
+    entry = context.block(function)
+    head = context.block(function, 'head')
+    body = context.block(function, 'body')
+    exit = context.block(function, 'exit')
+
+    # the entry branches, the loop needs a block of its own to hoist into
+    entry.add_assignment(i, context.integer(0))
+    entry.end_with_conditonal(
+        context.comparison('>', context.dereference_field(p, struct.n),
+                           context.integer(0)), head, exit)
+    head.end_with_conditonal(context.comparison('<', i, limit), body, exit)
+    body.add_assignment(
+        i, context.binary('+', 'int', i, context.integer(1)))
+    body.end_with_jump(head)
+    exit.end_with_return(i)
+
+    assert optimized(context) == dedent('''
+        exported_function f(p):
+          block0:
+            i = 0
+            if (p->n > 0) goto block4 else block3 'exit'
+          block1 'head':
+            if (i < licm0) goto block2 'body' else block3 'exit'
+          block2 'body':
+            i = (i + 1)
+            goto block1 'head'
+          block3 'exit':
+            return i
+          block4:
+            licm0 = (p->n * 2)
+            goto block1 'head'
+    ''')
+
+
+def test_check_elimination():
+    context = ir.Context(csource.Context(), [passes.check_elimination])
+    i = context.param('int', 'i')
+    n = context.param('int', 'n')
+    function = context.exported_function('int', 'f', [i, n])
+
+    entry = context.block(function)
+    first = context.block(function, 'first')
+    second = context.block(function, 'second')
+    fail = context.block(function, 'fail')
+
+    # the second bound check repeats the first, which dominates it
+    entry.end_with_conditonal(context.comparison('<', i, n), first, fail)
+    first.end_with_conditonal(context.comparison('<', i, n), second, fail)
+    second.end_with_return(i)
+    fail.end_with_return(context.integer(-1))
+
+    assert optimized(context) == dedent('''
+        exported_function f(i, n):
+          block0:
+            if (i < n) goto block1 'first' else block3 'fail'
+          block1 'first':
+            goto block2 'second'
+          block2 'second':
+            return i
+          block3 'fail':
+            return -1
+    ''')
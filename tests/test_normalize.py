@@ -0,0 +1,82 @@
+from xpython.frontend import JUMPS
+from xpython.frontend.bytecode import normalize
+
+
+SOURCE = '''
+def add(a, b):
+    return a + b
+
+def call(a):
+    return g(a, 1)
+
+def method(a):
+    return a.m(2)
+
+def keywords(a):
+    return g(a, key=3)
+
+def loop(n):
+    i = 0
+    while i < n:
+        if i is None:
+            break
+        i += 1
+    return i
+'''
+
+
+def stream(name):
+    namespace = {}
+    exec(compile(SOURCE, '<normalize>', 'exec'), namespace)
+
+    return normalize(namespace[name].__code__)
+
+
+def ops(name):
+    return [(i.opname, i.argval) for i in stream(name)]
+
+
+def test_binary_op():
+    assert ops('add') == [
+        ('LOAD_FAST', 'a'), ('LOAD_FAST', 'b'), ('BINARY_ADD', None),
+        ('RETURN_VALUE', None)]
+
+
+def test_calls():
+    # 3.11+ PUSH_NULL, PRECALL and CALL become the older call forms
+    assert ops('call') == [
+        ('LOAD_GLOBAL', 'g'), ('LOAD_FAST', 'a'), ('LOAD_CONST', 1),
+        ('CALL_FUNCTION', 2), ('RETURN_VALUE', None)]
+
+    assert ops('method') == [
+        ('LOAD_FAST', 'a'), ('LOAD_METHOD', 'm'), ('LOAD_CONST', 2),
+        ('CALL_METHOD', 1), ('RETURN_VALUE', None)]
+
+
+def test_keyword_call():
+    # KW_NAMES turns into the names tuple CALL_FUNCTION_KW takes
+    assert ops('keywords') == [
+        ('LOAD_GLOBAL', 'g'), ('LOAD_FAST', 'a'), ('LOAD_CONST', 3),
+        ('LOAD_CONST', ('key',)), ('CALL_FUNCTION_KW', 2),
+        ('RETURN_VALUE', None)]
+
+
+def test_jumps():
+    instructions = stream('loop')
+    offsets = [i.offset for i in instructions]
+    assert offsets == list(range(0, 2 * len(instructions), 2))
+
+    # jumps are absolute, into the stream, and their targets are marked
+    names = set()
+    targets = set()
+    for instruction in instructions:
+        names.add(instruction.opname)
+        if instruction.opname in JUMPS:
+            assert instruction.argval in offsets
+            targets.add(instruction.argval)
+
+    assert targets == set(i.offset for i in instructions if i.is_jump_target)
+    assert names <= {
+        'LOAD_CONST', 'STORE_FAST', 'LOAD_FAST', 'COMPARE_OP',
+        'INPLACE_ADD', 'RETURN_VALUE', 'SETUP_LOOP', 'POP_BLOCK',
+        'BREAK_LOOP'} | JUMPS
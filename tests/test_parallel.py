@@ -0,0 +1,75 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from xpython import parallel
+from xpython.buffers import BufferPool
+
+
+KERNELS = '''
+@nogil
+def total(b: 'buffer') -> 'int':
+    s = 0
+    i = 0
+    while i < len(b):
+        s = s + b[i]
+        i = i + 1
+    return s
+
+def held(b: 'buffer') -> 'int':
+    return len(b)
+'''
+
+DATA = bytes(i % 100 for i in range(10007))
+
+
+@pytest.fixture
+def compiled(compile_source):
+    return compile_source(KERNELS)
+
+
+def test_split(compiled):
+    buffer = BufferPool(compiled.ffi).acquire(data=DATA)
+
+    views = parallel.split(buffer, 4)
+    assert [v.size for v in views] == [2501, 2501, 2501, 2504]
+    assert b''.join(v.data for v in views) == DATA
+
+    # never more parts than bytes
+    assert len(parallel.split(buffer.view(0, 2), 4)) == 2
+
+
+def wrapper(compiled, name):
+    # the wrapper takes buffer objects and carries the nogil flag
+    return compiled.compiler_result(name).cffi_wrapper(name)
+
+
+def test_map(compiled):
+    total = wrapper(compiled, 'total')
+    buffer = BufferPool(compiled.ffi).acquire(data=DATA)
+
+    # the views run on several threads, their sums add up to one run
+    sums = parallel.map_split(total, buffer, workers=4)
+    assert len(sums) == 4
+    assert sum(sums) == total(buffer) == sum(DATA)
+
+    views = parallel.split(buffer, 3)
+    assert parallel.map(total, views, workers=3) == [
+        total(v) for v in views]
+
+
+def test_map_needs_nogil(compiled):
+    buffer = BufferPool(compiled.ffi).acquire(data=DATA)
+
+    with pytest.raises(AssertionError):
+        parallel.map(wrapper(compiled, 'held'), [buffer])
+
+
+def test_native_threads(compiled):
+    # the trampoline releases the gil around the call
+    total = compiled.native('total')
+    chunks = [DATA[i:i + 1000] for i in range(0, len(DATA), 1000)]
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert list(executor.map(total, chunks)) == [
+            total(chunk) for chunk in chunks]
@@ -0,0 +1,52 @@
+import pytest
+
+from xpython import pgo
+
+
+SOURCE = '''
+def f(a: 'int') -> 'int':
+    if a > 0:
+        return 1
+    return 0
+'''
+
+
+def test_stale_profile(compile_source, monkeypatch):
+    profile = pgo.Profile()
+    profile.functions['f'] = pgo.FunctionProfile('stale')
+    monkeypatch.setattr(pgo, 'PROFILE', profile)
+
+    with pytest.warns(UserWarning, match='Profile of f is for different'):
+        compiled = compile_source(SOURCE)
+
+    assert compiled.native('f')(3) == 1
+
+
+def test_cycle(compile_source, monkeypatch, tmp_path):
+    monkeypatch.setattr(pgo, 'INSTRUMENT', True)
+    instrumented = compile_source(SOURCE)
+    f = instrumented.native('f')
+    for a in range(1000):
+        assert f(a + 1) == 1
+    assert f(0) == 0
+
+    profile = pgo.Profile()
+    counts = profile.collect(
+        instrumented.result, instrumented.compiler.functions['f'])
+    offsets = instrumented.compiler.functions['f'].instruction_map
+    assert [counts.branch(o) for o in offsets if any(counts.branch(o))] \
+        == [(1000, 1)]
+
+    path = str(tmp_path / 'f.profile')
+    profile.save(path)
+
+    # the hint is only there once the profile is
+    monkeypatch.setattr(pgo, 'INSTRUMENT', False)
+    plain = compile_source(SOURCE)
+    assert '__builtin_expect' not in plain.context.source()
+
+    monkeypatch.setattr(pgo, 'PROFILE', pgo.Profile.load(path))
+    profiled = compile_source(SOURCE)
+    assert '__builtin_expect' in profiled.context.source()
+    assert profiled.native('f')(3) == 1
+    assert profiled.native('f')(-3) == 0
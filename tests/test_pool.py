@@ -0,0 +1,37 @@
+import cffi
+import pytest
+
+from xpython.backends import csource
+from xpython.buffers import BufferPool
+from xpython.types import Types
+
+
+def pool():
+    ffi = cffi.FFI()
+    Types(csource.Context(), ffi).get_type('buffer')
+
+    return BufferPool(ffi)
+
+
+def test_reuse():
+    buffers = pool()
+
+    first = buffers.acquire(data=b'abc')
+    assert first.data == b'abc'
+    first.release()
+
+    second = buffers.acquire(10)
+    assert second is first and second.size == 10
+    assert buffers.allocated == 1
+
+
+def test_double_release():
+    buffers = pool()
+
+    buffer = buffers.acquire(10)
+    buffer.release()
+    with pytest.raises(AssertionError):
+        buffer.release()
+
+    # handed out once, not to both of these
+    assert buffers.acquire(10) is not buffers.acquire(10)
@@ -0,0 +1,82 @@
+import io
+import os
+import threading
+
+import pytest
+
+from xpython.stream import stream
+
+
+# a pair split over two chunks is only seen through the state
+PAIRS = '''
+State = struct('State', ('pairs', 'int'), ('last', 'int'))
+
+def count_pairs(state: State, chunk: 'buffer') -> 'int':
+    i = 0
+    while i < len(chunk):
+        if chunk[i] == 10 and state.last == 13:
+            state.pairs = state.pairs + 1
+        state.last = chunk[i]
+        i = i + 1
+    return len(chunk)
+'''
+
+DATA = b'a\r\nbc\r\n\r\nd\r' * 50 + b'\n'
+
+
+@pytest.fixture
+def pairs(compile_source):
+    compiled = compile_source(PAIRS)
+    function = compiled.compiler_result('count_pairs').cffi_wrapper(
+        'count_pairs')
+
+    def run(source, **options):
+        state = compiled.ffi.new('State*')
+        sizes = list(stream(
+            compiled.ffi, function, state, source, chunk_size=4, **options))
+
+        assert sum(sizes) == len(DATA)
+        assert max(sizes) <= 4
+
+        return state.pairs
+
+    return run
+
+
+def test_mapped(pairs, tmp_path):
+    path = tmp_path / 'data'
+    path.write_bytes(DATA)
+
+    assert pairs(str(path)) == DATA.count(b'\r\n')
+
+
+def test_readinto(pairs, tmp_path):
+    path = tmp_path / 'data'
+    path.write_bytes(DATA)
+
+    with open(str(path), 'rb') as f:
+        assert pairs(f, use_mmap=False) == DATA.count(b'\r\n')
+
+    assert pairs(io.BytesIO(DATA)) == DATA.count(b'\r\n')
+
+
+def test_pipe(pairs):
+    read, write = os.pipe()
+
+    def writer():
+        with os.fdopen(write, 'wb') as f:
+            f.write(DATA)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    with os.fdopen(read, 'rb') as f:
+        assert pairs(f) == DATA.count(b'\r\n')
+    thread.join()
+
+
+def test_iterator(pairs):
+    # pieces larger than a chunk are split, smaller ones passed on
+    pieces = [DATA[i:i + 7] for i in range(0, len(DATA), 7)]
+
+    assert pairs(iter(pieces)) == DATA.count(b'\r\n')
+    assert pairs([DATA]) == DATA.count(b'\r\n')
@@ -0,0 +1,35 @@
+POLY = '''
+POLY = 0xEDB88320
+ALL = 0xFFFFFFFFFFFFFFFF
+BIG = (1, 0xEDB88320, 0x100000000)
+SQUARES = b'\\x00\\x01\\x04\\x09\\xc8'
+
+def mix(x: 'uint') -> 'uint':
+    return x ^ POLY
+
+def ones(x: 'unsigned') -> 'unsigned':
+    return x & ALL
+
+def big(i: 'int') -> 'ssize':
+    return BIG[i]
+
+def last() -> 'ssize':
+    return BIG[2]
+
+def square(i: 'int') -> 'int':
+    return SQUARES[i]
+'''
+
+
+def test_large_constants(compile_source):
+    compiled = compile_source(POLY)
+
+    assert compiled.native('mix')(0) == 0xEDB88320
+    assert compiled.native('mix')(0xEDB88320) == 0
+    assert compiled.native('ones')(2 ** 64 - 2) == 2 ** 64 - 2
+
+    big = compiled.native('big')
+    assert [big(i) for i in range(3)] == [1, 0xEDB88320, 0x100000000]
+    assert compiled.native('last')() == 0x100000000
+
+    assert compiled.native('square')(4) == 200
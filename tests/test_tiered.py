@@ -0,0 +1,40 @@
+import logging
+
+import cffi
+
+from xpython import tiered
+from xpython.backends import csource
+from xpython.contexts import ContextPool
+
+
+def add(a: 'int', b: 'int') -> 'int':
+    return a + b
+
+
+def test_promotion(caplog):
+    pool = ContextPool(csource.Context(), cffi.FFI())
+    events = []
+    function = tiered.Tiered(
+        add, pool, call_threshold=2, back_edge_threshold=0,
+        on_event=events.append)
+
+    assert function(1, 2) == 3
+    assert function(3, 4) == 7
+    assert function.wait() == tiered.NATIVE
+    assert [e.kind for e in events] == ['promoted']
+
+    # the fastcall trampoline is swapped in, it takes python ints
+    assert type(function.native).__name__ == 'builtin_function_or_method'
+    assert function(5, 6) == 11
+
+    # what it can't unbox runs as python, as it did before the swap
+    assert function(2 ** 40, 1) == 2 ** 40 + 1
+    assert function(1.5, 2) == 3.5
+    assert function(2 ** 31 - 1, 1) == 2 ** 31
+
+    # keywords stay on the python path
+    assert function(1, b=2) == 3
+
+    with caplog.at_level(logging.INFO, logger='xpython.tiered'):
+        tiered.report(events[0])
+    assert 'add promoted after 2 calls' in caplog.text
@@ -1,4 +1,5 @@
-from xpython.types import Buffer
+from xpython import errors
+from xpython.types import align_up
 
 
 class CffiBuffer:
@@ -21,6 +22,133 @@ class CffiBuffer:
     def cffi(self):
         return self._cffi
 
+    @property
+    def base(self):
+        return self._data
+
+    def view(self, start, stop):
+        return CffiBufferView(self, start, stop)
+
+
+class CffiBufferView:
+    # shares the data of its parent, which it keeps alive
+    def __init__(self, parent, start, stop):
+        assert 0 <= start <= stop <= parent.size, \
+            "View {}:{} out of bounds".format(start, stop)
+        ffi = parent.ffi
+        self.parent = parent
+        self.start = start
+        self._cffi = ffi.new("buffer*")
+        self._cffi.size = stop - start
+        self._cffi.data = parent.base + start
+        self.ffi = ffi
+
+    @property
+    def data(self):
+        return self.ffi.unpack(self._cffi.data, self.size)
+
+    @property
+    def size(self):
+        return self._cffi.size
+
+    @property
+    def cffi(self):
+        return self._cffi
+
+    def view(self, start, stop):
+        return self.parent.view(self.start + start, self.start + stop)
+
+
+class CffiArray:
+    def __init__(self, ffi, name, size):
+        self._data = ffi.new(name + "[]", size)
+        self._cffi = ffi.new(name + "_array*")
+        self._cffi.size = size
+        self._cffi.data = self._data
+        self.ffi = ffi
+
+    def __getitem__(self, index):
+        return self._data[index]
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def size(self):
+        return len(self._data)
+
+    @property
+    def buffer(self):
+        return self.ffi.buffer(self._data)
+
+    @property
+    def cffi(self):
+        return self._cffi
+
+
+class CffiColumns:
+    def __init__(self, ffi, name, size):
+        self._cffi = ffi.new(name + "_columns*")
+        self._cffi.size = size
+        self.ffi = ffi
+
+        # all columns share one allocation, each aligned for its item type
+        columns = [
+            (field_name, field.type)
+            for field_name, field in ffi.typeof(self._cffi[0]).fields
+            if field_name != 'size']
+
+        offsets = {}
+        total = 0
+        for field_name, ctype in columns:
+            total = align_up(total, ffi.alignof(ctype.item))
+            offsets[field_name] = total
+            total += ffi.sizeof(ctype.item) * size
+
+        self._data = ffi.new("char[]", max(total, 1))
+        self._columns = {}
+        for field_name, ctype in columns:
+            column = ffi.cast(ctype, self._data + offsets[field_name])
+            setattr(self._cffi, field_name, column)
+            self._columns[field_name] = column
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def size(self):
+        return self._cffi.size
+
+    def column(self, name):
+        column = self._columns[name]
+
+        return self.ffi.buffer(
+            column, self.ffi.sizeof(self.ffi.typeof(column).item) * self.size)
+
+    @property
+    def buffer(self):
+        return self.ffi.buffer(self._data)
+
+    @property
+    def cffi(self):
+        return self._cffi
+
+
+# a shared library built from a context, code(name) is the address of an
+# exported function
+class Library:
+    def __init__(self, path):
+        import ctypes
+
+        self.path = path
+        self.library = ctypes.CDLL(path)
+
+    def code(self, name):
+        import ctypes
+
+        return ctypes.cast(
+            getattr(self.library, name), ctypes.c_void_p).value
+
 
 class CompilerResult:
     def __init__(self, compiler, result):
@@ -39,23 +167,65 @@ class CompilerResult:
 
         return compiler.ffi.cast(cdef, code)
 
+    def native(self, name):
+        import ctypes
+
+        from xpython.cpy import METH_FASTCALL
+
+        class PyMethodDef(ctypes.Structure):
+            _fields_ = [
+                ('ml_name', ctypes.c_char_p),
+                ('ml_meth', ctypes.c_void_p),
+                ('ml_flags', ctypes.c_int),
+                ('ml_doc', ctypes.c_char_p)]
+
+        method_def = PyMethodDef(
+            name.encode(), self.result.code(name + '_fastcall'),
+            METH_FASTCALL, None)
+
+        # the function object points at the definition and into the
+        # library, its self keeps both alive
+        owner = (self, method_def)
+
+        # a prototype of our own, the one in pythonapi is shared
+        PyCFunction_NewEx = ctypes.PYFUNCTYPE(
+            ctypes.py_object, ctypes.c_void_p, ctypes.py_object,
+            ctypes.py_object)(('PyCFunction_NewEx', ctypes.pythonapi))
+
+        return PyCFunction_NewEx(ctypes.addressof(method_def), owner, None)
+
+    def check_error(self):
+        ffi = self.compiler.ffi
+
+        last_error = ffi.cast(
+            "int(*)(xpython_error*)", self.result.code('xpython_last_error'))
+        state = ffi.new("xpython_error*")
+
+        if last_error(state):
+            raise errors.exception(ffi, state)
+
     def cffi_wrapper(self, name):
         def make_param(name, typ):
-            if isinstance(typ, Buffer):
+            if typ.cffi_handle:
                 return name + '.cffi'
 
             return name
 
-        wrapper = "def wrapper_fun(cffi, ".format(name)
+        wrapper = "def wrapper_fun(cffi, check_error, ".format(name)
         compiler = self.compiler
         wrapper += ', '.join(
             'p{}'.format(i) for i, _ in enumerate(compiler.param_types))
         wrapper += '):\n'
-        wrapper += '  return cffi('
+        wrapper += '  result = cffi('
         wrapper += ', '.join(
             make_param('p{}'.format(i), t)
             for i, t in enumerate(compiler.param_types))
-        wrapper += ')'
+        wrapper += ')\n'
+        if compiler.raises:
+            # failed checks return the default value of the return type
+            wrapper += '  if not result:\n'
+            wrapper += '    check_error()\n'
+        wrapper += '  return result'
 
         print(wrapper)
 
@@ -63,4 +233,15 @@ class CompilerResult:
 
         import functools
 
-        return functools.partial(locals()['wrapper_fun'], self.cffi(name))
+        wrapper = functools.partial(
+            locals()['wrapper_fun'], self.cffi(name), self.check_error)
+        # cffi drops the GIL around the call, nothing in it may need it
+        wrapper.nogil = compiler.nogil
+
+        return wrapper
+
+
+async def compile_async(source, new_context, ffi, pool=None):
+    from xpython import aio
+
+    return await aio.compile_async(source, new_context, ffi, pool)
@@ -0,0 +1,166 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import atexit
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+from xpython import CompilerResult, Library
+from xpython.backends import DYNAMIC_LIBRARY
+from xpython.code import from_string, register_source
+from xpython.types import Types, declared, cdef
+
+
+# where compiled libraries go, None uses a temporary directory removed at
+# exit
+LIBRARY_DIRECTORY = None
+
+executor = None
+pending = {}
+
+temporary_directory = None
+temporary_lock = threading.Lock()
+
+
+class TypeSignature:
+    def __init__(self, typ):
+        self.cname = typ.cname
+        self.cffi_handle = typ.cffi_handle
+
+
+# the parts of a FunctionCompiler a CompilerResult needs, picklable
+class FunctionSignature:
+    def __init__(self, compiler):
+        self.name = compiler.name
+        self.ret_type = TypeSignature(compiler.ret_type)
+        self.param_types = [TypeSignature(t) for t in compiler.param_types]
+        self.raises = compiler.raises
+        self.nogil = compiler.nogil
+        self.ffi = None
+
+
+def compile_library(new_context, source, path):
+    # runs in a worker process
+    from xpython.compiler.namespace import NamespaceCompiler
+    import cffi
+
+    context = new_context()
+    ffi = cffi.FFI()
+    code = from_string(source)
+
+    compiler = NamespaceCompiler(
+        context, ffi, Types(context, ffi), code.code)
+    compiler.emit_functions()
+
+    # renamed into place, a loader never sees half a library
+    directory, name = os.path.split(path)
+    fd, partial = tempfile.mkstemp(dir=directory, prefix=name + '.')
+    os.close(fd)
+    try:
+        context.compile_to_file(DYNAMIC_LIBRARY, partial)
+        os.replace(partial, path)
+    except BaseException:
+        os.unlink(partial)
+        raise
+
+    signatures = OrderedDict(
+        (name, FunctionSignature(function))
+        for name, function in compiler.functions.items())
+
+    return signatures, list(declared.get(ffi, {}).items())
+
+
+def get_directory():
+    global temporary_directory
+
+    if LIBRARY_DIRECTORY is not None:
+        return LIBRARY_DIRECTORY
+
+    with temporary_lock:
+        if temporary_directory is None:
+            # loaded libraries stay mapped once their files are removed
+            temporary_directory = tempfile.mkdtemp(prefix='xpython_aio_')
+            atexit.register(shutil.rmtree, temporary_directory, True)
+
+    return temporary_directory
+
+
+def get_executor():
+    global executor
+
+    if executor is None:
+        executor = ProcessPoolExecutor()
+
+    return executor
+
+
+def load(ffi, source, path, signatures, cdefs):
+    # error locations point into the source
+    register_source(source)
+
+    for name, template in cdefs:
+        cdef(ffi, name, template)
+
+    library = Library(path)
+    results = OrderedDict()
+    for name, signature in signatures.items():
+        signature.ffi = ffi
+        results[name] = CompilerResult(signature, library)
+
+    return results
+
+
+async def compile_library_async(loop, key, new_context, source, pool):
+    # a name of its own, factories with the same name can share a key
+    fd, path = tempfile.mkstemp(
+        dir=get_directory(), prefix='xpython_{}_'.format(key), suffix='.so')
+    os.close(fd)
+
+    return path, await loop.run_in_executor(
+        pool, compile_library, new_context, source, path)
+
+
+async def compile_async(source, new_context, ffi, pool=None):
+    # concurrent requests for the same source share one compile, the
+    # compile is cancelled when every caller waiting on it is
+    loop = asyncio.get_running_loop()
+    pool = pool or get_executor()
+
+    # requests share a compile when they pass the same factory, its name
+    # alone could be a lambda or a method of another module
+    name = '{}.{}'.format(
+        getattr(new_context, '__module__', None),
+        getattr(new_context, '__qualname__', repr(new_context)))
+    key = hashlib.sha1(
+        '{}\0{}'.format(name, source).encode('utf-8')).hexdigest()
+    request = loop, new_context, key
+
+    if request not in pending:
+        task = loop.create_task(
+            compile_library_async(loop, key, new_context, source, pool))
+        pending[request] = [task, 0]
+
+        def done(task):
+            if pending.get(request, [None])[0] is task:
+                del pending[request]
+
+        task.add_done_callback(done)
+
+    entry = pending[request]
+    task = entry[0]
+    entry[1] += 1
+
+    try:
+        path, (signatures, cdefs) = await asyncio.shield(task)
+    except asyncio.CancelledError:
+        entry[1] -= 1
+        if entry[1] == 0:
+            task.cancel()
+        raise
+
+    entry[1] -= 1
+
+    return load(ffi, source, path, signatures, cdefs)
@@ -0,0 +1,37 @@
+# everything the compilers ask of a context, types.py, function.py and
+# functions.py use nothing else
+CONTEXT_METHODS = (
+    # types
+    'type', 'pointer_type', 'array_type', 'struct_type', 'field',
+
+    # declarations
+    'param', 'local', 'exported_function', 'internal_function',
+    'imported_function', 'builtin_function', 'exported_global',
+    'internal_global', 'imported_global', 'thread_local_global',
+    'set_initializer',
+
+    # expressions
+    'integer', 'null', 'string_literal', 'cast', 'comparison', 'binary',
+    'unary', 'call', 'address', 'function_address', 'dereference',
+    'dereference_field', 'access_field', 'access_field_lvalue',
+    'array_access',
+
+    # code
+    'block', 'location', 'new_child_context', 'reset', 'compile',
+    'compile_to_file'
+)
+
+# what compile_to_file(output_kind, path) writes, libgccjit's values
+ASSEMBLER, OBJECT_FILE, DYNAMIC_LIBRARY, EXECUTABLE = range(4)
+
+BLOCK_METHODS = (
+    'add_assignment', 'add_eval', 'end_with_jump', 'end_with_conditonal',
+    'end_with_return', 'end_with_void_return'
+)
+
+
+# a backend is any context with all of CONTEXT_METHODS and blocks with all
+# of BLOCK_METHODS, csource and ir are the ones checked against it, a
+# libgccjit context would need an adapter
+def missing(context):
+    return [name for name in CONTEXT_METHODS if not hasattr(context, name)]
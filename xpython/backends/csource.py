@@ -0,0 +1,573 @@
+import atexit
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from xpython import Library
+from xpython.backends import ASSEMBLER, OBJECT_FILE, DYNAMIC_LIBRARY, \
+    EXECUTABLE
+
+
+# the system compiler, -fwrapv makes arithmetic on promoted narrow types
+# wrap like the jit's does instead of being undefined, -Bsymbolic binds
+# calls between our own functions to our own definitions, not to a symbol
+# of the same name already loaded in the process (libm's remainder)
+CC = os.environ.get('CC', 'cc')
+CFLAGS = ['-O2', '-fPIC', '-fwrapv', '-Wl,-Bsymbolic']
+
+# sources and libraries are kept here keyed by a hash of what built them,
+# None uses one temporary directory that goes away with the process
+CACHE_DIRECTORY = None
+
+temporary_directory = None
+temporary_lock = threading.Lock()
+
+HEADER = '''\
+#include <stddef.h>
+#include <stdint.h>
+#include <sys/types.h>
+'''
+
+KEYWORDS = frozenset('''
+    auto break case char const continue default do double else enum extern
+    float for goto if inline int long register restrict return short signed
+    sizeof static struct switch typedef union unsigned void volatile while
+'''.split())
+
+INT64_MAX = 2 ** 63 - 1
+
+# what replaces -shared for each output kind
+OUTPUT_FLAGS = {
+    ASSEMBLER: ['-S'], OBJECT_FILE: ['-c'], DYNAMIC_LIBRARY: ['-shared'],
+    EXECUTABLE: []
+}
+
+
+def get_directory():
+    global temporary_directory
+
+    if CACHE_DIRECTORY is not None:
+        return CACHE_DIRECTORY
+
+    with temporary_lock:
+        if temporary_directory is None:
+            # loaded libraries stay mapped once their files are removed
+            temporary_directory = tempfile.mkdtemp(prefix='xpython_')
+            atexit.register(shutil.rmtree, temporary_directory, True)
+
+    return temporary_directory
+
+
+def identifier(name):
+    name = re.sub(r'\W', '_', name)
+    if not name or name[0].isdigit():
+        name = '_' + name
+
+    return name
+
+
+def literal(value):
+    # the type comes from a cast around it, the suffix only keeps the
+    # literal itself in range
+    if value == -INT64_MAX - 1:
+        return '(-{}LL - 1)'.format(INT64_MAX)
+    if value < 0:
+        return '(-{}LL)'.format(-value)
+    if value > INT64_MAX:
+        return '{}ULL'.format(value)
+
+    return '{}LL'.format(value)
+
+
+def quote(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+
+    out = []
+    for byte in data:
+        char = chr(byte)
+        if 32 <= byte < 127 and char not in '"\\?':
+            out.append(char)
+        else:
+            out.append('\\{:03o}'.format(byte))
+
+    return '"{}"'.format(''.join(out))
+
+
+class CType:
+    def __str__(self):
+        return self.declare('').strip()
+
+
+class Named(CType):
+    def __init__(self, name):
+        self.name = name
+
+    def declare(self, ident):
+        return '{} {}'.format(self.name, ident)
+
+
+class Pointer(CType):
+    def __init__(self, target):
+        self.target = target
+
+    def declare(self, ident):
+        if isinstance(self.target, Array):
+            return self.target.declare('(*{})'.format(ident))
+
+        return self.target.declare('*' + ident)
+
+
+class Array(CType):
+    def __init__(self, item, length):
+        self.item = item
+        self.target = item
+        self.length = length
+
+    def declare(self, ident):
+        return self.item.declare('{}[{}]'.format(ident, self.length))
+
+
+class Struct(CType):
+    def __init__(self, tag, fields):
+        self.tag = tag
+        self.fields = fields
+
+    def declare(self, ident):
+        return 'struct {} {}'.format(self.tag, ident)
+
+    def definition(self):
+        lines = ['struct {} {{'.format(self.tag)]
+        for field in self.fields:
+            lines.append('    {};'.format(field.ctype.declare(field.name)))
+        lines.append('};')
+
+        return '\n'.join(lines)
+
+
+class Field:
+    def __init__(self, ctype, name):
+        self.ctype = ctype
+        self.name = name
+
+
+class Location:
+    def __init__(self, filename, line, column):
+        self.filename = filename
+        self.line = line
+        self.column = column
+
+    def directive(self):
+        return '#line {} {}'.format(max(self.line, 1), quote(self.filename))
+
+
+class Expression:
+    def __init__(self, text, ctype=None):
+        self.text = text
+        self.ctype = ctype
+
+    def __str__(self):
+        return self.text
+
+
+class Variable(Expression):
+    def __init__(self, kind, text, ctype, name):
+        super().__init__(text, ctype)
+        self.kind = kind
+        self.name = name
+        self.initializer = None
+
+    def definition(self):
+        if self.kind == 'internal':
+            # the bytes member takes the initializer whatever the type is
+            ctype = self.ctype.declare('value')
+            text = 'static union {{ {}; unsigned char bytes[sizeof({})]; }} {}'
+            text = text.format(ctype, self.ctype, self.name)
+            if self.initializer is not None:
+                text += ' = {{ .bytes = {{ {} }} }}'.format(
+                    ', '.join(str(b) for b in self.initializer))
+
+            return text + ';'
+
+        storage = {
+            'exported': '', 'imported': 'extern ',
+            'thread_local': 'static _Thread_local '}[self.kind]
+
+        return storage + self.ctype.declare(self.name) + ';'
+
+
+class Function:
+    def __init__(self, kind, ret, name, params, location=None):
+        self.kind = kind
+        self.ret = ret
+        self.name = name
+        self.params = params
+        self.location = location
+        self.blocks = []
+        self.locals = []
+
+    def prototype(self):
+        if self.kind == 'imported':
+            params = [
+                '...' if p is Ellipsis else str(p) for p in self.params]
+        else:
+            params = [p.ctype.declare(p.text).strip() for p in self.params]
+
+        storage = {'exported': '', 'internal': 'static ',
+                   'imported': 'extern '}[self.kind]
+
+        return storage + self.ret.declare('{}({})'.format(
+            self.name, ', '.join(params) or 'void')).strip()
+
+    def definition(self):
+        lines = [self.prototype() + ' {']
+        for local in self.locals:
+            lines.append('    {};'.format(local.ctype.declare(local.text)))
+
+        for block in self.blocks:
+            lines.append('{}: ;{}'.format(block.label(), block.comment()))
+            lines.extend(block.lines)
+            if not block.terminated:
+                lines.append('    __builtin_unreachable();')
+
+        lines.append('}')
+
+        return '\n'.join(lines)
+
+
+class Block:
+    def __init__(self, function, name):
+        self.function = function
+        self.name = name
+        self.lines = []
+        self.terminated = False
+
+    def label(self):
+        return 'L{}'.format(self.function.blocks.index(self))
+
+    def comment(self):
+        if self.name is None:
+            return ''
+
+        return ' /* {} */'.format(self.name.replace('*/', '* /'))
+
+    def add(self, line, location=None):
+        assert not self.terminated, "Block {} already ended".format(
+            self.label())
+
+        if location is not None:
+            self.lines.append(location.directive())
+        self.lines.append('    ' + line)
+
+    def add_assignment(self, lvalue, rvalue, location=None):
+        self.add('{} = {};'.format(lvalue, rvalue), location)
+
+    def add_eval(self, value, location=None):
+        self.add('(void){};'.format(value), location)
+
+    def end_with_jump(self, target, location=None):
+        self.add('goto {};'.format(target.label()), location)
+        self.terminated = True
+
+    def end_with_conditonal(self, condition, true, false, location=None):
+        self.add('if ({}) goto {}; else goto {};'.format(
+            condition, true.label(), false.label()), location)
+        self.terminated = True
+
+    def end_with_return(self, value, location=None):
+        self.add('return {};'.format(value), location)
+        self.terminated = True
+
+    def end_with_void_return(self, location=None):
+        self.add('return;', location)
+        self.terminated = True
+
+
+class Result(Library):
+    def __init__(self, path, source):
+        super().__init__(path)
+        self.source = source
+
+
+# writes the code as one C translation unit and builds it with the system
+# compiler, the output is plain text so it can be read, diffed and cached,
+# flags and sources are added to the command, -flto with our own C lets
+# calls into it inline
+class Context:
+    def __init__(self, parent=None, flags=(), sources=()):
+        self.parent = parent
+        self.flags = list(flags)
+        self.sources = list(sources)
+
+        self.structs = []
+        self.globals = []
+        self.functions = []
+
+        if parent is None:
+            self.named = {}
+            self.identifiers = set(KEYWORDS)
+        else:
+            self.named = parent.named
+            self.identifiers = set(parent.identifiers)
+
+    def unique(self, name):
+        base = ident = identifier(name)
+        count = 0
+        while ident in self.identifiers:
+            count += 1
+            ident = '{}_{}'.format(base, count)
+        self.identifiers.add(ident)
+
+        return ident
+
+    def as_type(self, ctype):
+        if isinstance(ctype, str):
+            return self.type(ctype)
+
+        return ctype
+
+    def type(self, cname):
+        if cname not in self.named:
+            self.named[cname] = Named(cname)
+
+        return self.named[cname]
+
+    def pointer_type(self, ctype):
+        return Pointer(self.as_type(ctype))
+
+    def array_type(self, ctype, length):
+        return Array(self.as_type(ctype), length)
+
+    def struct_type(self, name, fields):
+        struct = Struct(self.unique(name), list(fields))
+        self.structs.append(struct)
+
+        return struct
+
+    def field(self, ctype, name):
+        return Field(self.as_type(ctype), name)
+
+    def param(self, ctype, name):
+        return Expression(self.unique(name), self.as_type(ctype))
+
+    def local(self, function, ctype, name):
+        local = Expression(self.unique(name), self.as_type(ctype))
+        function.locals.append(local)
+
+        return local
+
+    def function(self, kind, ret, name, params, location=None):
+        # linked by name, so the name is kept as it is
+        self.identifiers.add(name)
+        function = Function(kind, self.as_type(ret), name, params, location)
+        self.functions.append(function)
+
+        return function
+
+    def exported_function(self, ret, name, params, location=None):
+        return self.function('exported', ret, name, list(params), location)
+
+    def internal_function(self, ret, name, params, location=None):
+        return self.function('internal', ret, name, list(params), location)
+
+    def imported_function(self, ret, name, param_types):
+        return self.function('imported', ret, name, [
+            p if p is Ellipsis else self.as_type(p) for p in param_types])
+
+    def builtin_function(self, name):
+        return Function('builtin', None, name, [])
+
+    def variable(self, kind, ctype, name):
+        self.identifiers.add(name)
+        ctype = self.as_type(ctype)
+        text = name + '.value' if kind == 'internal' else name
+        variable = Variable(kind, text, ctype, name)
+        self.globals.append(variable)
+
+        return variable
+
+    def exported_global(self, ctype, name, location=None):
+        return self.variable('exported', ctype, name)
+
+    def internal_global(self, ctype, name, location=None):
+        return self.variable('internal', ctype, name)
+
+    def imported_global(self, ctype, name):
+        return self.variable('imported', ctype, name)
+
+    def thread_local_global(self, ctype, name, location=None):
+        return self.variable('thread_local', ctype, name)
+
+    def set_initializer(self, lvalue, blob):
+        assert lvalue.kind == 'internal', \
+            "Only internal globals take an initializer"
+        lvalue.initializer = bytes(blob)
+
+    def integer(self, value, ctype=None):
+        ctype = self.as_type(ctype or 'int')
+
+        return Expression('(({}){})'.format(ctype, literal(value)), ctype)
+
+    def null(self, ctype):
+        ctype = self.as_type(ctype)
+
+        return Expression('(({})0)'.format(ctype), ctype)
+
+    def string_literal(self, value):
+        return Expression(quote(value), self.type('const char*'))
+
+    def cast(self, value, ctype):
+        ctype = self.as_type(ctype)
+
+        return Expression('(({}){})'.format(ctype, value), ctype)
+
+    def comparison(self, op, a, b):
+        return Expression('({} {} {})'.format(a, op, b), self.type('int'))
+
+    def binary(self, op, ctype, a, b):
+        # C promotes narrow operands, the cast brings the result back
+        ctype = self.as_type(ctype)
+
+        return Expression('(({})({} {} {}))'.format(ctype, a, op, b), ctype)
+
+    def unary(self, op, ctype, a):
+        ctype = self.as_type(ctype)
+
+        return Expression('(({})({}{}))'.format(ctype, op, a), ctype)
+
+    def call(self, function, args=()):
+        return Expression('{}({})'.format(
+            function.name, ', '.join(str(a) for a in args)), function.ret)
+
+    def address(self, lvalue):
+        return Expression('(&{})'.format(lvalue), Pointer(lvalue.ctype))
+
+    def function_address(self, function):
+        return Expression('(&{})'.format(function.name), self.type('void*'))
+
+    def dereference(self, pointer):
+        return Expression(
+            '(*{})'.format(pointer), getattr(pointer.ctype, 'target', None))
+
+    def field_access(self, text, value, field):
+        return Expression(text.format(value, field.name), field.ctype)
+
+    def dereference_field(self, pointer, field):
+        return self.field_access('({}->{})', pointer, field)
+
+    def access_field(self, value, field):
+        return self.field_access('({}.{})', value, field)
+
+    def access_field_lvalue(self, lvalue, field):
+        return self.field_access('({}.{})', lvalue, field)
+
+    def array_access(self, pointer, index):
+        return Expression(
+            '({}[{}])'.format(pointer, index),
+            getattr(pointer.ctype, 'target', None))
+
+    def block(self, function, name=None):
+        block = Block(function, name)
+        function.blocks.append(block)
+
+        return block
+
+    def location(self, filename, line, column):
+        return Location(filename, line, column)
+
+    def new_child_context(self):
+        return Context(self, self.flags, self.sources)
+
+    def reset(self):
+        # empty again, as new_child_context gave it, for the next compile
+        self.structs = []
+        self.globals = []
+        self.functions = []
+
+        if self.parent is None:
+            self.identifiers = set(KEYWORDS)
+        else:
+            self.identifiers = set(self.parent.identifiers)
+
+    def chain(self):
+        contexts = []
+        context = self
+        while context is not None:
+            contexts.insert(0, context)
+            context = context.parent
+
+        return contexts
+
+    def source(self):
+        # a child's unit repeats its parents, like a jit child context does
+        contexts = self.chain()
+        structs = [s for c in contexts for s in c.structs]
+        globals_ = [g for c in contexts for g in c.globals]
+        functions = [f for c in contexts for f in c.functions]
+
+        parts = [HEADER]
+        parts.extend('struct {};'.format(s.tag) for s in structs)
+        parts.extend(s.definition() for s in structs)
+        parts.extend(g.definition() for g in globals_)
+        parts.extend(f.prototype() + ';' for f in functions)
+        parts.extend(
+            f.definition() for f in functions if f.kind != 'imported')
+
+        return '\n'.join(parts) + '\n'
+
+    def command(self, source_path, path, output_kind=DYNAMIC_LIBRARY):
+        return [CC] + CFLAGS + OUTPUT_FLAGS[output_kind] + self.flags + \
+            ['-o', path, source_path] + self.sources
+
+    def key(self, source):
+        digest = hashlib.sha1(source.encode('utf-8'))
+        digest.update(' '.join(self.command('', '')).encode('utf-8'))
+        for path in self.sources:
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+
+        return digest.hexdigest()
+
+    def build(self, source, path, output_kind=DYNAMIC_LIBRARY):
+        # written next to the library under a temporary name and renamed,
+        # concurrent builds of the same key never see half a file
+        directory = os.path.dirname(os.path.abspath(path))
+        source_path = os.path.splitext(path)[0] + '.c'
+
+        fd, partial = tempfile.mkstemp(dir=directory, suffix='.c')
+        with os.fdopen(fd, 'w') as f:
+            f.write(source)
+        os.replace(partial, source_path)
+
+        fd, partial = tempfile.mkstemp(dir=directory, suffix='.out')
+        os.close(fd)
+
+        command = self.command(source_path, partial, output_kind)
+        process = subprocess.run(
+            command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True)
+        if process.returncode != 0:
+            os.unlink(partial)
+        assert process.returncode == 0, "{} failed:\n{}".format(
+            ' '.join(command), process.stdout)
+
+        os.replace(partial, path)
+
+    def compile(self):
+        source = self.source()
+        path = os.path.join(
+            get_directory(), 'xpython_{}.so'.format(self.key(source)))
+
+        if not os.path.exists(path):
+            self.build(source, path)
+
+        return Result(path, source)
+
+    def compile_to_file(self, output_kind, path):
+        assert output_kind in OUTPUT_FLAGS, \
+            "Unknown output kind {}".format(output_kind)
+        self.build(self.source(), path, output_kind)
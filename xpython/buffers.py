@@ -0,0 +1,280 @@
+from contextlib import contextmanager
+import bisect
+import mmap
+import os
+import threading
+
+from xpython import CffiBufferView
+
+
+ADVICE = {
+    'normal': getattr(mmap, 'MADV_NORMAL', None),
+    'sequential': getattr(mmap, 'MADV_SEQUENTIAL', None),
+    'random': getattr(mmap, 'MADV_RANDOM', None),
+    'willneed': getattr(mmap, 'MADV_WILLNEED', None),
+    'dontneed': getattr(mmap, 'MADV_DONTNEED', None),
+    'hugepage': getattr(mmap, 'MADV_HUGEPAGE', None),
+}
+
+# the size field of buffer is an int
+MAX_BUFFER_SIZE = 2 ** 31 - 1
+
+
+# a buffer struct over a mapped file, kernels read the page cache directly
+class MappedBuffer:
+    def __init__(self, ffi, file, writable=False, advice=('sequential',),
+                 huge_pages=False, offset=0, length=0):
+        self.ffi = ffi
+        self.writable = writable
+
+        if isinstance(file, (str, bytes, os.PathLike)):
+            fd = os.open(file, os.O_RDWR if writable else os.O_RDONLY)
+            try:
+                self.map = self._map(fd, offset, length)
+            finally:
+                os.close(fd)
+        else:
+            self.map = self._map(file.fileno(), offset, length)
+
+        self.length = len(self.map)
+        self.base = ffi.from_buffer(self.map, require_writable=writable)
+        self._cffi = None
+
+        for name in advice:
+            self.advise(name)
+        if huge_pages:
+            self.advise('hugepage')
+
+    def _map(self, fileno, offset, length):
+        access = mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ
+
+        return mmap.mmap(fileno, length, access=access, offset=offset)
+
+    def advise(self, name, start=0, stop=None):
+        if ADVICE[name] is None or not hasattr(self.map, 'madvise'):
+            # not available on this platform, advice is only a hint
+            return
+
+        start, length = self._page_range(start, stop)
+        if length:
+            self.map.madvise(ADVICE[name], start, length)
+
+    def prefetch(self, start, stop):
+        self.advise('willneed', start, stop)
+
+    def _page_range(self, start, stop):
+        if stop is None:
+            stop = self.length
+        assert 0 <= start <= stop <= self.length, \
+            "Range {}:{} out of bounds".format(start, stop)
+
+        # madvise wants page aligned starts
+        aligned = start - start % mmap.PAGESIZE
+
+        return aligned, stop - aligned
+
+    @property
+    def size(self):
+        return self.length
+
+    @property
+    def data(self):
+        return self.map[:]
+
+    @property
+    def cffi(self):
+        if self._cffi is None:
+            assert self.length <= MAX_BUFFER_SIZE, \
+                "Mapping too large for one buffer, use views"
+            self._cffi = self.ffi.new("buffer*")
+            self._cffi.size = self.length
+            self._cffi.data = self.base
+
+        return self._cffi
+
+    def view(self, start, stop):
+        assert stop - start <= MAX_BUFFER_SIZE, \
+            "View too large for one buffer"
+
+        return CffiBufferView(self, start, stop)
+
+    def flush(self):
+        if self.writable:
+            self.map.flush()
+
+    def close(self):
+        if self.map is None:
+            return
+
+        # views and the buffer struct must not outlive the mapping
+        self._cffi = None
+        self.ffi.release(self.base)
+        self.base = None
+        self.map.close()
+        self.map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# capacities handed out by a BufferPool, larger requests get their own
+SIZE_CLASSES = tuple(1 << shift for shift in range(8, 25, 2))
+
+
+# a preallocated buffer struct, reused through its pool
+class PooledBuffer:
+    def __init__(self, ffi, capacity):
+        self._data = ffi.new("char[]", capacity)
+        self._cffi = ffi.new("buffer*")
+        self._cffi.data = self._data
+        self._cffi.size = 0
+        self.capacity = capacity
+        self.ffi = ffi
+        self.pool = None
+        # set while the buffer is the pool's, a second release is a bug
+        self.released = False
+
+    @property
+    def base(self):
+        return self._data
+
+    @property
+    def data(self):
+        return self.ffi.unpack(self._data, self.size)
+
+    @property
+    def size(self):
+        return self._cffi.size
+
+    @size.setter
+    def size(self, size):
+        assert 0 <= size <= self.capacity, \
+            "Size {} over capacity {}".format(size, self.capacity)
+        self._cffi.size = size
+
+    @property
+    def cffi(self):
+        return self._cffi
+
+    def view(self, start, stop):
+        return CffiBufferView(self, start, stop)
+
+    def fill(self, data):
+        self.size = len(data)
+        self.ffi.memmove(self._data, data, len(data))
+
+    def reset(self):
+        self._cffi.size = 0
+
+    def release(self):
+        if self.pool is not None:
+            self.pool.release(self)
+
+
+class BufferPool:
+    def __init__(self, ffi, size_classes=SIZE_CLASSES, max_free=64):
+        self.ffi = ffi
+        self.size_classes = sorted(size_classes)
+        self.max_free = max_free
+        self.free = {capacity: [] for capacity in self.size_classes}
+        self.lock = threading.Lock()
+        self.allocated = 0
+
+    def size_class(self, size):
+        index = bisect.bisect_left(self.size_classes, size)
+        if index == len(self.size_classes):
+            return None
+
+        return self.size_classes[index]
+
+    def acquire(self, size=0, data=None):
+        if data is not None:
+            size = len(data)
+
+        capacity = self.size_class(size)
+        buffer = None
+
+        if capacity is not None:
+            with self.lock:
+                free = self.free[capacity]
+                if free:
+                    buffer = free.pop()
+                    buffer.released = False
+
+        if buffer is None:
+            with self.lock:
+                self.allocated += 1
+            buffer = PooledBuffer(self.ffi, capacity or max(size, 1))
+            buffer.pool = self if capacity is not None else None
+
+        if data is not None:
+            buffer.fill(data)
+        else:
+            buffer.size = size
+
+        return buffer
+
+    def release(self, buffer):
+        assert buffer.pool is self, "Buffer belongs to another pool"
+
+        with self.lock:
+            assert not buffer.released, "Buffer released twice"
+            buffer.released = True
+            buffer.reset()
+
+            free = self.free[buffer.capacity]
+            if len(free) < self.max_free:
+                free.append(buffer)
+
+    @contextmanager
+    def buffer(self, size=0, data=None):
+        buffer = self.acquire(size, data)
+        try:
+            yield buffer
+        finally:
+            buffer.release()
+
+    def arena(self):
+        return BufferArena(self)
+
+
+# gives every buffer taken from it back to the pool when it closes
+class BufferArena:
+    def __init__(self, pool):
+        self.pool = pool
+        self.buffers = []
+
+    def acquire(self, size=0, data=None):
+        buffer = self.pool.acquire(size, data)
+        self.buffers.append(buffer)
+
+        return buffer
+
+    def reset(self):
+        for buffer in self.buffers:
+            buffer.release()
+        self.buffers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.reset()
+
+
+local = threading.local()
+
+
+def thread_pool(ffi):
+    # pools are per thread and ffi, their free lists are never contended
+    pools = getattr(local, 'pools', None)
+    if pools is None:
+        pools = local.pools = {}
+
+    if ffi not in pools:
+        pools[ffi] = BufferPool(ffi)
+
+    return pools[ffi]
@@ -17,6 +17,26 @@ class CFunctions:
     def printf(self):
         return self.get_function('int', 'printf', ['const char*', ...])
 
+    @property
+    def memmove(self):
+        return self.get_function(
+            'void*', 'memmove', ['void*', 'void*', 'unsigned long'])
+
+    @property
+    def memset(self):
+        return self.get_function(
+            'void*', 'memset', ['void*', 'int', 'unsigned long'])
+
+    @property
+    def memchr(self):
+        return self.get_function(
+            'void*', 'memchr', ['void*', 'int', 'unsigned long'])
+
+    @property
+    def memcmp(self):
+        return self.get_function(
+            'int', 'memcmp', ['void*', 'void*', 'unsigned long'])
+
     def get_function(self, ret_type, name, param_types):
         if name in self.cache:
             return self.cache[name]
@@ -0,0 +1,118 @@
+from xpython.cpy import PyObject
+
+
+# CPython C-API functions, name: (return type, parameter types)
+FUNCTIONS = {
+    # objects
+    'Py_IncRef': ('void', ['void*']),
+    'Py_DecRef': ('void', ['void*']),
+    'PyType_IsSubtype': ('int', ['void*', 'void*']),
+    'PyType_Ready': ('int', ['void*']),
+    'PyType_GenericNew': ('void*', ['void*', 'void*', 'void*']),
+
+    # modules
+    'PyModule_Create2': ('void*', ['void*', 'int']),
+    'PyModule_AddObject': ('int', ['void*', 'const char*', 'void*']),
+
+    # ints
+    'PyLong_AsLong': ('long', ['void*']),
+    'PyLong_FromLong': ('void*', ['long']),
+    'PyLong_AsSsize_t': ('ssize_t', ['void*']),
+    'PyLong_FromSsize_t': ('void*', ['ssize_t']),
+    'PyLong_AsSize_t': ('size_t', ['void*']),
+    'PyLong_FromSize_t': ('void*', ['size_t']),
+    'PyLong_AsUnsignedLong': ('unsigned long', ['void*']),
+    'PyLong_FromUnsignedLong': ('void*', ['unsigned long']),
+
+    # bytes
+    'PyBytes_FromStringAndSize': ('void*', ['const char*', 'ssize_t']),
+    'PyBytes_AsString': ('char*', ['void*']),
+    'PyBytes_Size': ('ssize_t', ['void*']),
+
+    # buffer protocol
+    'PyObject_GetBuffer': ('int', ['void*', 'void*', 'int']),
+    'PyBuffer_Release': ('void', ['void*']),
+
+    # tuples
+    'PyTuple_Size': ('ssize_t', ['void*']),
+    'PyTuple_GetItem': ('void*', ['void*', 'ssize_t']),
+
+    # threads
+    'PyEval_SaveThread': ('void*', []),
+    'PyEval_RestoreThread': ('void', ['void*']),
+
+    # errors
+    'PyErr_Occurred': ('void*', []),
+    'PyErr_Clear': ('void', []),
+    'PyErr_ExceptionMatches': ('int', ['void*']),
+    'PyErr_SetString': ('void', ['void*', 'const char*']),
+    'PyErr_Format': ('void*', ['void*', 'const char*', ...]),
+    'PyErr_NoMemory': ('void*', []),
+}
+
+
+# CPython C-API data, name: type, PyObject stands for the object struct
+GLOBALS = {
+    'PyExc_TypeError': 'void*',
+    'PyExc_ValueError': 'void*',
+    'PyExc_OverflowError': 'void*',
+    'PyExc_IndexError': 'void*',
+    'PyExc_ZeroDivisionError': 'void*',
+    'PyExc_RuntimeError': 'void*',
+    'PyExc_MemoryError': 'void*',
+
+    '_Py_NoneStruct': PyObject,
+    '_Py_NotImplementedStruct': PyObject,
+}
+
+
+# C-API symbols declared once per context, calls bind directly to the
+# symbols exported by the interpreter
+class CAPI:
+    def __init__(self, types):
+        self.types = types
+        self.context = types.context
+        self.functions = {}
+        self.globals = {}
+
+    def child(self, types):
+        # declarations of the parent context are visible in its children
+        capi = CAPI(types)
+        capi.functions.update(self.functions)
+        capi.globals.update(self.globals)
+
+        return capi
+
+    def function(self, name):
+        if name not in self.functions:
+            ret_type, param_types = FUNCTIONS[name]
+            self.functions[name] = self.context.imported_function(
+                ret_type, name, param_types)
+
+        return self.functions[name]
+
+    def call(self, name, *args):
+        return self.context.call(self.function(name), list(args))
+
+    def address(self, name):
+        context = self.context
+
+        return context.cast(
+            context.function_address(self.function(name)),
+            self.types.opaque.ctype)
+
+    def get_global(self, name):
+        if name not in self.globals:
+            typ = GLOBALS[name]
+            if typ is PyObject:
+                typ = self.types.get_type(PyObject).value.ctype
+
+            self.globals[name] = self.context.imported_global(typ, name)
+
+        return self.globals[name]
+
+    def incref(self, block, obj):
+        block.add_eval(self.call('Py_IncRef', obj))
+
+    def decref(self, block, obj):
+        block.add_eval(self.call('Py_DecRef', obj))
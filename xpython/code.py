@@ -1,4 +1,21 @@
-import tempfile
+from collections import OrderedDict
+import hashlib
+import linecache
+import os
+import threading
+import types
+
+
+# directory for persistent source files, keyed by source hash; None keeps
+# sources in memory only
+SOURCE_DIRECTORY = None
+
+# registered sources kept in memory, the least recently used go first and
+# their lines with them; files in SOURCE_DIRECTORY can still be read back
+MAX_SOURCES = 256
+
+sources = OrderedDict()
+sources_lock = threading.Lock()
 
 
 class Code:
@@ -6,15 +23,80 @@ class Code:
         self.code = code
 
     def first_function(self):
-        return self.code.co_consts[0]
+        for const in self.code.co_consts:
+            if isinstance(const, types.CodeType):
+                return const
+
+        assert 0, "No function in {}".format(self.code.co_filename)
+
+
+def source_hash(value):
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+
+def register_source(value, directory=None):
+    digest = source_hash(value)
+
+    if directory is None:
+        path = '<xpython-{}>'.format(digest[:16])
+    else:
+        path = os.path.join(directory, 'xpython_{}.py'.format(digest))
+        if not os.path.exists(path):
+            tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+            with open(tmp_path, 'w') as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+
+    with sources_lock:
+        sources[path] = value
+        sources.move_to_end(path)
+
+        while len(sources) > MAX_SOURCES:
+            dropped, _ = sources.popitem(last=False)
+            linecache.cache.pop(dropped, None)
+
+    install_source(path, value)
 
+    return path
 
-def from_string(value, tmp=True):
+
+def install_source(path, value):
+    # mtime None makes linecache.checkcache leave the entry alone
+    linecache.cache[path] = (
+        len(value), None, value.splitlines(True), path)
+
+
+def get_source(path):
+    with sources_lock:
+        value = sources.get(path)
+        if value is None:
+            return None
+        sources.move_to_end(path)
+
+    if path not in linecache.cache:
+        install_source(path, value)
+
+    return value
+
+
+def get_line(path, lineno):
+    get_source(path)
+
+    return linecache.getline(path, lineno)
+
+
+def from_string(value, tmp=True, directory=None):
     path = '<unknown>'
     if tmp:
-        _, path = tempfile.mkstemp('.py', 'xpython_')
-        with open(path, "w") as f:
-            f.write(value)
+        path = register_source(value, directory or SOURCE_DIRECTORY)
+
+    # the ast frontend lowers the same tree later, from its parse cache,
+    # so the source is parsed once
+    from xpython import frontend
+    if frontend.FRONTEND == 'ast':
+        from xpython.frontend.syntax import parse
+
+        value = parse(value, path)
 
     compiled = compile(value, path, 'exec')
 
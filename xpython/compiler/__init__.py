@@ -1,5 +1,4 @@
-import dis
-
+from xpython import frontend
 from xpython.nodes import Constant, Location
 
 
@@ -10,12 +9,25 @@ class AbstractCompiler:
         self.code = code
         self.stack = []
 
+    @property
+    def capi(self):
+        return self.types.capi
+
+    def instructions(self):
+        return frontend.instructions(self.code)
+
+    def reachable(self, instruction):
+        return True
+
     def emit(self):
-        for instruction in dis.get_instructions(self.code):
+        for instruction in self.instructions():
             if instruction.starts_line:
                 self.location = Location(
                     self.code.co_filename, instruction.starts_line)
 
+            if not self.reachable(instruction):
+                continue
+
             self.log()
 
             try:
@@ -1,5 +1,290 @@
+from collections import OrderedDict
+
 from xpython.compiler.namespace import NamespaceCompiler
+from xpython.compiler.function import FunctionCompiler
+from xpython.compiler.trampoline import Trampoline, fastcall
+from xpython.cpy import PyMethodDef, PyMemberDef, PyNumberMethods, \
+    PySequenceMethods, METH_FASTCALL, Py_TPFLAGS_DEFAULT
+from xpython.nodes import Function, Constant, Rvalue
 
 
 class ClassCompiler(NamespaceCompiler):
-    pass
+    def __init__(self, context, ffi, types, klass):
+        super().__init__(context, ffi, types, klass.function.code)
+
+        self.klass = klass
+        self.names['__name__'] = Constant.frompy(self, '__main__')
+
+        assert len(klass.bases) == 1, \
+            "Class {} needs a py_struct as its only base".format(klass)
+        self.struct = types.get_type(klass.bases[0])
+
+        self.methods = OrderedDict()
+
+    def compile_methods(self, names):
+        for name, item in self.names.items():
+            if not isinstance(item, Function):
+                continue
+
+            ann = item.annotations
+            compiler = FunctionCompiler(
+                self.context, self.ffi, self.types, names, item.code,
+                ann['return'], '{}_{}'.format(self.klass.qualname, name),
+                [self.klass.bases[0]] +
+                [v for k, v in ann.items() if k != 'return'])
+            compiler.setup_function()
+            compiler.setup_blocks()
+            compiler.emit()
+
+            self.methods[name] = compiler
+
+    def trampoline_name(self, name):
+        return '{}_{}_trampoline'.format(self.klass.qualname, name)
+
+    def self_value(self, trampoline):
+        return self.context.cast(trampoline.params[0], self.struct.ctype)
+
+    def arguments_check(self, trampoline, nargs, method):
+        context = self.context
+
+        expected = len(method.param_types) - 1
+        message = '{}() takes {} arguments'.format(
+            method.code.co_name, expected)
+        trampoline.raise_if(
+            context.comparison(
+                '!=', nargs, self.types.ssize.jit_constant(context, expected)),
+            'PyExc_TypeError', message.encode())
+
+    def init_trampoline(self, method):
+        context = self.context
+        types = self.types
+        opaque = types.opaque
+
+        trampoline = Trampoline(
+            self, self.trampoline_name('init'), types.int,
+            [(opaque, 'self'), (opaque, 'args'), (opaque, 'kwds')],
+            types.int.jit_constant(context, -1))
+        _, args, _ = trampoline.params
+
+        nargs = trampoline.local(types.ssize, 'nargs')
+        trampoline.block.add_assignment(
+            nargs, trampoline.capi.call('PyTuple_Size', args))
+        self.arguments_check(trampoline, nargs, method)
+
+        arguments = [self.self_value(trampoline)]
+        for i in range(1, len(method.param_types)):
+            arg = trampoline.capi.call(
+                'PyTuple_GetItem', args,
+                types.ssize.jit_constant(context, i - 1))
+            arguments.append(trampoline.unbox_argument(method, i, arg))
+
+        trampoline.call(method, arguments)
+        trampoline.finish(types.int.jit_constant(context, 0))
+
+        return trampoline.function
+
+    def binary_trampoline(self, name, method):
+        context = self.context
+        opaque = self.types.opaque
+
+        trampoline = Trampoline(
+            self, self.trampoline_name(name), opaque,
+            [(opaque, 'a'), (opaque, 'b')], context.null(opaque.ctype))
+        a, b = trampoline.params
+
+        # binary slots are called for reflected operations too
+        type_object = self.type_objects[self.struct]
+        not_implemented_block = context.block(trampoline.function)
+        ok_block = context.block(trampoline.function)
+        trampoline.block.end_with_conditonal(
+            trampoline.not_instance(a, type_object),
+            not_implemented_block, ok_block)
+
+        trampoline.block = not_implemented_block
+        trampoline.block.end_with_return(trampoline.not_implemented())
+        trampoline.block = ok_block
+
+        trampoline.type_error_not_implemented = True
+        other = trampoline.unbox_argument(method, 1, b)
+        trampoline.type_error_not_implemented = False
+
+        arguments = [self.self_value(trampoline), other]
+
+        result = trampoline.call(method, arguments)
+        trampoline.finish(method.ret_type.box(trampoline, result))
+
+        return trampoline.function
+
+    def length_trampoline(self, method):
+        context = self.context
+        types = self.types
+
+        trampoline = Trampoline(
+            self, self.trampoline_name('len'), types.ssize,
+            [(types.opaque, 'self')], types.ssize.jit_constant(context, -1))
+
+        result = trampoline.call(method, [self.self_value(trampoline)])
+        trampoline.finish(context.cast(result, types.ssize.ctype))
+
+        return trampoline.function
+
+    def item_trampoline(self, method):
+        context = self.context
+        types = self.types
+        opaque = types.opaque
+
+        trampoline = Trampoline(
+            self, self.trampoline_name('getitem'), opaque,
+            [(opaque, 'self'), (types.ssize, 'index')],
+            context.null(opaque.ctype))
+        _, index = trampoline.params
+
+        arguments = [
+            self.self_value(trampoline),
+            method.param_types[1].narrow(trampoline, index, types.ssize)]
+
+        result = trampoline.call(method, arguments)
+        trampoline.finish(method.ret_type.box(trampoline, result))
+
+        return trampoline.function
+
+    def static(self, compiler, typid, name, count=None):
+        context = self.context
+
+        value = self.types.get_type(typid).value
+        ctype = value.ctype
+        if count is not None:
+            ctype = context.array_type(ctype, count)
+
+        lvalue = context.exported_global(
+            ctype, '{}_{}'.format(self.klass.qualname, name),
+            compiler.location.tojit(context))
+
+        if count is None:
+            return Rvalue(value, name, lvalue)
+
+        return [
+            Rvalue(value, '{}[{}]'.format(name, i), context.array_access(
+                lvalue, self.types.ssize.jit_constant(context, i)))
+            for i in range(count)]
+
+    def pointer_to(self, rvalue):
+        context = self.context
+
+        return Rvalue(
+            self.types.opaque, '&' + rvalue.desc,
+            context.cast(
+                context.address(rvalue.tojit(context)),
+                self.types.opaque.ctype))
+
+    def function_pointer(self, function, name):
+        context = self.context
+
+        return Rvalue(
+            self.types.opaque, name,
+            context.cast(
+                context.function_address(function), self.types.opaque.ctype))
+
+    def export_methods(self, compiler, methods):
+        # one more zeroed entry terminates the table
+        entries = self.static(
+            compiler, PyMethodDef, 'methods', len(methods) + 1)
+
+        for entry, (name, method) in zip(entries, methods.items()):
+            typ = entry.typ
+            function = fastcall(
+                self, self.trampoline_name(name), method, method=True)
+
+            typ.store_attribute(
+                compiler, entry, 'ml_name',
+                Constant(self.types.cstr, name.encode()))
+            typ.store_attribute(
+                compiler, entry, 'ml_meth',
+                self.function_pointer(function, name))
+            typ.store_attribute(
+                compiler, entry, 'ml_flags',
+                Constant(self.types.int, METH_FASTCALL))
+
+        return entries[0]
+
+    def export_members(self, compiler):
+        fields = [
+            field for name, field in self.struct.fields.items()
+            if name != 'ob_base' and hasattr(field.typ, 'member_type')]
+
+        entries = self.static(
+            compiler, PyMemberDef, 'members', len(fields) + 1)
+
+        for entry, field in zip(entries, fields):
+            typ = entry.typ
+
+            typ.store_attribute(
+                compiler, entry, 'name',
+                Constant(self.types.cstr, field.name.encode()))
+            typ.store_attribute(
+                compiler, entry, 'type',
+                Constant(self.types.int, field.typ.member_type))
+            typ.store_attribute(
+                compiler, entry, 'offset',
+                Constant(
+                    self.types.ssize,
+                    self.struct.layout.offsets[field.name]))
+
+        return entries[0]
+
+    def export(self, compiler, type_object):
+        types = self.types
+        typ = type_object.typ
+
+        self.type_objects[self.struct] = type_object
+
+        def store(where, name, what):
+            where.typ.store_attribute(compiler, where, name, what)
+
+        ob_base = typ.load_attribute(compiler, type_object, 'ob_base')
+        ob_base = ob_base.typ.load_attribute(compiler, ob_base, 'ob_base')
+        store(ob_base, 'ob_refcnt', Constant(types.ssize, 1))
+
+        store(type_object, 'tp_name', Constant(
+            types.cstr, self.klass.qualname.encode()))
+        store(type_object, 'tp_basicsize', Constant(
+            types.ssize, self.struct.value.size()))
+        store(type_object, 'tp_flags', Constant(
+            types.unsigned, Py_TPFLAGS_DEFAULT))
+        store(type_object, 'tp_new', compiler.names['PyType_GenericNew'])
+
+        methods = OrderedDict(
+            (name, method) for name, method in self.methods.items()
+            if not name.startswith('__'))
+        store(type_object, 'tp_methods', self.pointer_to(
+            self.export_methods(compiler, methods)))
+        store(type_object, 'tp_members', self.pointer_to(
+            self.export_members(compiler)))
+
+        if '__init__' in self.methods:
+            function = self.init_trampoline(self.methods['__init__'])
+            store(type_object, 'tp_init', self.function_pointer(
+                function, '__init__'))
+
+        if '__add__' in self.methods:
+            number = self.static(compiler, PyNumberMethods, 'as_number')
+            function = self.binary_trampoline('add', self.methods['__add__'])
+            store(number, 'nb_add', self.function_pointer(
+                function, '__add__'))
+            store(type_object, 'tp_as_number', self.pointer_to(number))
+
+        if '__len__' in self.methods or '__getitem__' in self.methods:
+            sequence = self.static(
+                compiler, PySequenceMethods, 'as_sequence')
+
+            if '__len__' in self.methods:
+                function = self.length_trampoline(self.methods['__len__'])
+                store(sequence, 'sq_length', self.function_pointer(
+                    function, '__len__'))
+
+            if '__getitem__' in self.methods:
+                function = self.item_trampoline(self.methods['__getitem__'])
+                store(sequence, 'sq_item', self.function_pointer(
+                    function, '__getitem__'))
+
+            store(type_object, 'tp_as_sequence', self.pointer_to(sequence))
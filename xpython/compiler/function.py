@@ -1,12 +1,12 @@
 from collections import OrderedDict
-import dis
 
-from xpython import CompilerResult
+from xpython import CompilerResult, pgo
 from xpython.compiler import AbstractCompiler
+from xpython.frontend import JUMPS
 from xpython.c import CFunctions
-from xpython.types import Void
+from xpython.types import Void, COMPARISONS
 from xpython.nodes import Rvalue, Constant, Global, Unreachable, Local, \
-    Temporary, Param
+    Temporary, Param, Slice, Method
 
 
 block_boundaries = [
@@ -16,10 +16,16 @@ block_boundaries = [
 
 
 class FunctionCompiler(AbstractCompiler):
-    def __init__(self, context, ffi, types, names, code, ret_type, name, param_types):
+    def __init__(self, context, ffi, types, names, code, ret_type, name, param_types,
+                 nogil=False):
         self.context = context
         self.code = code
         self.name = name
+
+        # nogil functions are verified not to touch the Python C-API and run
+        # with the GIL released
+        self.nogil = nogil
+        self.uses_capi = False
         self.stack = []
         self.temporaries = 0
 
@@ -27,11 +33,20 @@ class FunctionCompiler(AbstractCompiler):
         self.types = types
         self.names = names
 
+        # values written through and what each local was assigned, the
+        # params they lead back to are unboxed writable
+        self.written = []
+        self.assigned = {}
+
         self.ret_type = self.types.get_type(ret_type)
         self.param_types = [self.types.get_type(p) for p in param_types]
 
         self.c = CFunctions(context)
 
+        self.errors = types.errors
+        self.error_exit = None
+        self.raises = False
+
     def get_print(self, params):
         formats = {'int': b'%d'}
 
@@ -61,47 +76,161 @@ class FunctionCompiler(AbstractCompiler):
         self.function = self.context.exported_function(
             self.ret_type.ctype, self.name, params, location)
 
+        # instrumented builds count every block and branch edge
+        self.counters = pgo.Counters(self) if pgo.INSTRUMENT else None
+
         # setup locals
         for i in range(code.co_argcount, code.co_nlocals):
             self.variables.append(
                 Local(self.function, None, code.co_varnames[i]))
 
     def make_block(self, instruction):
-        return self.context.block(
+        block = self.context.block(
             self.function, '{0.offset} {0.opname}'.format(instruction))
 
-    def setup_blocks(self):
-        self.block_map = OrderedDict()
-
-        instructions = OrderedDict(
-            (i.offset, i) for i in dis.get_instructions(self.code))
+        if self.counters is not None:
+            self.counters.count(block, str(instruction.offset))
 
-        block = self.make_block(instructions[0])
-        self.block_map[0] = block
-
-        for instruction in instructions.values():
-            if instruction.offset in self.block_map:
-                continue
+        return block
 
+    def setup_blocks(self):
+        instructions = list(self.instructions())
+        self.instruction_map = OrderedDict(
+            (i.offset, i) for i in instructions)
+        self.fallthrough = {
+            a.offset: b.offset for a, b in zip(instructions, instructions[1:])}
+
+        # blocks are created when something reaches them, code nothing
+        # reaches is never emitted
+        self.block_starts = set()
+        self.jump_sources = {}
+
+        for instruction in instructions:
             if instruction.is_jump_target:
-                block = self.make_block(instruction)
-                self.block_map[instruction.offset] = block
-                continue
+                self.block_starts.add(instruction.offset)
+
+            if instruction.opname in JUMPS:
+                self.jump_sources.setdefault(
+                    instruction.argval, []).append(instruction.offset)
 
             if instruction.opname in block_boundaries:
-                offset = instruction.offset + 2
                 # check if this is the last instruction
-                if offset == len(self.code.co_code):
-                    break
-
-                block = self.make_block(instructions[offset])
-                self.block_map[offset] = block
+                if instruction.offset in self.fallthrough:
+                    self.block_starts.add(
+                        self.fallthrough[instruction.offset])
 
-        print(self.block_map)
+        self.profile = None
+        if pgo.PROFILE is not None:
+            self.profile = pgo.PROFILE.function(self)
 
-        self.block_iter = iter(self.block_map.values())
-        self.block = next(self.block_iter)
+        self.blocks = {}
+        self.block = self.get_block(instructions[0].offset)
         self.block_stack = []
+        self.spills = {}
+
+    def emit(self):
+        super().emit()
+
+        if self.counters is not None:
+            self.counters.emit_reader()
+
+    def get_block(self, offset):
+        if offset not in self.blocks:
+            self.blocks[offset] = self.make_block(self.instruction_map[offset])
+
+        return self.blocks[offset]
+
+    def enter_block(self, offset):
+        block = self.blocks.get(offset)
+
+        if self.block is not None:
+            # the previous block falls through
+            if offset in self.spills:
+                self.spill(offset)
+            block = self.get_block(offset)
+            self.block.end_with_jump(block, self.location.tojit(self.context))
+        elif block is None and any(
+                source > offset
+                for source in self.jump_sources.get(offset, ())):
+            # only reached by jumping back from code after it
+            block = self.get_block(offset)
+
+        self.block = block
+        if block is not None and offset in self.spills:
+            self.stack = list(self.spills[offset])
+
+    def spill(self, offset):
+        # values left on the stack by a jump are what the target starts
+        # with, the arms of a conditional expression say; every edge
+        # assigns them to the same temporaries
+        if offset not in self.spills:
+            self.spills[offset] = [self.temporary(v) for v in self.stack]
+        spilled = self.spills[offset]
+        assert len(spilled) == len(self.stack), \
+            "Jumps to {} leave different stacks".format(offset)
+
+        for tmp, value in zip(spilled, self.stack):
+            self.assigned.setdefault(tmp, []).append(value)
+            self.block.add_assignment(
+                tmp.tojit(self.context), value.tojit(self.context),
+                self.location.tojit(self.context))
+        del self.stack[:]
+
+    def reachable(self, instruction):
+        if instruction.offset in self.block_starts:
+            self.enter_block(instruction.offset)
+
+        return self.block is not None
+
+    @property
+    def capi(self):
+        assert not self.nogil, \
+            "nogil function {} can't use the Python C-API".format(self.name)
+        self.uses_capi = True
+
+        return self.types.capi
+
+    def expect(self, condition, expected):
+        # a hint only, the branch still tests the condition
+        context = self.context
+
+        long = self.types.get_type('ssize').ctype
+        expect = context.builtin_function('__builtin_expect')
+
+        return context.comparison(
+            '!=',
+            context.call(expect, [
+                context.cast(condition, long),
+                context.integer(int(expected), long)]),
+            context.integer(0, long))
+
+    def check(self, failed, code):
+        # the failure branch is cold, the fast path stays a single compare
+        context = self.context
+        self.raises = True
+
+        cold = self.expect(failed, False)
+
+        raise_block = context.block(self.function)
+        raise_block.add_eval(self.errors.raise_call(code, self.location))
+        raise_block.end_with_jump(self.get_error_exit())
+
+        ok_block = context.block(self.function)
+        self.block.end_with_conditonal(
+            cold, raise_block, ok_block, self.location.tojit(context))
+        self.block = ok_block
+
+    def get_error_exit(self):
+        if self.error_exit is None:
+            self.error_exit = self.context.block(self.function, 'error')
+
+            if isinstance(self.ret_type, Void):
+                self.error_exit.end_with_void_return()
+            else:
+                self.error_exit.end_with_return(
+                    self.ret_type.default_constant().tojit(self.context))
+
+        return self.error_exit
 
     def log(self):
         print('block {}, stack {}'.format(self.block, self.stack))
@@ -120,10 +249,39 @@ class FunctionCompiler(AbstractCompiler):
         a = self.stack.pop()
         if not variable.typ:
             variable.typ = a.typ
+        self.assigned.setdefault(variable, []).append(a)
 
+        # the value first, it fails on things that aren't values
+        value = a.tojit(self.context)
         self.block.add_assignment(
-            variable.tojit(self.context),
-            a.tojit(self.context), self.location.tojit(self.context))
+            variable.tojit(self.context), value,
+            self.location.tojit(self.context))
+
+    def mutate(self, value):
+        self.written.append(value)
+
+    @property
+    def mutated(self):
+        # names of the params a write may reach through locals and slices,
+        # a local assigned after the write counts too
+        names = set()
+        seen = set()
+        work = list(self.written)
+        while work:
+            value = work.pop()
+            if id(value) in seen:
+                continue
+            seen.add(id(value))
+
+            if isinstance(value, Param):
+                names.add(value.desc)
+            if isinstance(value, Local):
+                work.extend(self.assigned.get(value, ()))
+            for parent in ('src', 'parent'):
+                if getattr(value, parent, None) is not None:
+                    work.append(getattr(value, parent))
+
+        return names
 
     def temporary(self, src):
         tmp = Temporary(self.function, src.typ, self.temporaries, src)
@@ -151,13 +309,13 @@ class FunctionCompiler(AbstractCompiler):
         self.stack[-1].typ.binary_add(self)
 
     def inplace_add(self, instruction):
-        self.stack[-1].typ.binary_add(self)
+        self.stack[-1].typ.inplace_add(self)
 
     def binary_subtract(self, instruction):
-        self.stack[-1].typ.inplace_subtract(self)
+        self.stack[-1].typ.binary_subtract(self)
 
     def inplace_subtract(self, instruction):
-        self.stack[-1].typ.binary_subtract(self)
+        self.stack[-1].typ.inplace_subtract(self)
 
     def binary_multiply(self, instruction):
         self.stack[-1].typ.binary_multiply(self)
@@ -171,15 +329,113 @@ class FunctionCompiler(AbstractCompiler):
     def inplace_floor_divide(self, instruction):
         self.stack[-1].typ.inplace_floor_divide(self)
 
+    def binary_modulo(self, instruction):
+        self.stack[-1].typ.binary_modulo(self)
+
+    def inplace_modulo(self, instruction):
+        self.stack[-1].typ.inplace_modulo(self)
+
+    def binary_power(self, instruction):
+        self.stack[-1].typ.binary_power(self)
+
+    def inplace_power(self, instruction):
+        self.stack[-1].typ.inplace_power(self)
+
+    def binary_and(self, instruction):
+        self.stack[-1].typ.binary_and(self)
+
+    def inplace_and(self, instruction):
+        self.stack[-1].typ.inplace_and(self)
+
+    def binary_or(self, instruction):
+        self.stack[-1].typ.binary_or(self)
+
+    def inplace_or(self, instruction):
+        self.stack[-1].typ.inplace_or(self)
+
+    def binary_xor(self, instruction):
+        self.stack[-1].typ.binary_xor(self)
+
+    def inplace_xor(self, instruction):
+        self.stack[-1].typ.inplace_xor(self)
+
+    def binary_lshift(self, instruction):
+        self.stack[-2].typ.binary_lshift(self)
+
+    def inplace_lshift(self, instruction):
+        self.stack[-2].typ.inplace_lshift(self)
+
+    def binary_rshift(self, instruction):
+        self.stack[-2].typ.binary_rshift(self)
+
+    def inplace_rshift(self, instruction):
+        self.stack[-2].typ.inplace_rshift(self)
+
+    def unary_negative(self, instruction):
+        self.stack[-1].typ.unary_negative(self)
+
+    def unary_invert(self, instruction):
+        self.stack[-1].typ.unary_invert(self)
+
     def compare_op(self, instruction):
         b = self.stack.pop()
         a = self.stack.pop()
+        op = instruction.argval
+
+        if op in COMPARISONS and isinstance(a, Constant) \
+                and isinstance(b, Constant) \
+                and isinstance(a.value, int) and isinstance(b.value, int):
+            self.stack.append(Constant(
+                self.types.default, int(COMPARISONS[op](a.value, b.value))))
+
+            return
+
         comparison = self.context.comparison(
-            dis.cmp_op[instruction.arg],
-            a.tojit(self.context),
-            b.tojit(self.context))
+            op, a.tojit(self.context), b.tojit(self.context))
         self.stack.append(Rvalue(int, 'comp', comparison))
 
+    def select(self, typ, condition, if_true, if_false):
+        context = self.context
+        result = self.temporary(Rvalue(typ, 'select'))
+
+        true_block = context.block(self.function)
+        false_block = context.block(self.function)
+        join_block = context.block(self.function)
+        self.block.end_with_conditonal(condition, true_block, false_block)
+
+        true_block.add_assignment(result.tojit(context), if_true)
+        true_block.end_with_jump(join_block)
+        false_block.add_assignment(result.tojit(context), if_false)
+        false_block.end_with_jump(join_block)
+        self.block = join_block
+
+        return result
+
+    def build_slice(self, instruction):
+        assert instruction.arg == 2, "Slices with a step aren't supported"
+        stop = self.stack.pop()
+        start = self.stack.pop()
+
+        self.stack.append(Slice(start, stop))
+
+    def load_method(self, instruction):
+        self.stack.append(Method(self.stack.pop(), instruction.argval))
+
+    def call_method(self, instruction):
+        arguments = []
+        for _ in range(instruction.arg):
+            arguments.insert(0, self.stack.pop())
+        method = self.stack.pop()
+
+        f = getattr(method.where.typ, method.name + '_method', None)
+        assert f, "{} has no method {}".format(method.where.typ, method.name)
+        result = f(self, method.where, *arguments)
+
+        if result is None:
+            self.stack.append(Constant.frompy(self, None))
+        else:
+            self.stack.append(result)
+
     def unpack_sequence(self, instruction):
         arg = self.stack.pop()
         for item in reversed(arg.value):
@@ -309,55 +565,72 @@ class FunctionCompiler(AbstractCompiler):
         else:
             self.block.end_with_void_return(self.location.tojit(self.context))
 
-        self.block = next(self.block_iter, None)
+        self.block = None
+
+    def jump(self, offset):
+        if self.stack:
+            self.spill(offset)
+        self.block.end_with_jump(
+            self.get_block(offset), self.location.tojit(self.context))
+        self.block = None
+
+    def pop_jump_if(self, instruction, jump_if):
+        condition = self.stack.pop()
+        target = instruction.argval
+
+        # a constant condition takes one side only, the other one is dead
+        # unless something else reaches it
+        if isinstance(condition, Constant):
+            if bool(condition.value) == jump_if:
+                self.jump(target)
+
+            return
+
+        jump_block = self.get_block(target)
+        next_block = self.get_block(self.fallthrough[instruction.offset])
+        if jump_if:
+            on_true, on_false = jump_block, next_block
+        else:
+            on_true, on_false = next_block, jump_block
+
+        rvalue = condition.tojit(self.context)
+        offset = instruction.offset
+
+        # a side the profile saw nearly never taken is made cold
+        if self.profile is not None:
+            expected = self.profile.expected(offset)
+            if expected is not None:
+                rvalue = self.expect(rvalue, expected)
+
+        if self.counters is not None:
+            on_true = self.counters.edge(on_true, '{}:true'.format(offset))
+            on_false = self.counters.edge(
+                on_false, '{}:false'.format(offset))
 
-    def pop_jump_if_false(self, instruction):
-        next_block = next(self.block_iter)
         self.block.end_with_conditonal(
-            self.stack.pop().tojit(self.context),
-            next_block, self.block_map[instruction.arg],
-            self.location.tojit(self.context))
-        self.block = next_block
+            rvalue, on_true, on_false, self.location.tojit(self.context))
+        self.block = None
+
+    def pop_jump_if_false(self, instruction):
+        self.pop_jump_if(instruction, False)
 
     def pop_jump_if_true(self, instruction):
-        next_block = next(self.block_iter)
-        self.block.end_with_conditonal(
-            self.stack.pop().tojit(self.context),
-            self.block_map[instruction.arg], next_block,
-            self.location.tojit(self.context))
-        self.block = next_block
+        self.pop_jump_if(instruction, True)
 
     def pop_top(self, instruction):
-        top = self.stack.pop()
-
-        if isinstance(top, Unreachable):
-            next_block = next(self.block_iter)
-            self.block.end_with_jump(
-                next_block, self.location.tojit(self.context))
-            self.block = next_block
+        self.stack.pop()
 
     def jump_absolute(self, instruction):
-        self.block.end_with_jump(
-            self.block_map[instruction.arg], self.location.tojit(self.context))
-        self.block = next(self.block_iter)
+        self.jump(instruction.argval)
 
     def break_loop(self, instruction):
-        self.block.end_with_jump(
-            self.block_stack[-1],
-            self.location.tojit(self.context))
-        self.block = next(self.block_iter)
+        self.jump(self.block_stack[-1])
 
     def setup_loop(self, instruction):
-        self.block_stack.append(
-            self.block_map[instruction.offset + instruction.arg])
-        next_block = next(self.block_iter)
-        self.block.end_with_jump(next_block, self.location.tojit(self.context))
-        self.block = next_block
+        # the loop body starts a new block, entered by falling through
+        self.block_stack.append(instruction.argval)
 
     def pop_block(self, instruction):
-        next_block = next(self.block_iter)
-        self.block.end_with_jump(next_block, self.location.tojit(self.context))
-        self.block = next_block
         self.block_stack.pop()
 
     def compile(self):
@@ -17,14 +17,9 @@ def default(compiler, arguments):
 
 
 def PyType_GenericNew(compiler):
-    context = compiler.context
-    dlsym = context.imported_function(
-        "void*", "dlsym", ["void*", "const char*"])
-    dlsym_call = context.call(
-        dlsym, [context.null("void*"), context.string_literal(b"PyType_GenericNew")])
-
     return Rvalue(
-        compiler.types.opaque, 'PyType_GenericNew', dlsym_call)
+        compiler.types.opaque, 'PyType_GenericNew',
+        compiler.capi.address('PyType_GenericNew'))
 
 
 def sizeof(compiler, arguments):
@@ -43,11 +38,9 @@ def PyModule_Create(compiler, arguments):
 
     context = compiler.context
 
-    PyModule_Create2 = context.imported_function(
-        "void*", "PyModule_Create2", ["void*", "int"])
-    PyModule_Create2_call = context.call(
-        PyModule_Create2,
-        [context.address(argument.tojit(context)), context.integer(3)])
+    PyModule_Create2_call = compiler.capi.call(
+        'PyModule_Create2',
+        context.address(argument.tojit(context)), context.integer(3))
 
     return Rvalue(
         compiler.types.opaque, "PyModule_Create2()", PyModule_Create2_call)
@@ -58,15 +51,11 @@ def PyModule_AddObject(compiler, arguments):
 
     context = compiler.context
 
-    PyModule_AddObject = context.imported_function(
-        "int", "PyModule_AddObject", ["void*", "const char*", "void*"])
-    PyModule_AddObject_call = context.call(
-        PyModule_AddObject,
-        [
-            arguments[0].tojit(context),
-            arguments[1].tojit(context),
-            context.address(arguments[2].tojit(context))
-        ])
+    PyModule_AddObject_call = compiler.capi.call(
+        'PyModule_AddObject',
+        arguments[0].tojit(context),
+        arguments[1].tojit(context),
+        context.address(arguments[2].tojit(context)))
 
     return Rvalue(
         compiler.types.int, "PyModule_AddObject()", PyModule_AddObject_call)
@@ -78,10 +67,8 @@ def PyType_Ready(compiler, arguments):
 
     context = compiler.context
 
-    PyType_Ready = context.imported_function(
-        "int", "PyType_Ready", ["void*"])
-    PyType_Ready_call = context.call(
-        PyType_Ready, [context.address(argument.tojit(context))])
+    PyType_Ready_call = compiler.capi.call(
+        'PyType_Ready', context.address(argument.tojit(context)))
 
     return Rvalue(
         compiler.types.int, "PyType_Ready()", PyType_Ready_call)
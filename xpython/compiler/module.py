@@ -5,8 +5,8 @@ from xpython.types import Types
 
 
 class ModuleCompiler(NamespaceCompiler):
-    def __init__(self, context, ffi, code):
-        self.types = Types(context, ffi)
+    def __init__(self, context, ffi, code, types=None):
+        self.types = types or Types(context, ffi)
 
         super().__init__(context, ffi, self.types, code)
 
@@ -20,6 +20,8 @@ class ModuleCompiler(NamespaceCompiler):
                 continue
 
             compiler = ClassCompiler(
-                self.context, self.ffi, self.types, value.function.code)
+                self.context, self.ffi, self.types, value)
+            value.compiler = compiler
             self.class_compilers[name] = compiler
             compiler.emit()
+            compiler.compile_methods(self.names)
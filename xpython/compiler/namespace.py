@@ -3,12 +3,24 @@ from collections import OrderedDict
 from xpython import CompilerResult
 from xpython.compiler import AbstractCompiler
 from xpython.compiler.function import FunctionCompiler
+from xpython.compiler.trampoline import boxable, fastcall
 from xpython.compiler.functions import default, PyModule_Create, PyType_Ready,\
     PyModule_AddObject, sizeof, PyType_GenericNew
 from xpython.nodes import Function, ConstKeyMap, Global, Class, Constant
-from xpython.typing import struct, struct_instance
+from xpython.typing import struct, struct_instance, nogil
 from xpython.cpy import PyObject, PyModuleDef, py_struct, \
-    PyObjectType, Py_TPFLAGS_DEFAULT
+    PyObjectType, Py_TPFLAGS_DEFAULT, export_class
+
+
+def is_table(arg):
+    if not isinstance(arg, Constant) or not arg.value:
+        return False
+
+    if isinstance(arg.value, bytes):
+        return True
+
+    return isinstance(arg.value, tuple) and all(
+        isinstance(v, int) for v in arg.value)
 
 
 class NamespaceCompiler(AbstractCompiler):
@@ -18,6 +30,7 @@ class NamespaceCompiler(AbstractCompiler):
         default_const = Constant(types.unsigned, Py_TPFLAGS_DEFAULT)
 
         super().__init__(context, ffi, code)
+        self.type_objects = {}
         self.names = OrderedDict([
             ('struct', struct), ('void', 'void'), ('py_struct', py_struct),
             ('opaque', 'opaque'),
@@ -29,7 +42,9 @@ class NamespaceCompiler(AbstractCompiler):
             ('PyModule_Create', PyModule_Create),
             ('PyType_Ready', PyType_Ready),
             ('PyModule_AddObject', PyModule_AddObject),
-            ('PyType_GenericNew', PyType_GenericNew)])
+            ('PyType_GenericNew', PyType_GenericNew),
+            ('export_class', export_class),
+            ('nogil', nogil)])
 
     def log(self):
         print(self.stack)
@@ -51,6 +66,12 @@ class NamespaceCompiler(AbstractCompiler):
         if annotations:
             annotations = self.stack.pop().value
 
+            # since 3.10 annotations are a flat tuple of names and values
+            if isinstance(annotations, tuple):
+                pairs = zip(annotations[::2], annotations[1::2])
+                annotations = OrderedDict(
+                    (getattr(k, 'value', k), v) for k, v in pairs)
+
         self.stack.append(Function(qualname, code, annotations))
 
     def store_name(self, instruction):
@@ -59,6 +80,13 @@ class NamespaceCompiler(AbstractCompiler):
         if isinstance(arg, struct_instance):
             typ = self.types.get_type(arg.typ).value
             value = typ.store_name(self, instruction)
+        elif is_table(arg):
+            typ = self.types.table(arg.value)
+            value = typ.store_name(self, instruction, arg.value)
+        elif isinstance(arg, Constant) and isinstance(arg.value, int):
+            # module level ints are folded into the code that reads them,
+            # typed wider when they don't fit default
+            value = Constant(self.types.fitting([arg.value]), arg.value)
         else:
             value = arg
 
@@ -67,9 +95,19 @@ class NamespaceCompiler(AbstractCompiler):
     def load_name(self, instruction):
         self.stack.append(self.names[instruction.argval])
 
+    def load_attr(self, instruction):
+        self.stack.append(getattr(self.stack.pop(), instruction.argval))
+
     def load_build_class(self, instruction):
         self.stack.append(Global('build_class'))
 
+    def build_tuple(self, instruction):
+        items = []
+        for _ in range(instruction.arg):
+            items.insert(0, self.stack.pop())
+
+        self.stack.append(Constant(tuple, tuple(items)))
+
     def build_const_key_map(self, instruction):
         keys = self.stack.pop().value
         arguments = []
@@ -86,8 +124,15 @@ class NamespaceCompiler(AbstractCompiler):
         f = self.stack.pop()
 
         if getattr(f, 'name', None) and f.name == 'build_class':
-            self.stack.append(Class(arguments[1], arguments[0]))
+            self.stack.append(
+                Class(arguments[1].value, arguments[0], arguments[2:]))
+
+            return
 
+        if f is nogil:
+            assert instruction.arg == 1 and isinstance(arguments[0], Function)
+            arguments[0].nogil = True
+            self.stack.append(arguments[0])
             return
 
         if isinstance(f, struct):
@@ -103,11 +148,32 @@ class NamespaceCompiler(AbstractCompiler):
 
         assert 0
 
+    def call_function_kw(self, instruction):
+        names = self.stack.pop().value
+        arguments = []
+        for _ in range(instruction.arg):
+            arguments.insert(0, self.stack.pop())
+        f = self.stack.pop()
+
+        assert issubclass(f, struct), \
+            "Keyword arguments are only supported for struct declarations"
+
+        split = len(arguments) - len(names)
+        args = [a.value for a in arguments[:split]]
+        kwargs = dict(zip(names, (a.value for a in arguments[split:])))
+        self.stack.append(f(*args, **kwargs))
+
     def return_value(self, instruction):
         self.stack.pop()
 
     def compile(self):
+        self.emit_functions()
+
+        return CompilerResult(self, self.context.compile())
+
+    def emit_functions(self):
         self.emit()
+        self.functions = OrderedDict()
 
         for name, item in self.names.items():
             if not isinstance(item, Function):
@@ -117,9 +183,12 @@ class NamespaceCompiler(AbstractCompiler):
             compiler = FunctionCompiler(
                 self.context, self.ffi, self.types, self.names, item.code,
                 ann['return'], name,
-                [v for k, v in ann.items() if k != 'return'])
+                [v for k, v in ann.items() if k != 'return'], item.nogil)
             compiler.setup_function()
             compiler.setup_blocks()
             compiler.emit()
+            self.functions[name] = compiler
 
-        return CompilerResult(self, self.context.compile())
+            if boxable(compiler):
+                fastcall(
+                    self, name + '_fastcall', compiler, exported=True)
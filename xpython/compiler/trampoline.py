@@ -0,0 +1,260 @@
+from xpython.cpy import PyObject
+from xpython.types import Integer, Buffer, Void
+
+
+# a C function with a CPython calling convention that converts its
+# arguments, calls compiled code and converts the result back
+class Trampoline:
+    def __init__(self, compiler, name, ret_type, params, error_value,
+                 exported=False):
+        context = compiler.context
+        self.context = context
+        self.types = compiler.types
+        self.capi = compiler.types.capi
+        self.type_objects = compiler.type_objects
+        self.name = name
+
+        self.params = [context.param(typ.ctype, n) for typ, n in params]
+        if exported:
+            self.function = context.exported_function(
+                ret_type.ctype, name, self.params, None)
+        else:
+            self.function = context.internal_function(
+                ret_type.ctype, name, self.params)
+        self.block = context.block(self.function)
+        self.ret_type = ret_type
+        self.error_value = error_value
+        self.error_blocks = {}
+        self.cleanups = []
+        self.locals = 0
+
+        # set while unboxing a binary operand, a TypeError returns
+        # NotImplemented so python tries the reflected operation
+        self.type_error_not_implemented = False
+
+    def local(self, typ, name):
+        self.locals += 1
+
+        return self.context.local(
+            self.function, typ.ctype, '{}{}'.format(name, self.locals))
+
+    def cleanup(self, callback):
+        self.cleanups.append(callback)
+
+    def error(self):
+        # error paths undo whatever was acquired before them
+        depth = len(self.cleanups)
+        key = depth, self.type_error_not_implemented
+
+        if key not in self.error_blocks:
+            block = self.context.block(
+                self.function, 'error{}'.format(depth))
+            self.error_blocks[key] = block
+
+            if self.type_error_not_implemented:
+                block = self.not_implemented_on_type_error(block)
+
+            for callback in reversed(self.cleanups):
+                callback(block)
+            block.end_with_return(self.error_value)
+
+        return self.error_blocks[key]
+
+    def not_implemented_on_type_error(self, block):
+        # returns the block other errors go on in
+        context = self.context
+
+        type_error_block = context.block(self.function)
+        other_block = context.block(self.function)
+        matches = self.capi.call(
+            'PyErr_ExceptionMatches', self.capi.get_global('PyExc_TypeError'))
+        block.end_with_conditonal(
+            context.comparison('!=', matches, context.integer(0)),
+            type_error_block, other_block)
+
+        type_error_block.add_eval(self.capi.call('PyErr_Clear'))
+        for callback in reversed(self.cleanups):
+            callback(type_error_block)
+
+        current, self.block = self.block, type_error_block
+        type_error_block.end_with_return(self.not_implemented())
+        self.block = current
+
+        return other_block
+
+    def check(self, condition):
+        ok_block = self.context.block(self.function)
+        self.block.end_with_conditonal(condition, self.error(), ok_block)
+        self.block = ok_block
+
+    def finish(self, value):
+        if self.cleanups:
+            result = self.local(self.ret_type, 'retval')
+            self.block.add_assignment(result, value)
+            value = result
+
+            for callback in reversed(self.cleanups):
+                callback(self.block)
+
+        self.block.end_with_return(value)
+
+    def check_error(self, condition):
+        context = self.context
+
+        maybe_block = context.block(self.function)
+        ok_block = context.block(self.function)
+        self.block.end_with_conditonal(condition, maybe_block, ok_block)
+
+        occurred = context.comparison(
+            '!=', self.capi.call('PyErr_Occurred'),
+            context.null(self.types.opaque.ctype))
+        maybe_block.end_with_conditonal(occurred, self.error(), ok_block)
+
+        self.block = ok_block
+
+    def raise_if(self, condition, exception, message):
+        context = self.context
+
+        raise_block = context.block(self.function)
+        ok_block = context.block(self.function)
+        self.block.end_with_conditonal(condition, raise_block, ok_block)
+
+        raise_block.add_eval(self.capi.call(
+            'PyErr_SetString', self.capi.get_global(exception),
+            context.string_literal(message)))
+        raise_block.end_with_jump(self.error())
+
+        self.block = ok_block
+
+    def incref(self, obj):
+        self.capi.incref(self.block, obj)
+
+    def singleton(self, name):
+        context = self.context
+
+        obj = context.cast(
+            context.address(self.capi.get_global(name)),
+            self.types.opaque.ctype)
+        self.incref(obj)
+
+        return obj
+
+    def none(self):
+        return self.singleton('_Py_NoneStruct')
+
+    def not_implemented(self):
+        return self.singleton('_Py_NotImplementedStruct')
+
+    def not_instance(self, obj, type_object):
+        context = self.context
+
+        pyobject = self.types.get_type(PyObject)
+        ob_type = context.dereference_field(
+            context.cast(obj, pyobject.ctype),
+            pyobject.fields['ob_type'].cfield)
+        is_subtype = self.capi.call(
+            'PyType_IsSubtype', ob_type,
+            context.address(type_object.tojit(context)))
+
+        return context.comparison('==', is_subtype, context.integer(0))
+
+    def unbox_argument(self, compiler, index, obj):
+        typ = compiler.param_types[index]
+
+        if compiler.code.co_varnames[index] in compiler.mutated:
+            return typ.unbox(self, obj, writable=True)
+
+        return typ.unbox(self, obj)
+
+    def call(self, compiler, arguments):
+        context = self.context
+        call = context.call(compiler.function, arguments)
+
+        if compiler.nogil:
+            thread_state = self.local(self.types.opaque, 'thread_state')
+            self.block.add_assignment(
+                thread_state, self.capi.call('PyEval_SaveThread'))
+
+        if isinstance(compiler.ret_type, Void):
+            self.block.add_eval(call)
+            result = None
+        else:
+            result = self.local(compiler.ret_type, 'result')
+            self.block.add_assignment(result, call)
+
+        if compiler.nogil:
+            self.block.add_eval(
+                self.capi.call('PyEval_RestoreThread', thread_state))
+
+        if compiler.raises:
+            self.check_raised(compiler, result)
+
+        return result
+
+    def check_raised(self, compiler, result):
+        # compiled code signals errors with the default return value
+        context = self.context
+
+        raised = context.comparison(
+            '!=', self.types.errors.set_pyerr_call(),
+            self.types.int.jit_constant(context, 0))
+
+        if result is None:
+            self.check(raised)
+
+            return
+
+        maybe_block = context.block(self.function)
+        ok_block = context.block(self.function)
+        self.block.end_with_conditonal(
+            context.comparison(
+                '==', result,
+                compiler.ret_type.default_constant().tojit(context)),
+            maybe_block, ok_block)
+
+        self.block = maybe_block
+        self.check(raised)
+        self.block.end_with_jump(ok_block)
+        self.block = ok_block
+
+
+def boxable(compiler):
+    return (
+        all(isinstance(t, (Integer, Buffer)) for t in compiler.param_types)
+        and isinstance(compiler.ret_type, (Integer, Void)))
+
+
+def fastcall(owner, name, compiler, method=False, exported=False):
+    context = owner.context
+    types = owner.types
+    opaque = types.opaque
+
+    trampoline = Trampoline(
+        owner, name, opaque,
+        [(opaque, 'self'), (types.pointer(opaque), 'args'),
+         (types.ssize, 'nargs')],
+        context.null(opaque.ctype), exported)
+    self_obj, args, nargs = trampoline.params
+
+    first = 1 if method else 0
+    expected = len(compiler.param_types) - first
+    message = '{}() takes {} arguments'.format(
+        compiler.code.co_name, expected)
+    trampoline.raise_if(
+        context.comparison(
+            '!=', nargs, types.ssize.jit_constant(context, expected)),
+        'PyExc_TypeError', message.encode())
+
+    arguments = []
+    if method:
+        arguments.append(context.cast(self_obj, compiler.param_types[0].ctype))
+
+    for i in range(first, len(compiler.param_types)):
+        arg = context.array_access(
+            args, types.ssize.jit_constant(context, i - first))
+        arguments.append(trampoline.unbox_argument(compiler, i, arg))
+
+    result = trampoline.call(compiler, arguments)
+    trampoline.finish(compiler.ret_type.box(trampoline, result))
+
+    return trampoline.function
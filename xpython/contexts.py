@@ -0,0 +1,53 @@
+from contextlib import contextmanager
+import threading
+
+from xpython.runtime import Runtime
+
+
+# hands out child contexts of one base context, the runtime is declared
+# once in the base and the children only add what a compile needs; a
+# child is emptied and kept for the next compile once it is given back
+class ContextPool:
+    def __init__(self, context, ffi):
+        self.context = context
+        self.ffi = ffi
+
+        self.runtime = Runtime(context, ffi).build()
+        self.types = self.runtime.types
+
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.children = 0
+        self.free = []
+
+    def new_child(self):
+        # the base context must not change once children exist
+        with self.lock:
+            if self.free:
+                return self.runtime.child(self.free.pop())
+
+            self.children += 1
+
+            return self.runtime.child()
+
+    def release(self, context):
+        # what was compiled into it is already loaded
+        context.reset()
+
+        with self.lock:
+            self.free.append(context)
+
+    @contextmanager
+    def child(self):
+        # a thread compiles into one child at a time, the child goes back
+        # to the pool when the block ends
+        assert not getattr(self.local, 'busy', False), \
+            "Thread already holds a child context"
+        self.local.busy = True
+
+        context, types = self.new_child()
+        try:
+            yield context, types
+        finally:
+            self.release(context)
+            self.local.busy = False
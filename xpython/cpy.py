@@ -115,10 +115,137 @@ PyModuleDef = struct(
 )
 
 
+METH_VARARGS = 0x0001
+METH_KEYWORDS = 0x0002
+METH_NOARGS = 0x0004
+METH_O = 0x0008
+METH_FASTCALL = 0x0080
+
+
+PyMethodDef = struct(
+    'PyMethodDef',
+
+    ('ml_name', 'cstr'),
+    ('ml_meth', ...),
+    ('ml_flags', 'int'),
+    ('ml_doc', 'cstr')
+)
+
+
+T_INT = 1
+T_CHAR = 7
+T_BYTE = 8
+T_UBYTE = 9
+T_UINT = 11
+T_ULONG = 12
+T_PYSSIZET = 19
+
+
+PyMemberDef = struct(
+    'PyMemberDef',
+
+    ('name', 'cstr'),
+    ('type', 'int'),
+    ('offset', 'ssize'),
+    ('flags', 'int'),
+    ('doc', 'cstr')
+)
+
+
+PyNumberMethods = struct(
+    'PyNumberMethods',
+
+    ('nb_add', ...),
+    ('nb_subtract', ...),
+    ('nb_multiply', ...),
+    ('nb_remainder', ...),
+    ('nb_divmod', ...),
+    ('nb_power', ...),
+    ('nb_negative', ...),
+    ('nb_positive', ...),
+    ('nb_absolute', ...),
+    ('nb_bool', ...),
+    ('nb_invert', ...),
+    ('nb_lshift', ...),
+    ('nb_rshift', ...),
+    ('nb_and', ...),
+    ('nb_xor', ...),
+    ('nb_or', ...),
+    ('nb_int', ...),
+    ('nb_reserved', ...),
+    ('nb_float', ...),
+
+    ('nb_inplace_add', ...),
+    ('nb_inplace_subtract', ...),
+    ('nb_inplace_multiply', ...),
+    ('nb_inplace_remainder', ...),
+    ('nb_inplace_power', ...),
+    ('nb_inplace_lshift', ...),
+    ('nb_inplace_rshift', ...),
+    ('nb_inplace_and', ...),
+    ('nb_inplace_xor', ...),
+    ('nb_inplace_or', ...),
+
+    ('nb_floor_divide', ...),
+    ('nb_true_divide', ...),
+    ('nb_inplace_floor_divide', ...),
+    ('nb_inplace_true_divide', ...),
+
+    ('nb_index', ...),
+
+    ('nb_matrix_multiply', ...),
+    ('nb_inplace_matrix_multiply', ...)
+)
+
+
+PySequenceMethods = struct(
+    'PySequenceMethods',
+
+    ('sq_length', ...),
+    ('sq_concat', ...),
+    ('sq_repeat', ...),
+    ('sq_item', ...),
+    ('was_sq_slice', ...),
+    ('sq_ass_item', ...),
+    ('was_sq_ass_slice', ...),
+    ('sq_contains', ...),
+
+    ('sq_inplace_concat', ...),
+    ('sq_inplace_repeat', ...)
+)
+
+
+PyBUF_SIMPLE = 0
+PyBUF_WRITABLE = 0x0001
+
+
+Py_buffer = struct(
+    'Py_buffer',
+
+    ('buf', ...),
+    ('obj', ...),
+    ('len', 'ssize'),
+    ('itemsize', 'ssize'),
+    ('readonly', 'int'),
+    ('ndim', 'int'),
+    ('format', ...),
+    ('shape', ...),
+    ('strides', ...),
+    ('suboffsets', ...),
+    ('internal', ...)
+)
+
+
 class py_struct(struct):
-    def __init__(self, name, *fields):
-        super().__init__(name, ('ob_base', PyObject.value), *fields)
+    # PyObject header has to stay at offset 0
+    pinned = 1
+
+    def __init__(self, name, *fields, **kwargs):
+        super().__init__(name, ('ob_base', PyObject.value), *fields, **kwargs)
+
 
+def export_class(compiler, arguments):
+    assert len(arguments) == 2
+    type_object, klass = arguments
 
-def export_class(klass):
-    pass
+    klass.compiler.export(compiler, type_object)
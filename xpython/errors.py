@@ -0,0 +1,158 @@
+from xpython.code import get_line
+from xpython.typing import struct
+
+
+OK = 0
+OVERFLOW = 1
+INDEX = 2
+ZERO_DIVISION = 3
+VALUE = 4
+
+
+EXCEPTIONS = {
+    OVERFLOW: (OverflowError, 'PyExc_OverflowError', 'integer overflow'),
+    INDEX: (IndexError, 'PyExc_IndexError', 'index out of range'),
+    ZERO_DIVISION: (
+        ZeroDivisionError, 'PyExc_ZeroDivisionError', 'division by zero'),
+    VALUE: (ValueError, 'PyExc_ValueError', 'invalid value'),
+}
+
+
+ErrorState = struct(
+    'xpython_error',
+
+    ('code', 'int'),
+    ('filename', 'cstr'),
+    ('lineno', 'int')
+)
+
+
+# failed checks record what happened in a thread local and make the
+# function return early, callers turn the record into an exception
+class Errors:
+    def __init__(self, types):
+        self.types = types
+        self.context = types.context
+
+    def build(self):
+        context = self.context
+        types = self.types
+
+        self.struct = types.get_type(ErrorState)
+        self.state = context.thread_local_global(
+            self.struct.value.ctype, 'xpython_error_state', None)
+
+        fields = self.struct.fields
+        self.code = context.access_field_lvalue(
+            self.state, fields['code'].cfield)
+        self.filename = context.access_field_lvalue(
+            self.state, fields['filename'].cfield)
+        self.lineno = context.access_field_lvalue(
+            self.state, fields['lineno'].cfield)
+
+        self.build_raise()
+        self.build_last_error()
+        self.set_pyerr = None
+
+    def child(self, types):
+        # reuses the state and helpers declared in a parent context
+        errors = Errors(types)
+        errors.struct = self.struct
+        errors.state = self.state
+        errors.code = self.code
+        errors.filename = self.filename
+        errors.lineno = self.lineno
+        errors.raise_function = self.raise_function
+        errors.set_pyerr = self.set_pyerr
+
+        return errors
+
+    def build_raise(self):
+        context = self.context
+        types = self.types
+
+        code = context.param(types.int.ctype, 'code')
+        filename = context.param(types.cstr.ctype, 'filename')
+        lineno = context.param(types.int.ctype, 'lineno')
+        self.raise_function = context.internal_function(
+            'void', 'xpython_raise', [code, filename, lineno])
+
+        block = context.block(self.raise_function)
+        block.add_assignment(self.code, code)
+        block.add_assignment(self.filename, filename)
+        block.add_assignment(self.lineno, lineno)
+        block.end_with_void_return()
+
+    def build_last_error(self):
+        context = self.context
+
+        out = context.param(self.struct.ctype, 'out')
+        function = context.exported_function(
+            self.types.int.ctype, 'xpython_last_error', [out], None)
+
+        block = context.block(function)
+        block.add_assignment(context.dereference(out), self.state)
+        block.add_assignment(self.code, self.types.int.jit_constant(
+            context, OK))
+        block.end_with_return(
+            context.dereference_field(out, self.struct.fields['code'].cfield))
+
+    def build_set_pyerr(self):
+        # turns a recorded error into a python exception, returns the code
+        context = self.context
+        types = self.types
+        capi = types.capi
+
+        function = context.internal_function(
+            types.int.ctype, 'xpython_set_pyerr', [])
+        block = context.block(function)
+        code = context.local(function, types.int.ctype, 'code')
+        block.add_assignment(code, self.code)
+        block.add_assignment(self.code, types.int.jit_constant(context, OK))
+
+        for error, (_, exception, message) in EXCEPTIONS.items():
+            raise_block = context.block(function)
+            next_block = context.block(function)
+            block.end_with_conditonal(
+                context.comparison(
+                    '==', code, types.int.jit_constant(context, error)),
+                raise_block, next_block)
+
+            raise_block.add_eval(capi.call(
+                'PyErr_Format', capi.get_global(exception),
+                context.string_literal(message.encode() + b' at %s:%d'),
+                self.filename, self.lineno))
+            raise_block.end_with_return(code)
+
+            block = next_block
+
+        block.end_with_return(code)
+
+        return function
+
+    def set_pyerr_call(self):
+        if self.set_pyerr is None:
+            self.set_pyerr = self.build_set_pyerr()
+
+        return self.context.call(self.set_pyerr, [])
+
+    def raise_call(self, code, location):
+        context = self.context
+        types = self.types
+
+        return context.call(self.raise_function, [
+            types.int.jit_constant(context, code),
+            context.string_literal(location.filename.encode()),
+            types.int.jit_constant(context, location.lineno)])
+
+
+def exception(ffi, state):
+    typ, _, message = EXCEPTIONS[state.code]
+    filename = ffi.string(state.filename).decode()
+
+    message = '{} at {}:{}'.format(message, filename, state.lineno)
+    line = get_line(filename, state.lineno).strip()
+    if line:
+        message += ': ' + line
+
+    return typ(message)
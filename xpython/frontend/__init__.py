@@ -0,0 +1,32 @@
+from collections import namedtuple
+
+
+# the instruction stream the compilers consume, in the opcode vocabulary
+# of CPython 3.7 whatever the running version is; offsets are positions
+# in the stream and jump argvals are offsets in it too
+Instruction = namedtuple(
+    'Instruction',
+    'opname arg argval offset starts_line is_jump_target')
+
+
+# 'bytecode' walks the compiled code object, 'ast' lowers its source
+FRONTEND = 'bytecode'
+
+
+JUMPS = frozenset([
+    'POP_JUMP_IF_FALSE', 'POP_JUMP_IF_TRUE', 'JUMP_ABSOLUTE', 'SETUP_LOOP'
+])
+
+
+def instructions(code, frontend=None):
+    frontend = frontend or FRONTEND
+
+    if frontend == 'ast':
+        from xpython.frontend.syntax import lower
+
+        return lower(code)
+
+    assert frontend == 'bytecode', "Unknown frontend " + frontend
+    from xpython.frontend.bytecode import normalize
+
+    return normalize(code)
@@ -0,0 +1,205 @@
+import dis
+import sys
+
+from xpython.frontend import Instruction, JUMPS
+
+
+VERSION = sys.version_info[:2]
+assert (3, 7) <= VERSION <= (3, 12), \
+    "Unsupported python version {}.{}".format(*VERSION)
+
+
+# BINARY_OP arguments of 3.11 and 3.12, inplace variants follow at 13
+BINARY_OPS = [
+    'ADD', 'AND', 'FLOOR_DIVIDE', 'LSHIFT', 'MATRIX_MULTIPLY', 'MULTIPLY',
+    'MODULO', 'OR', 'POWER', 'RSHIFT', 'SUBTRACT', 'TRUE_DIVIDE', 'XOR'
+]
+
+# bookkeeping without an equivalent in the stream
+DROPPED = frozenset([
+    'NOP', 'EXTENDED_ARG', 'RESUME', 'PRECALL', 'CACHE', 'COPY_FREE_VARS',
+    'MAKE_CELL', 'END_FOR'
+])
+
+RENAMED = {
+    'POP_JUMP_FORWARD_IF_FALSE': 'POP_JUMP_IF_FALSE',
+    'POP_JUMP_BACKWARD_IF_FALSE': 'POP_JUMP_IF_FALSE',
+    'POP_JUMP_FORWARD_IF_TRUE': 'POP_JUMP_IF_TRUE',
+    'POP_JUMP_BACKWARD_IF_TRUE': 'POP_JUMP_IF_TRUE',
+    'JUMP_FORWARD': 'JUMP_ABSOLUTE',
+    'JUMP_BACKWARD': 'JUMP_ABSOLUTE',
+    'JUMP_BACKWARD_NO_INTERRUPT': 'JUMP_ABSOLUTE',
+    'LOAD_FAST_CHECK': 'LOAD_FAST',
+    'LOAD_FAST_AND_CLEAR': 'LOAD_FAST',
+}
+
+# jumps on None compare with None first
+NONE_JUMPS = {
+    'POP_JUMP_IF_NONE': '==',
+    'POP_JUMP_FORWARD_IF_NONE': '==',
+    'POP_JUMP_BACKWARD_IF_NONE': '==',
+    'POP_JUMP_IF_NOT_NONE': '!=',
+    'POP_JUMP_FORWARD_IF_NOT_NONE': '!=',
+    'POP_JUMP_BACKWARD_IF_NOT_NONE': '!=',
+}
+
+UNCONDITIONAL = frozenset([
+    'JUMP_FORWARD', 'JUMP_BACKWARD', 'JUMP_BACKWARD_NO_INTERRUPT',
+    'JUMP_ABSOLUTE', 'RETURN_VALUE', 'RETURN_CONST', 'RAISE_VARARGS',
+    'RERAISE'
+])
+
+
+class Normalizer:
+    def __init__(self, code):
+        self.code = code
+        self.out = []
+        self.offsets = {}
+
+        # where NULLs and methods sit on the stack, 3.11 calls need them
+        self.depth = 0
+        self.target_depths = {}
+        self.callables = {}
+        self.kw_names = None
+        self.last_code = None
+        self.line = None
+
+    def emit(self, raw, opname, arg=None, argval=None):
+        # dropped instructions pass their line on
+        line = raw.starts_line or self.line
+        self.line = None
+
+        self.out.append([opname, arg, argval, line])
+
+    def run(self):
+        previous = None
+
+        for raw in dis.get_instructions(self.code):
+            self.offsets[raw.offset] = len(self.out)
+
+            if VERSION >= (3, 11):
+                if raw.offset in self.target_depths and previous in \
+                        UNCONDITIONAL:
+                    self.depth = self.target_depths[raw.offset]
+                self.track(raw)
+
+            self.translate(raw)
+            previous = raw.opname
+
+        return self.finish()
+
+    def track(self, raw):
+        # the stack depth before raw runs
+        if raw.opcode in dis.hasjrel + dis.hasjabs:
+            self.target_depths.setdefault(
+                raw.argval,
+                self.depth + dis.stack_effect(raw.opcode, raw.arg, jump=True))
+
+        if raw.opname == 'PUSH_NULL' or (
+                raw.opname == 'LOAD_GLOBAL' and raw.arg & 1):
+            self.callables[self.depth] = 'function'
+        elif raw.opname == 'LOAD_METHOD' or (
+                raw.opname == 'LOAD_ATTR' and VERSION >= (3, 12)
+                and raw.arg & 1):
+            self.callables[self.depth - 1] = 'method'
+
+        # 3.11 splits the stack effect of a call over PRECALL and CALL
+        if raw.opname == 'PRECALL' or (
+                raw.opname == 'CALL' and VERSION >= (3, 12)):
+            self.call_base = self.depth - raw.arg - 2
+
+        self.depth += dis.stack_effect(
+            raw.opcode, raw.arg if raw.opcode >= dis.HAVE_ARGUMENT else None,
+            jump=False)
+
+    def translate(self, raw):
+        opname = raw.opname
+
+        if opname in DROPPED or opname == 'PUSH_NULL':
+            self.line = raw.starts_line or self.line
+            return
+
+        if opname == 'LOAD_CONST':
+            if hasattr(raw.argval, 'co_code'):
+                self.last_code = raw.argval
+            self.emit(raw, opname, raw.arg, raw.argval)
+        elif opname in RENAMED:
+            self.emit(raw, RENAMED[opname], raw.arg, raw.argval)
+        elif opname in NONE_JUMPS:
+            self.emit(raw, 'LOAD_CONST', None, None)
+            self.emit(raw, 'COMPARE_OP', None, NONE_JUMPS[opname])
+            self.emit(raw, 'POP_JUMP_IF_TRUE', raw.arg, raw.argval)
+        elif opname == 'BINARY_OP':
+            name = BINARY_OPS[raw.arg % len(BINARY_OPS)]
+            prefix = 'INPLACE_' if raw.arg >= len(BINARY_OPS) else 'BINARY_'
+            self.emit(raw, prefix + name)
+        elif opname == 'IS_OP':
+            self.emit(raw, 'COMPARE_OP', None, '!=' if raw.arg else '==')
+        elif opname == 'CONTAINS_OP':
+            self.emit(raw, 'COMPARE_OP', None, 'not in' if raw.arg else 'in')
+        elif opname == 'COMPARE_OP':
+            self.emit(raw, opname, None, raw.argval)
+        elif opname == 'LOAD_ATTR' and VERSION >= (3, 12) and raw.arg & 1:
+            self.emit(raw, 'LOAD_METHOD', None, raw.argval)
+        elif opname == 'LOAD_GLOBAL':
+            self.emit(raw, opname, None, raw.argval)
+        elif opname == 'KW_NAMES':
+            self.kw_names = self.code.co_consts[raw.arg]
+            self.line = raw.starts_line or self.line
+        elif opname == 'CALL':
+            self.call(raw)
+        elif opname == 'MAKE_FUNCTION':
+            if VERSION >= (3, 11):
+                # the qualified name was on the stack before 3.11
+                self.emit(
+                    raw, 'LOAD_CONST', None, self.last_code.co_qualname)
+            self.emit(raw, opname, raw.arg, raw.argval)
+        elif opname == 'RETURN_CONST':
+            self.emit(raw, 'LOAD_CONST', raw.arg, raw.argval)
+            self.emit(raw, 'RETURN_VALUE')
+        elif opname == 'BINARY_SLICE':
+            self.emit(raw, 'BUILD_SLICE', 2, 2)
+            self.emit(raw, 'BINARY_SUBSCR')
+        elif opname == 'STORE_SLICE':
+            self.emit(raw, 'BUILD_SLICE', 2, 2)
+            self.emit(raw, 'STORE_SUBSCR')
+        elif opname == 'COPY' and raw.arg == 1:
+            self.emit(raw, 'DUP_TOP')
+        elif opname == 'SWAP' and raw.arg == 2:
+            self.emit(raw, 'ROT_TWO')
+        else:
+            self.emit(raw, opname, raw.arg, raw.argval)
+
+    def call(self, raw):
+        # CALL n has NULL and callable or callable and self below the
+        # arguments; without either the callable was called with n + 1
+        kind = self.callables.pop(self.call_base, None)
+        count = raw.arg if kind else raw.arg + 1
+
+        if self.kw_names is not None:
+            self.emit(raw, 'LOAD_CONST', None, self.kw_names)
+            self.emit(raw, 'CALL_FUNCTION_KW', count, count)
+            self.kw_names = None
+        elif kind == 'method':
+            self.emit(raw, 'CALL_METHOD', count, count)
+        else:
+            self.emit(raw, 'CALL_FUNCTION', count, count)
+
+    def finish(self):
+        # renumber, the stream has its own offsets
+        def offset(raw_offset):
+            return self.offsets[raw_offset] * 2
+
+        for item in self.out:
+            if item[0] in JUMPS:
+                item[2] = offset(item[2])
+
+        targets = set(item[2] for item in self.out if item[0] in JUMPS)
+
+        return [
+            Instruction(opname, arg, argval, i * 2, line, i * 2 in targets)
+            for i, (opname, arg, argval, line) in enumerate(self.out)]
+
+
+def normalize(code):
+    return Normalizer(code).run()
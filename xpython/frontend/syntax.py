@@ -0,0 +1,649 @@
+import ast
+import functools
+import linecache
+import operator
+import sys
+import types
+
+from xpython.code import get_source
+from xpython.frontend import Instruction, JUMPS
+
+
+BINARY_OPS = {
+    ast.Add: 'ADD', ast.Sub: 'SUBTRACT', ast.Mult: 'MULTIPLY',
+    ast.FloorDiv: 'FLOOR_DIVIDE', ast.Mod: 'MODULO', ast.Pow: 'POWER',
+    ast.LShift: 'LSHIFT', ast.RShift: 'RSHIFT', ast.BitAnd: 'AND',
+    ast.BitOr: 'OR', ast.BitXor: 'XOR', ast.Div: 'TRUE_DIVIDE',
+    ast.MatMult: 'MATRIX_MULTIPLY'
+}
+
+UNARY_OPS = {
+    ast.USub: 'UNARY_NEGATIVE', ast.Invert: 'UNARY_INVERT',
+    ast.UAdd: 'UNARY_POSITIVE', ast.Not: 'UNARY_NOT'
+}
+
+COMPARE_OPS = {
+    ast.Lt: '<', ast.LtE: '<=', ast.Eq: '==', ast.NotEq: '!=',
+    ast.Gt: '>', ast.GtE: '>=', ast.Is: '==', ast.IsNot: '!=',
+    ast.In: 'in', ast.NotIn: 'not in'
+}
+
+# constant expressions are folded like CPython's peephole optimizer does
+FOLDS = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+    ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod,
+    ast.LShift: operator.lshift, ast.RShift: operator.rshift,
+    ast.BitAnd: operator.and_, ast.BitOr: operator.or_,
+    ast.BitXor: operator.xor, ast.Pow: operator.pow,
+    ast.USub: operator.neg, ast.Invert: operator.invert,
+    ast.UAdd: operator.pos
+}
+
+# results larger than this stay expressions, as in CPython
+MAX_FOLDED_BITS = 128
+
+# python 3.7 parses literals into separate node types and 3.8 wraps
+# plain subscript indexes, later versions deprecate both
+LEGACY_NODES = sys.version_info < (3, 8)
+WRAPPED_INDEX = sys.version_info < (3, 9)
+
+
+class NotConstant(Exception):
+    pass
+
+
+class Label:
+    def __init__(self):
+        self.index = None
+
+
+def constant(node):
+    if isinstance(node, ast.Constant):
+        return node.value
+    if LEGACY_NODES:
+        if isinstance(node, ast.Num):
+            return node.n
+        if isinstance(node, (ast.Str, ast.Bytes)):
+            return node.s
+        if isinstance(node, ast.NameConstant):
+            return node.value
+
+    if isinstance(node, ast.Tuple) and isinstance(node.ctx, ast.Load):
+        return tuple(constant(e) for e in node.elts)
+
+    if isinstance(node, ast.UnaryOp) and type(node.op) in FOLDS:
+        value = constant(node.operand)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return FOLDS[type(node.op)](value)
+
+    if isinstance(node, ast.BinOp) and type(node.op) in FOLDS:
+        a, b = constant(node.left), constant(node.right)
+        if isinstance(a, int) and isinstance(b, int) and \
+                not isinstance(a, bool) and not isinstance(b, bool):
+            try:
+                # guard the operators that blow up before computing them
+                if isinstance(node.op, ast.LShift) and b > MAX_FOLDED_BITS:
+                    raise NotConstant()
+                if isinstance(node.op, ast.Pow) and (
+                        b < 0 or a.bit_length() * b > MAX_FOLDED_BITS):
+                    raise NotConstant()
+                value = FOLDS[type(node.op)](a, b)
+            except (ArithmeticError, ValueError):
+                raise NotConstant()
+
+            if value.bit_length() <= MAX_FOLDED_BITS:
+                return value
+
+    raise NotConstant()
+
+
+def is_constant(node):
+    try:
+        constant(node)
+    except NotConstant:
+        return False
+
+    return True
+
+
+def first_line(node):
+    return min([node.lineno] + [d.lineno for d in node.decorator_list])
+
+
+def stored_names(nodes):
+    names = set()
+    for node in nodes:
+        for child in ast.walk(node):
+            if isinstance(child, ast.Name) and \
+                    not isinstance(child.ctx, ast.Load):
+                names.add(child.id)
+
+    return names
+
+
+@functools.lru_cache(maxsize=32)
+def parse(source, filename):
+    return ast.parse(source, filename)
+
+
+def find_node(tree, code):
+    if code.co_name == '<module>':
+        return tree
+
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)) and \
+                node.name == code.co_name and \
+                first_line(node) == code.co_firstlineno:
+            return node
+
+    assert 0, "No definition of {} at {}:{}".format(
+        code.co_name, code.co_filename, code.co_firstlineno)
+
+
+class Lowering:
+    def __init__(self, code, node):
+        self.code = code
+        self.node = node
+        self.function = isinstance(node, ast.FunctionDef)
+        self.out = []
+        self.line = None
+        self.statement_line = None
+
+        # the innermost loop is last, (continue label, break label)
+        self.loops = []
+
+    def fail(self, node, message):
+        assert 0, "{} at {}:{}".format(
+            message, self.code.co_filename, getattr(node, 'lineno', '?'))
+
+    def label(self):
+        return Label()
+
+    def bind(self, label):
+        label.index = len(self.out)
+
+    def emit(self, opname, arg=None, argval=None):
+        line = None
+        if self.statement_line != self.line:
+            line = self.line = self.statement_line
+
+        self.out.append([opname, arg, argval, line])
+
+    def run(self):
+        # docstrings are string statements, those emit nothing
+        body = self.node.body
+        self.statements(body)
+
+        if not body or not self.terminal(body[-1]):
+            self.emit('LOAD_CONST', None, None)
+            self.emit('RETURN_VALUE')
+
+        return self.finish()
+
+    def finish(self):
+        # labels become offsets of the instructions they are bound to
+        def offset(label):
+            return label.index * 2
+
+        for item in self.out:
+            if item[0] in JUMPS:
+                item[2] = offset(item[2])
+
+        targets = set(item[2] for item in self.out if item[0] in JUMPS)
+
+        return [
+            Instruction(opname, arg, argval, i * 2, line, i * 2 in targets)
+            for i, (opname, arg, argval, line) in enumerate(self.out)]
+
+    def terminal(self, node):
+        return isinstance(node, (ast.Return, ast.Break, ast.Continue))
+
+    # statements
+
+    def statements(self, nodes):
+        for node in nodes:
+            self.statement_line = node.lineno
+            handler = getattr(self, 'statement_' + type(node).__name__, None)
+            if handler is None:
+                self.fail(node, "Unsupported statement " + type(node).__name__)
+            handler(node)
+
+            # nothing after these is reachable
+            if self.terminal(node):
+                return
+
+    def statement_Pass(self, node):
+        pass
+
+    def statement_Expr(self, node):
+        if isinstance(constant_or_none(node.value), str):
+            return
+
+        self.expression(node.value)
+        self.emit('POP_TOP')
+
+    def statement_Assign(self, node):
+        self.expression(node.value)
+
+        for target in node.targets[:-1]:
+            self.emit('DUP_TOP')
+            self.store(target)
+        self.store(node.targets[-1])
+
+    def statement_AugAssign(self, node):
+        target = node.target
+        inplace = 'INPLACE_' + BINARY_OPS[type(node.op)]
+
+        if isinstance(target, ast.Name):
+            self.load_name(target.id)
+            self.expression(node.value)
+            self.emit(inplace)
+            self.store(target)
+        elif isinstance(target, ast.Subscript):
+            # object and index are evaluated twice, they have to be pure
+            index = subscript_index(target)
+            if not all(self.pure(n) for n in (target.value, index)):
+                self.fail(node, "Augmented subscript needs plain operands")
+
+            for _ in range(2):
+                self.expression(target.value)
+                self.subscript(index)
+            self.emit('BINARY_SUBSCR')
+            self.expression(node.value)
+            self.emit(inplace)
+            self.emit('ROT_THREE')
+            self.emit('STORE_SUBSCR')
+        else:
+            self.fail(node, "Unsupported augmented assignment")
+
+    def statement_Return(self, node):
+        if node.value is None:
+            self.emit('LOAD_CONST', None, None)
+        else:
+            self.expression(node.value)
+        self.emit('RETURN_VALUE')
+
+    def statement_If(self, node):
+        orelse = self.label()
+        end = self.label()
+
+        self.jump_if(node.test, orelse, False)
+        self.statements(node.body)
+
+        if node.orelse:
+            if not self.terminal(node.body[-1]):
+                self.emit('JUMP_ABSOLUTE', None, end)
+            self.bind(orelse)
+            self.statements(node.orelse)
+        else:
+            self.bind(orelse)
+
+        self.bind(end)
+
+    def statement_While(self, node):
+        head = self.label()
+        exit = self.label()
+        end = self.label()
+
+        self.emit('SETUP_LOOP', None, end)
+        self.bind(head)
+        if not (is_constant(node.test) and constant(node.test)):
+            self.jump_if(node.test, exit, False)
+
+        self.loop_body(node.body, head, end)
+        self.statement_line = node.lineno
+        self.emit('JUMP_ABSOLUTE', None, head)
+
+        self.bind(exit)
+        self.emit('POP_BLOCK')
+        self.statements(node.orelse)
+        self.bind(end)
+
+    def statement_For(self, node):
+        # only counting loops; the next value is compared before it is
+        # stored, so the variable ends on the last value like in python
+        # and is left alone when the loop doesn't run
+        target, call = node.target, node.iter
+        if not (isinstance(target, ast.Name) and isinstance(call, ast.Call)
+                and isinstance(call.func, ast.Name)
+                and call.func.id == 'range' and not call.keywords
+                and 1 <= len(call.args) <= 3):
+            self.fail(node, "Only for loops over range() are supported")
+
+        args = call.args
+        start = args[0] if len(args) > 1 else ast.Constant(0)
+        stop = args[1] if len(args) > 1 else args[0]
+        step = 1
+        if len(args) == 3:
+            step = constant_or_none(args[2])
+            if not isinstance(step, int) or step == 0:
+                self.fail(node, "range() step has to be a nonzero constant")
+
+        # the bound is evaluated on every iteration instead of once, the
+        # start twice
+        stored = stored_names(node.body)
+        if target.id in stored or not self.pure(stop) or any(
+                isinstance(n, ast.Name) and n.id in stored
+                for n in ast.walk(stop)):
+            self.fail(node, "range() bound and loop variable can't change")
+        if any(isinstance(n, ast.Call) for n in ast.walk(start)):
+            self.fail(node, "range() start can't call anything")
+
+        head = self.label()
+        step_label = self.label()
+        exit = self.label()
+        end = self.label()
+        compare = '<' if step > 0 else '>'
+
+        self.emit('SETUP_LOOP', None, end)
+        self.expression(start)
+        self.expression(stop)
+        self.emit('COMPARE_OP', None, compare)
+        self.emit('POP_JUMP_IF_FALSE', None, exit)
+        self.expression(start)
+        self.store(target)
+
+        self.bind(head)
+        self.loop_body(node.body, step_label, end)
+
+        self.bind(step_label)
+        self.statement_line = node.lineno
+        self.load_name(target.id)
+        self.emit('LOAD_CONST', None, step)
+        self.emit('BINARY_ADD')
+        self.expression(stop)
+        self.emit('COMPARE_OP', None, compare)
+        self.emit('POP_JUMP_IF_FALSE', None, exit)
+        self.load_name(target.id)
+        self.emit('LOAD_CONST', None, step)
+        self.emit('INPLACE_ADD')
+        self.store(target)
+        self.emit('JUMP_ABSOLUTE', None, head)
+
+        self.bind(exit)
+        self.emit('POP_BLOCK')
+        self.statements(node.orelse)
+        self.bind(end)
+
+    def loop_body(self, body, continue_label, break_label):
+        self.loops.append((continue_label, break_label))
+        self.statements(body)
+        self.loops.pop()
+
+    def statement_Break(self, node):
+        if not self.loops:
+            self.fail(node, "break outside of a loop")
+        self.emit('JUMP_ABSOLUTE', None, self.loops[-1][1])
+
+    def statement_Continue(self, node):
+        if not self.loops:
+            self.fail(node, "continue outside of a loop")
+        self.emit('JUMP_ABSOLUTE', None, self.loops[-1][0])
+
+    def statement_FunctionDef(self, node):
+        if self.function:
+            self.fail(node, "Nested functions aren't supported")
+
+        arguments = node.args
+        if arguments.defaults or arguments.kw_defaults or \
+                arguments.vararg or arguments.kwarg or \
+                arguments.kwonlyargs:
+            self.fail(node, "Only plain positional parameters are supported")
+
+        for decorator in node.decorator_list:
+            self.expression(decorator)
+
+        annotated = [
+            (a.arg, a.annotation) for a in arguments.args if a.annotation]
+        if node.returns:
+            annotated.append(('return', node.returns))
+
+        for name, annotation in annotated:
+            self.emit('LOAD_CONST', None, name)
+            self.expression(annotation)
+        if annotated:
+            self.emit('BUILD_TUPLE', len(annotated) * 2, len(annotated) * 2)
+
+        code = self.nested_code(node)
+        self.emit('LOAD_CONST', None, code)
+        self.emit('LOAD_CONST', None, self.qualname(code))
+        flags = 4 if annotated else 0
+        self.emit('MAKE_FUNCTION', flags, flags)
+
+        for _ in node.decorator_list:
+            self.emit('CALL_FUNCTION', 1, 1)
+        self.store_name(node.name)
+
+    def statement_ClassDef(self, node):
+        if self.function:
+            self.fail(node, "Nested classes aren't supported")
+        if node.keywords or node.decorator_list:
+            self.fail(node, "Class keywords and decorators aren't supported")
+
+        code = self.nested_code(node)
+        self.emit('LOAD_BUILD_CLASS')
+        self.emit('LOAD_CONST', None, code)
+        self.emit('LOAD_CONST', None, node.name)
+        self.emit('MAKE_FUNCTION', 0, 0)
+        self.emit('LOAD_CONST', None, node.name)
+        for base in node.bases:
+            self.expression(base)
+        count = len(node.bases) + 2
+        self.emit('CALL_FUNCTION', count, count)
+        self.store_name(node.name)
+
+    def nested_code(self, node):
+        for const in self.code.co_consts:
+            if isinstance(const, types.CodeType) and \
+                    const.co_name == node.name and \
+                    const.co_firstlineno == first_line(node):
+                return const
+
+        self.fail(node, "No code object for " + node.name)
+
+    def qualname(self, code):
+        if hasattr(code, 'co_qualname'):
+            return code.co_qualname
+
+        if isinstance(self.node, ast.ClassDef):
+            return '{}.{}'.format(self.node.name, code.co_name)
+
+        return code.co_name
+
+    # stores and loads
+
+    def store(self, target):
+        if isinstance(target, ast.Name):
+            self.store_name(target.id)
+        elif isinstance(target, ast.Subscript):
+            self.expression(target.value)
+            self.subscript(subscript_index(target))
+            self.emit('STORE_SUBSCR')
+        elif isinstance(target, ast.Attribute):
+            self.expression(target.value)
+            self.emit('STORE_ATTR', None, target.attr)
+        elif isinstance(target, ast.Tuple):
+            count = len(target.elts)
+            self.emit('UNPACK_SEQUENCE', count, count)
+            for element in target.elts:
+                self.store(element)
+        else:
+            self.fail(target, "Unsupported assignment target")
+
+    def store_name(self, name):
+        if not self.function:
+            self.emit('STORE_NAME', None, name)
+        elif name in self.code.co_varnames:
+            self.emit('STORE_FAST', self.code.co_varnames.index(name), name)
+        else:
+            self.fail(self.node, "Can't assign global " + name)
+
+    def load_name(self, name):
+        if not self.function:
+            self.emit('LOAD_NAME', None, name)
+        elif name in self.code.co_varnames:
+            self.emit('LOAD_FAST', self.code.co_varnames.index(name), name)
+        else:
+            self.emit('LOAD_GLOBAL', None, name)
+
+    def pure(self, node):
+        return is_constant(node) or isinstance(node, ast.Name) or (
+            isinstance(node, ast.Attribute) and self.pure(node.value))
+
+    # expressions
+
+    def expression(self, node):
+        if is_constant(node):
+            self.emit('LOAD_CONST', None, constant(node))
+            return
+
+        handler = getattr(self, 'expression_' + type(node).__name__, None)
+        if handler is None:
+            self.fail(node, "Unsupported expression " + type(node).__name__)
+        handler(node)
+
+    def expression_Name(self, node):
+        self.load_name(node.id)
+
+    def expression_Attribute(self, node):
+        self.expression(node.value)
+        self.emit('LOAD_ATTR', None, node.attr)
+
+    def expression_Subscript(self, node):
+        self.expression(node.value)
+        self.subscript(subscript_index(node))
+        self.emit('BINARY_SUBSCR')
+
+    def subscript(self, index):
+        if isinstance(index, ast.Slice):
+            if index.step is not None:
+                self.fail(index, "Slices with a step aren't supported")
+            for bound in (index.lower, index.upper):
+                if bound is None:
+                    self.emit('LOAD_CONST', None, None)
+                else:
+                    self.expression(bound)
+            self.emit('BUILD_SLICE', 2, 2)
+        else:
+            self.expression(index)
+
+    def expression_BinOp(self, node):
+        self.expression(node.left)
+        self.expression(node.right)
+        self.emit('BINARY_' + BINARY_OPS[type(node.op)])
+
+    def expression_UnaryOp(self, node):
+        self.expression(node.operand)
+        self.emit(UNARY_OPS[type(node.op)])
+
+    def expression_Compare(self, node):
+        if len(node.ops) != 1:
+            self.fail(node, "Chained comparisons aren't supported")
+
+        self.expression(node.left)
+        self.expression(node.comparators[0])
+        self.emit('COMPARE_OP', None, COMPARE_OPS[type(node.ops[0])])
+
+    def expression_IfExp(self, node):
+        orelse = self.label()
+        end = self.label()
+
+        self.jump_if(node.test, orelse, False)
+        self.expression(node.body)
+        self.emit('JUMP_ABSOLUTE', None, end)
+        self.bind(orelse)
+        self.expression(node.orelse)
+        self.bind(end)
+
+    def expression_Tuple(self, node):
+        for element in node.elts:
+            self.expression(element)
+        self.emit('BUILD_TUPLE', len(node.elts), len(node.elts))
+
+    def expression_Call(self, node):
+        if any(isinstance(a, ast.Starred) for a in node.args) or \
+                any(k.arg is None for k in node.keywords):
+            self.fail(node, "Argument unpacking isn't supported")
+
+        count = len(node.args) + len(node.keywords)
+
+        # methods are only looked up in functions, namespaces call
+        # attributes of python objects
+        if self.function and isinstance(node.func, ast.Attribute) and \
+                not node.keywords:
+            self.expression(node.func.value)
+            self.emit('LOAD_METHOD', None, node.func.attr)
+            for argument in node.args:
+                self.expression(argument)
+            self.emit('CALL_METHOD', count, count)
+            return
+
+        self.expression(node.func)
+        for argument in node.args:
+            self.expression(argument)
+
+        if node.keywords:
+            for keyword in node.keywords:
+                self.expression(keyword.value)
+            self.emit(
+                'LOAD_CONST', None, tuple(k.arg for k in node.keywords))
+            self.emit('CALL_FUNCTION_KW', count, count)
+        else:
+            self.emit('CALL_FUNCTION', count, count)
+
+    # conditions jump directly, there is no boolean value in between
+
+    def jump_if(self, node, target, when):
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            self.jump_if(node.operand, target, not when)
+        elif isinstance(node, ast.BoolOp):
+            # and jumps away on the first false operand, or on the first
+            # true one; the last operand decides otherwise
+            short = isinstance(node.op, ast.Or)
+            if short == when:
+                for value in node.values:
+                    self.jump_if(value, target, when)
+            else:
+                skip = self.label()
+                for value in node.values[:-1]:
+                    self.jump_if(value, skip, short)
+                self.jump_if(node.values[-1], target, when)
+                self.bind(skip)
+        else:
+            self.expression(node)
+            self.emit(
+                'POP_JUMP_IF_TRUE' if when else 'POP_JUMP_IF_FALSE',
+                None, target)
+
+
+def constant_or_none(node):
+    try:
+        return constant(node)
+    except NotConstant:
+        return None
+
+
+def subscript_index(node):
+    index = node.slice
+    if WRAPPED_INDEX and isinstance(index, ast.Index):
+        return index.value
+
+    return index
+
+
+def source_of(code):
+    source = get_source(code.co_filename)
+    if source is None:
+        source = ''.join(linecache.getlines(code.co_filename))
+
+    assert source, \
+        "No source for {}, the ast frontend needs it".format(
+            code.co_filename)
+
+    return source
+
+
+def lower(code):
+    tree = parse(source_of(code), code.co_filename)
+
+    return Lowering(code, find_node(tree, code)).run()
@@ -0,0 +1,390 @@
+from collections import OrderedDict
+
+
+# context methods building expressions, equal calls give the same Value
+EXPRESSIONS = frozenset([
+    'cast', 'comparison', 'binary', 'unary', 'address', 'call', 'integer',
+    'null', 'string_literal', 'access_field', 'access_field_lvalue',
+    'dereference_field', 'dereference', 'array_access', 'function_address'
+])
+
+# expressions that read memory when used as a value
+LOADS = frozenset([
+    'access_field', 'access_field_lvalue', 'dereference_field',
+    'dereference', 'array_access'
+])
+
+VARIABLES = frozenset([
+    'param', 'local', 'exported_global', 'internal_global',
+    'imported_global', 'thread_local_global'
+])
+
+FUNCTIONS = frozenset([
+    'exported_function', 'internal_function', 'imported_function',
+    'builtin_function'
+])
+
+# types and locations belong to the backend, they aren't code
+PASS_THROUGH = frozenset(['type', 'struct_type', 'location'])
+
+
+def freeze(args):
+    return tuple(freeze(a) if isinstance(a, list) else a for a in args)
+
+
+def realize(arg):
+    if isinstance(arg, (Node, Block)):
+        return arg.realize()
+    if isinstance(arg, (list, tuple)):
+        return [realize(a) for a in arg]
+
+    return arg
+
+
+class Node:
+    def __init__(self, context, method, args):
+        self.context = context
+        self.method = method
+        self.args = args
+        self.real = None
+
+    def realize(self):
+        if self.real is None:
+            self.real = getattr(self.context.backend, self.method)(
+                *realize(self.args))
+
+        return self.real
+
+    def operands(self):
+        for arg in self.args:
+            if isinstance(arg, tuple):
+                yield from (a for a in arg if isinstance(a, Node))
+            elif isinstance(arg, Node):
+                yield arg
+
+
+class Value(Node):
+    def __init__(self, context, method, args, ctype):
+        super().__init__(context, method, args)
+        self.ctype = ctype
+
+    def __repr__(self):
+        return '<Value {}>'.format(format_value(self))
+
+
+class Declaration(Node):
+    def __init__(self, context, method, args):
+        super().__init__(context, method, args)
+        self.blocks = []
+
+        if method in VARIABLES:
+            self.ctype = args[1] if method == 'local' else args[0]
+            self.name = args[2] if method == 'local' else args[1]
+        elif method == 'builtin_function':
+            self.ctype = None
+            self.name = args[0]
+        else:
+            self.ctype = args[0]
+            self.name = args[1]
+
+    def __repr__(self):
+        return '<{} {}>'.format(self.method, self.name)
+
+
+class Block:
+    def __init__(self, context, function, name):
+        self.context = context
+        self.function = function
+        self.name = name
+        self.statements = []
+        self.terminator = None
+        self.real = None
+
+    def realize(self):
+        if self.real is None:
+            function = self.function.realize()
+            if self.name is None:
+                self.real = self.context.backend.block(function)
+            else:
+                self.real = self.context.backend.block(function, self.name)
+
+        return self.real
+
+    def add_assignment(self, *args):
+        self.statements.append(('add_assignment', freeze(args)))
+
+    def add_eval(self, *args):
+        self.statements.append(('add_eval', freeze(args)))
+
+    def end_with_jump(self, *args):
+        self.terminator = ('end_with_jump', args)
+
+    def end_with_conditonal(self, *args):
+        self.terminator = ('end_with_conditonal', args)
+
+    def end_with_return(self, *args):
+        self.terminator = ('end_with_return', args)
+
+    def end_with_void_return(self, *args):
+        self.terminator = ('end_with_void_return', args)
+
+    def successors(self):
+        method, args = self.terminator
+        if method == 'end_with_jump':
+            return [args[0]]
+        if method == 'end_with_conditonal':
+            return [args[1], args[2]]
+
+        return []
+
+    def emit(self):
+        block = self.realize()
+
+        for method, args in self.statements + [self.terminator]:
+            getattr(block, method)(*realize(args))
+
+    def __repr__(self):
+        return '<Block {}>'.format(self.label())
+
+    def label(self):
+        index = self.function.blocks.index(self)
+        if self.name is None:
+            return 'block{}'.format(index)
+
+        return 'block{} {!r}'.format(index, self.name)
+
+
+def reachable(function):
+    if not function.blocks:
+        return []
+
+    seen = OrderedDict([(function.blocks[0], None)])
+    work = [function.blocks[0]]
+    while work:
+        for successor in work.pop().successors():
+            if successor not in seen:
+                seen[successor] = None
+                work.append(successor)
+
+    # creation order, the first block is the entry
+    return [b for b in function.blocks if b in seen]
+
+
+# records everything the compilers build and replays it onto a backend
+# context once the passes ran over it; expressions are interned values,
+# but locals are assigned as often as the compilers like, it isn't SSA
+class Context:
+    def __init__(self, backend, passes=None, parent=None):
+        from xpython.ir.passes import PassManager
+
+        self.backend = backend
+        self.manager = PassManager(passes)
+        self.values = {}
+        self.pending = []
+        self.initializers = []
+
+        # type information is shared with the parent, like the types are
+        if parent is None:
+            self.field_types = {}
+            self.field_names = {}
+            self.pointees = {}
+        else:
+            self.field_types = parent.field_types
+            self.field_names = parent.field_names
+            self.pointees = parent.pointees
+
+    def __getattr__(self, name):
+        if name in EXPRESSIONS:
+            return lambda *args: self.value(name, *args)
+        if name in VARIABLES or name in FUNCTIONS:
+            return lambda *args: self.declare(name, *args)
+        if name in PASS_THROUGH:
+            return getattr(self.backend, name)
+
+        raise AttributeError(name)
+
+    def value(self, method, *args):
+        args = freeze(args)
+        key = (method,) + args
+        if key not in self.values:
+            self.values[key] = Value(
+                self, method, args, self.ctype_of(method, args))
+
+        return self.values[key]
+
+    def ctype_of(self, method, args):
+        if method in ('cast', 'binary', 'unary'):
+            return args[1]
+        if method == 'integer':
+            return args[1] if len(args) > 1 else None
+        if method == 'null':
+            return args[0]
+        if method in ('access_field', 'access_field_lvalue',
+                      'dereference_field'):
+            return self.field_types.get(args[1])
+        if method in ('dereference', 'array_access'):
+            return self.pointees.get(getattr(args[0], 'ctype', None))
+        if method == 'call' and args[0].method != 'builtin_function':
+            return args[0].ctype
+
+        return None
+
+    def declare(self, method, *args):
+        # builtins are known by name, the same name is the same function
+        if method == 'builtin_function':
+            key = (method,) + args
+            if key not in self.values:
+                self.values[key] = Declaration(self, method, args)
+
+            return self.values[key]
+
+        declaration = Declaration(self, method, freeze(args))
+        if method in ('exported_function', 'internal_function'):
+            self.pending.append(declaration)
+
+        return declaration
+
+    def field(self, ctype, name):
+        field = self.backend.field(ctype, name)
+        self.field_types[field] = ctype
+        self.field_names[field] = name
+
+        return field
+
+    def pointer_type(self, ctype):
+        pointer = self.backend.pointer_type(ctype)
+        self.pointees[pointer] = ctype
+
+        return pointer
+
+    def array_type(self, ctype, length):
+        array = self.backend.array_type(ctype, length)
+        self.pointees[array] = ctype
+
+        return array
+
+    def block(self, function, name=None):
+        block = Block(self, function, name)
+        function.blocks.append(block)
+
+        return block
+
+    def set_initializer(self, lvalue, blob):
+        self.initializers.append((lvalue, blob))
+
+    def new_child_context(self):
+        return Context(
+            self.backend.new_child_context(), self.manager.passes, self)
+
+    def reset(self):
+        self.backend.reset()
+        self.values = {}
+        self.pending = []
+        self.initializers = []
+
+    def optimize(self):
+        self.manager.run(self, self.pending)
+
+    def emit(self):
+        for function in self.pending:
+            function.realize()
+            blocks = reachable(function)
+            for block in blocks:
+                block.realize()
+            for block in blocks:
+                block.emit()
+
+        for lvalue, blob in self.initializers:
+            self.backend.set_initializer(lvalue.realize(), blob)
+
+        self.pending = []
+        self.initializers = []
+
+    def compile(self):
+        self.optimize()
+        self.emit()
+
+        return self.backend.compile()
+
+    def compile_to_file(self, output_kind, path):
+        self.optimize()
+        self.emit()
+
+        return self.backend.compile_to_file(output_kind, path)
+
+    def dump(self, functions=None):
+        lines = []
+        for function in functions or self.pending:
+            lines.append('{} {}({}):'.format(
+                function.method, function.name,
+                ', '.join(format_value(p) for p in function.args[2])))
+
+            for block in reachable(function):
+                lines.append('  {}:'.format(block.label()))
+                for method, args in block.statements + [block.terminator]:
+                    lines.append('    ' + format_statement(method, args))
+
+        return '\n'.join(lines)
+
+
+def format_value(value):
+    if not isinstance(value, Node):
+        return repr(value)
+
+    if isinstance(value, Declaration):
+        return value.name
+
+    method, args = value.method, value.args
+    names = value.context.field_names
+
+    if method == 'integer' or method == 'string_literal':
+        return repr(args[0])
+    if method == 'null':
+        return 'NULL'
+    if method == 'cast':
+        return '({}){}'.format(args[1], format_value(args[0]))
+    if method == 'comparison':
+        return '({} {} {})'.format(
+            format_value(args[1]), args[0], format_value(args[2]))
+    if method == 'binary':
+        return '({} {} {})'.format(
+            format_value(args[2]), args[0], format_value(args[3]))
+    if method == 'unary':
+        return '{}{}'.format(args[0], format_value(args[2]))
+    if method == 'address':
+        return '&' + format_value(args[0])
+    if method == 'call':
+        arguments = args[1] if len(args) > 1 else ()
+        return '{}({})'.format(
+            format_value(args[0]),
+            ', '.join(format_value(a) for a in arguments))
+    if method in ('access_field', 'access_field_lvalue'):
+        return '{}.{}'.format(
+            format_value(args[0]), names.get(args[1], args[1]))
+    if method == 'dereference_field':
+        return '{}->{}'.format(
+            format_value(args[0]), names.get(args[1], args[1]))
+    if method == 'dereference':
+        return '*' + format_value(args[0])
+    if method == 'array_access':
+        return '{}[{}]'.format(format_value(args[0]), format_value(args[1]))
+    if method == 'function_address':
+        return '&' + format_value(args[0])
+
+    return '{}{}'.format(method, args)
+
+
+def format_statement(method, args):
+    if method == 'add_assignment':
+        return '{} = {}'.format(format_value(args[0]), format_value(args[1]))
+    if method == 'add_eval':
+        return format_value(args[0])
+    if method == 'end_with_jump':
+        return 'goto {}'.format(args[0].label())
+    if method == 'end_with_conditonal':
+        return 'if {} goto {} else {}'.format(
+            format_value(args[0]), args[1].label(), args[2].label())
+    if method == 'end_with_return':
+        return 'return {}'.format(format_value(args[0]))
+
+    return 'return'
@@ -0,0 +1,841 @@
+import time
+from collections import Counter, OrderedDict
+
+from xpython.ir import Value, Declaration, LOADS, reachable
+
+
+# calls without side effects, they can be shared and moved like arithmetic
+PURE_BUILTINS = frozenset([
+    '__builtin_expect', '__builtin_bswap16', '__builtin_bswap32',
+    '__builtin_bswap64'
+])
+
+# these write their result through the pointer they get last
+OVERFLOW_BUILTINS = frozenset([
+    '__builtin_add_overflow', '__builtin_sub_overflow',
+    '__builtin_mul_overflow'
+])
+
+TRAPPING = frozenset(['/', '%'])
+
+COMPARISONS = {
+    '==': lambda a, b: a == b, '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b, '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b, '>=': lambda a, b: a >= b,
+}
+
+# blocks of one function are searched for shared work up to this size
+MAX_STATEMENTS = 100000
+
+MAX_ROUNDS = 100
+
+
+class Effects:
+    def __init__(self):
+        self.variables = set()
+        self.memory = set()
+        self.all_memory = False
+        self.impure = False
+
+        # what evaluating it writes
+        self.stores = set()
+        self.clobbers = False
+
+    def update(self, other):
+        self.variables |= other.variables
+        self.memory |= other.memory
+        self.all_memory |= other.all_memory
+        self.impure |= other.impure
+        self.stores |= other.stores
+        self.clobbers |= other.clobbers
+
+    def kills(self, effects):
+        # self is what a statement writes, effects what a value reads
+        if self.variables & effects.variables:
+            return True
+        if not effects.memory:
+            return False
+
+        return self.all_memory or bool(self.memory & effects.memory)
+
+
+def constant(effects):
+    return not effects.variables and not effects.memory
+
+
+def variable_of(lvalue):
+    # the variable a store through this lvalue changes, if any
+    while isinstance(lvalue, Value) and \
+            lvalue.method == 'access_field_lvalue':
+        lvalue = lvalue.args[0]
+
+    if isinstance(lvalue, Declaration):
+        return lvalue
+
+    return None
+
+
+class Analysis:
+    def __init__(self, function):
+        self.function = function
+        self.blocks = reachable(function)
+        self.predecessors = OrderedDict((b, []) for b in self.blocks)
+        for block in self.blocks:
+            for successor in block.successors():
+                self.predecessors[successor].append(block)
+
+        self.address_taken = set()
+        self.assignments = Counter()
+        for block in self.blocks:
+            for method, args in statements(block):
+                for value in args:
+                    self.find_addresses(value)
+
+                if method == 'add_assignment':
+                    variable = variable_of(args[0])
+                    if variable is not None:
+                        self.assignments[variable] += 1
+
+        self.memo = {}
+        self._dominators = None
+
+    def find_addresses(self, value):
+        if isinstance(value, tuple):
+            for v in value:
+                self.find_addresses(v)
+        elif isinstance(value, Value):
+            if value.method == 'address':
+                variable = variable_of(value.args[0])
+                if variable is not None:
+                    self.address_taken.add(variable)
+            for operand in value.operands():
+                self.find_addresses(operand)
+
+    def in_memory(self, variable):
+        return variable.method not in ('param', 'local') or \
+            variable in self.address_taken
+
+    def effects(self, value):
+        if value in self.memo:
+            return self.memo[value]
+
+        effects = Effects()
+        if isinstance(value, Declaration):
+            if value.method in ('param', 'local', 'exported_global',
+                                'internal_global', 'imported_global',
+                                'thread_local_global'):
+                if self.in_memory(value):
+                    effects.memory.add(('variable', value))
+                else:
+                    effects.variables.add(value)
+        elif isinstance(value, Value):
+            method = value.method
+
+            if method == 'address':
+                effects.update(self.address_effects(value.args[0]))
+            else:
+                for operand in value.operands():
+                    if method == 'call' and operand is value.args[0]:
+                        continue
+                    effects.update(self.effects(operand))
+
+            if method == 'dereference_field':
+                effects.memory.add(('field', value.args[1]))
+            elif method in ('dereference', 'array_access'):
+                effects.memory.add('array')
+            elif method == 'call':
+                function = value.args[0]
+                builtin = function.method == 'builtin_function'
+                if builtin and function.name in OVERFLOW_BUILTINS:
+                    effects.impure = True
+                    effects.stores |= self.stores_through(value.args[1][-1])
+                elif not builtin or function.name not in PURE_BUILTINS:
+                    effects.impure = True
+                    effects.clobbers = True
+
+        self.memo[value] = effects
+
+        return effects
+
+    def address_effects(self, lvalue):
+        # taking an address reads what leads to it, not the value
+        if isinstance(lvalue, Declaration):
+            return Effects()
+        if lvalue.method == 'access_field_lvalue':
+            return self.address_effects(lvalue.args[0])
+
+        effects = Effects()
+        for operand in lvalue.operands():
+            effects.update(self.effects(operand))
+
+        return effects
+
+    def stores_through(self, pointer):
+        variable = None
+        if isinstance(pointer, Value) and pointer.method == 'address':
+            variable = variable_of(pointer.args[0])
+
+        if variable is None:
+            return set(['array'])
+        if self.in_memory(variable):
+            return set([('variable', variable)])
+
+        return set()
+
+    def writes(self, method, args):
+        effects = Effects()
+
+        if method == 'add_assignment':
+            lvalue = args[0]
+            variable = variable_of(lvalue)
+            if variable is not None:
+                if self.in_memory(variable):
+                    effects.memory.add(('variable', variable))
+                else:
+                    effects.variables.add(variable)
+            elif lvalue.method == 'dereference_field':
+                effects.memory.add(('field', lvalue.args[1]))
+            elif lvalue.method == 'array_access':
+                # buffer data never holds the structs describing it
+                effects.memory.add('array')
+            else:
+                effects.all_memory = True
+
+        for value in args:
+            if isinstance(value, (Value, Declaration)):
+                evaluated = self.effects(value)
+                effects.memory |= evaluated.stores
+                effects.all_memory |= evaluated.clobbers
+
+        return effects
+
+    def dominators(self):
+        # immediate dominators, Cooper, Harvey and Kennedy
+        if self._dominators is not None:
+            return self._dominators
+
+        order = []
+        seen = set()
+        stack = [(self.blocks[0], iter(self.blocks[0].successors()))]
+        seen.add(self.blocks[0])
+        while stack:
+            block, successors = stack[-1]
+            for successor in successors:
+                if successor not in seen:
+                    seen.add(successor)
+                    stack.append((successor, iter(successor.successors())))
+                    break
+            else:
+                order.append(block)
+                stack.pop()
+        order.reverse()
+        number = {b: i for i, b in enumerate(order)}
+
+        idom = {order[0]: order[0]}
+        changed = True
+        while changed:
+            changed = False
+            for block in order[1:]:
+                new = None
+                for predecessor in self.predecessors[block]:
+                    if predecessor not in idom:
+                        continue
+                    if new is None:
+                        new = predecessor
+                        continue
+                    a, b = predecessor, new
+                    while a is not b:
+                        while number[a] > number[b]:
+                            a = idom[a]
+                        while number[b] > number[a]:
+                            b = idom[b]
+                    new = a
+                if idom.get(block) is not new:
+                    idom[block] = new
+                    changed = True
+
+        self._dominators = idom
+
+        return idom
+
+    def dominates(self, a, b):
+        idom = self.dominators()
+        while True:
+            if a is b:
+                return True
+            if idom[b] is b:
+                return False
+            b = idom[b]
+
+
+def statements(block):
+    return block.statements + [block.terminator]
+
+
+def set_statement(block, index, statement):
+    if index == len(block.statements):
+        block.terminator = statement
+    else:
+        block.statements[index] = statement
+
+
+def substitute(value, mapping, lvalue=False):
+    if isinstance(value, tuple):
+        return tuple(substitute(v, mapping) for v in value)
+    if not lvalue and value in mapping:
+        return mapping[value]
+    if not isinstance(value, Value):
+        return value
+
+    method, args = value.method, value.args
+    if method == 'address':
+        new = (substitute(args[0], mapping, True),)
+    elif method == 'access_field_lvalue':
+        new = (substitute(args[0], mapping, True),) + args[1:]
+    else:
+        new = tuple(substitute(a, mapping) for a in args)
+
+    if all(a is b for a, b in zip(new, args)):
+        return value
+
+    return value.context.value(method, *new)
+
+
+def substitute_statement(statement, mapping):
+    method, args = statement
+    if method == 'add_assignment':
+        return method, (substitute(args[0], mapping, True),) + tuple(
+            substitute(a, mapping) for a in args[1:])
+
+    return method, tuple(substitute(a, mapping) for a in args)
+
+
+def candidates(value, found, lvalue=False):
+    # shareable subexpressions in evaluation order, lvalues stay in place
+    if not isinstance(value, Value):
+        return
+
+    method = value.method
+    if method == 'address':
+        candidates(value.args[0], found, True)
+    elif method == 'access_field_lvalue':
+        candidates(value.args[0], found, True)
+    else:
+        for operand in value.operands():
+            candidates(operand, found)
+
+    if not lvalue and value.ctype is not None and (
+            method in LOADS or method in ('binary', 'unary', 'cast')):
+        found.append(value)
+
+
+def statement_candidates(method, args):
+    found = []
+    for i, value in enumerate(args):
+        candidates(value, found, method == 'add_assignment' and i == 0)
+
+    return found
+
+
+def size(value):
+    if not isinstance(value, Value):
+        return 1
+
+    return 1 + sum(size(o) for o in value.operands())
+
+
+def occurrences(inner, value):
+    if value is inner:
+        return 1
+    if not isinstance(value, Value):
+        return 0
+
+    return sum(occurrences(inner, o) for o in value.operands())
+
+
+def materialize(context, function, shared):
+    # shared is a list of (value, positions, definition position), the
+    # value is computed once into a local at its definition position
+    inserts = {}
+    rewrites = {}
+    shared.sort(key=lambda item: size(item[0]))
+
+    for number, (value, positions, definition) in enumerate(shared):
+        local = context.local(function, value.ctype, 'cse{}'.format(number))
+        inserts.setdefault(definition, []).append((value, local))
+        for position in positions:
+            rewrites.setdefault(position, {})[value] = local
+
+    for block in set(p[0] for p in list(inserts) + list(rewrites)):
+        new = []
+        for index, statement in enumerate(statements(block)):
+            mapping = rewrites.get((block, index), {})
+            for value, local in inserts.get((block, index), ()):
+                # definitions use the locals defined before them
+                inner = dict((k, v) for k, v in mapping.items()
+                             if k is not value)
+                new.append(('add_assignment', (
+                    local, substitute(value, inner))))
+            new.append(substitute_statement(statement, mapping))
+
+        block.statements = new[:-1]
+        block.terminator = new[-1]
+
+
+def copy_propagation(context, function):
+    # a local holding a copy of a variable is replaced by the variable,
+    # which removes the temporaries loads go through
+    propagate_stable(Analysis(function))
+
+    for _ in range(MAX_ROUNDS):
+        if not propagate_forward(Analysis(function)):
+            return
+
+
+def copy_of(analysis, statement):
+    method, args = statement
+    if method != 'add_assignment':
+        return None
+
+    target, source = args[0], args[1]
+    if isinstance(target, Declaration) and isinstance(source, Declaration) \
+            and target.method == 'local' and target is not source \
+            and source.method in ('param', 'local') \
+            and not analysis.in_memory(target) \
+            and not analysis.in_memory(source) \
+            and analysis.assignments[target] == 1 \
+            and target.ctype is source.ctype:
+        return target, source
+
+    return None
+
+
+def propagate_stable(analysis):
+    # copies of variables that never change are those variables
+    copies = {}
+    changed = True
+    while changed:
+        changed = False
+        for block in analysis.blocks:
+            for statement in block.statements:
+                copy = copy_of(analysis, statement)
+                if copy is None or copy[0] in copies:
+                    continue
+                target, source = copy
+                if analysis.assignments[source] == 0 or source in copies:
+                    copies[target] = source
+                    changed = True
+
+    if not copies:
+        return
+
+    def resolve(variable):
+        while variable in copies:
+            variable = copies[variable]
+        return variable
+
+    mapping = dict((t, resolve(t)) for t in copies)
+    for block in analysis.blocks:
+        block.statements = [
+            substitute_statement(s, mapping) for s in block.statements
+            if not (s[0] == 'add_assignment' and s[1][0] in mapping)]
+        block.terminator = substitute_statement(block.terminator, mapping)
+
+
+def propagate_forward(analysis):
+    # other copies are replaced where the copied variable still holds the
+    # same value, that is after the copy within the extended basic block
+    # and before the next write to the variable
+    entry = analysis.blocks[0]
+    mentions = Counter()
+    for block in analysis.blocks:
+        for statement in statements(block):
+            count_mentions(statement[1], mentions)
+
+    changed = False
+    removed = set()
+    for block in analysis.blocks:
+        for index, statement in enumerate(block.statements):
+            copy = copy_of(analysis, statement)
+            if copy is None:
+                continue
+            target, source = copy
+            mapping = {target: source}
+
+            # the copy itself mentions the target once
+            uses = mentions[target] - 1
+            replaced = 0
+            work = [(block, index + 1)]
+            while work and replaced < uses:
+                current, start = work.pop()
+                written = False
+                for i in range(start, len(current.statements) + 1):
+                    old = statements(current)[i]
+                    reads = Counter()
+                    count_reads(old, reads)
+                    if reads[target]:
+                        set_statement(
+                            current, i, substitute_statement(old, mapping))
+                        replaced += reads[target]
+                    if source in analysis.writes(*old).variables:
+                        written = True
+                        break
+                if written:
+                    continue
+                for successor in current.successors():
+                    if successor is not entry and \
+                            analysis.predecessors[successor] == [current]:
+                        work.append((successor, 0))
+
+            if replaced:
+                changed = True
+            if replaced == uses:
+                removed.add((block, index))
+
+    for block in analysis.blocks:
+        block.statements = [
+            s for i, s in enumerate(block.statements)
+            if (block, i) not in removed]
+
+    return changed
+
+
+def count_mentions(value, counts):
+    if isinstance(value, tuple):
+        for v in value:
+            count_mentions(v, counts)
+    elif isinstance(value, Declaration):
+        counts[value] += 1
+    elif isinstance(value, Value):
+        count_mentions(value.args, counts)
+
+
+def count_reads(statement, counts):
+    method, args = statement
+    for i, value in enumerate(args):
+        count_value_reads(
+            value, counts, method == 'add_assignment' and i == 0)
+
+
+def count_value_reads(value, counts, lvalue=False):
+    if isinstance(value, Declaration):
+        if not lvalue:
+            counts[value] += 1
+    elif isinstance(value, Value):
+        method = value.method
+        if method in ('address', 'access_field_lvalue'):
+            count_value_reads(value.args[0], counts, True)
+            operands = value.args[1:]
+        else:
+            operands = value.args
+        for operand in operands:
+            if isinstance(operand, tuple):
+                for o in operand:
+                    count_value_reads(o, counts)
+            else:
+                count_value_reads(operand, counts)
+
+
+class Group:
+    def __init__(self, value, position):
+        self.value = value
+        self.definition = position
+        self.positions = []
+
+
+def common_subexpressions(context, function):
+    # value numbering over extended basic blocks, a block with a single
+    # predecessor sees what its predecessor computed
+    analysis = Analysis(function)
+    if sum(len(b.statements) for b in analysis.blocks) > MAX_STATEMENTS:
+        return
+
+    groups = []
+    entry = analysis.blocks[0]
+    roots = [b for b in analysis.blocks
+             if b is entry or len(analysis.predecessors[b]) != 1]
+    work = [(b, {}) for b in reversed(roots)]
+
+    while work:
+        block, available = work.pop()
+
+        for index, (method, args) in enumerate(statements(block)):
+            position = (block, index)
+            for value in statement_candidates(method, args):
+                if constant(analysis.effects(value)):
+                    continue
+                group = available.get(value)
+                if group is None:
+                    group = available[value] = Group(value, position)
+                    groups.append(group)
+                group.positions.append(position)
+
+            writes = analysis.writes(method, args)
+            for value in list(available):
+                if writes.kills(analysis.effects(value)):
+                    del available[value]
+
+        for successor in block.successors():
+            if successor is not entry and \
+                    analysis.predecessors[successor] == [block]:
+                work.append((successor, dict(available)))
+
+    # outer expressions first, what they contain is shared through them
+    groups.sort(key=lambda g: -size(g.value))
+    counts = dict((g, len(g.positions)) for g in groups)
+    shared = []
+    for group in groups:
+        if counts[group] < 2:
+            continue
+        shared.append(
+            (group.value, set(group.positions), group.definition))
+
+        for other in groups:
+            occurs = occurrences(other.value, group.value)
+            if other is group or not occurs:
+                continue
+            overlap = len([p for p in group.positions if p in other.positions])
+            if overlap:
+                counts[other] -= occurs * (overlap - 1)
+
+    if shared:
+        materialize(context, function, shared)
+
+
+def loops(analysis):
+    # natural loops, a back edge goes to a block dominating its source
+    found = OrderedDict()
+    for block in analysis.blocks:
+        for successor in block.successors():
+            if not analysis.dominates(successor, block):
+                continue
+
+            body = found.setdefault(successor, set([successor]))
+            work = [block]
+            while work:
+                member = work.pop()
+                if member in body:
+                    continue
+                body.add(member)
+                work.extend(analysis.predecessors[member])
+
+    return found
+
+
+def loop_invariant_code_motion(context, function):
+    # every hoist changes the loops, they are found again after each
+    for _ in range(MAX_ROUNDS):
+        if not hoist(context, function):
+            return
+
+
+def hoist(context, function):
+    analysis = Analysis(function)
+    entry = analysis.blocks[0]
+    found = loops(analysis)
+
+    # inner loops first, what they hoist can leave the outer loop next
+    for header in sorted(found, key=lambda h: len(found[h])):
+        body = found[header]
+        if header is entry:
+            continue
+
+        writes = [
+            analysis.writes(method, args)
+            for block in body for method, args in statements(block)]
+        exits = [
+            b for b in body if not b.successors()
+            or any(s not in body for s in b.successors())]
+        latches = [p for p in analysis.predecessors[header] if p in body]
+
+        def invariant(value):
+            effects = analysis.effects(value)
+            return not effects.impure and not constant(effects) and \
+                not any(w.kills(effects) for w in writes)
+
+        # the header runs whenever the loop is entered, fields of what it
+        # dereferences can be loaded before it
+        safe = set()
+        for method, args in statements(header):
+            dereferenced(args, safe)
+
+        # other code that can fault only moves if it runs on every way
+        # through the loop, the preheader computes it even when the loop
+        # exits right away
+        hoisted = OrderedDict()
+        for block in analysis.blocks:
+            if block not in body:
+                continue
+            always = all(
+                analysis.dominates(block, b) for b in exits + latches)
+            for method, args in statements(block):
+                for value in statement_candidates(method, args):
+                    if invariant(value) and (
+                            always or speculatable(value, safe)):
+                        hoisted[value] = None
+
+        # outer invariant expressions cover their operands
+        for value in list(hoisted):
+            if any(v is not value and occurrences(value, v)
+                   for v in hoisted):
+                del hoisted[value]
+
+        if not hoisted:
+            continue
+
+        preheader = make_preheader(context, analysis, header, body)
+        mapping = OrderedDict(
+            (value, context.local(function, value.ctype, 'licm{}'.format(n)))
+            for n, value in enumerate(hoisted))
+        for value, local in mapping.items():
+            preheader.statements.append(('add_assignment', (local, value)))
+
+        for block in body:
+            for index, statement in enumerate(statements(block)):
+                set_statement(
+                    block, index, substitute_statement(statement, mapping))
+
+        return True
+
+    return False
+
+
+def dereferenced(value, found):
+    if isinstance(value, tuple):
+        for v in value:
+            dereferenced(v, found)
+    elif isinstance(value, Value):
+        if value.method == 'dereference_field':
+            found.add(value.args[0])
+        dereferenced(value.args, found)
+
+
+def speculatable(value, safe):
+    if not isinstance(value, Value):
+        return True
+
+    method = value.method
+    if method == 'dereference_field' and value.args[0] not in safe:
+        return False
+    if method in ('dereference', 'array_access', 'call'):
+        return False
+    if method == 'binary' and value.args[0] in TRAPPING:
+        return False
+
+    return all(speculatable(o, safe) for o in value.operands())
+
+
+def make_preheader(context, analysis, header, body):
+    outside = [p for p in analysis.predecessors[header] if p not in body]
+    if len(outside) == 1 and \
+            outside[0].terminator[0] == 'end_with_jump':
+        return outside[0]
+
+    preheader = context.block(header.function)
+    preheader.end_with_jump(header)
+    for block in outside:
+        method, args = block.terminator
+        block.terminator = (method, tuple(
+            preheader if a is header else a for a in args))
+
+    return preheader
+
+
+def fold_condition(condition):
+    if not isinstance(condition, Value) or \
+            condition.method != 'comparison':
+        return None
+
+    op, a, b = condition.args
+    if op in COMPARISONS and all(
+            isinstance(v, Value) and v.method == 'integer' for v in (a, b)):
+        return COMPARISONS[op](a.args[0], b.args[0])
+
+    return None
+
+
+def check_elimination(context, function):
+    # a condition a dominating branch already decided, with nothing in
+    # between changing what it reads, always goes the same way
+    analysis = Analysis(function)
+    idom = analysis.dominators()
+
+    def reaching(start, block):
+        # blocks on the paths from start to block
+        region = set([block])
+        work = [block]
+        while work:
+            for predecessor in analysis.predecessors[work.pop()]:
+                if predecessor not in region and predecessor is not start \
+                        and analysis.dominates(start, predecessor):
+                    region.add(predecessor)
+                    work.append(predecessor)
+        return region
+
+    def decided(block, condition):
+        effects = analysis.effects(condition)
+        dominator = idom[block]
+        while True:
+            method, args = dominator.terminator
+            if method == 'end_with_conditonal' and args[0] is condition:
+                for successor, result in ((args[1], True), (args[2], False)):
+                    if args[1] is args[2] or \
+                            analysis.predecessors[successor] != [dominator] \
+                            or not analysis.dominates(successor, block):
+                        continue
+                    region = reaching(successor, block)
+                    region.add(successor)
+                    if any(analysis.writes(m, a).kills(effects)
+                           for b in region
+                           for m, a in (b.statements if b is block
+                                        else statements(b))):
+                        return None
+                    return result
+
+            if idom[dominator] is dominator:
+                return None
+            dominator = idom[dominator]
+
+    for block in analysis.blocks:
+        method, args = block.terminator
+        if method != 'end_with_conditonal':
+            continue
+
+        result = fold_condition(args[0])
+        if result is None and block is not analysis.blocks[0]:
+            result = decided(block, args[0])
+        if result is None:
+            continue
+
+        target = args[1] if result else args[2]
+        block.terminator = ('end_with_jump', (target,) + args[3:])
+
+
+# copies made by sharing and hoisting are propagated again, which lets
+# checks on them meet the checks they repeat; what the removed checks
+# separated can be shared after that
+PASSES = [
+    copy_propagation, common_subexpressions, loop_invariant_code_motion,
+    copy_propagation, check_elimination, common_subexpressions,
+    copy_propagation
+]
+
+
+class PassManager:
+    def __init__(self, passes=None):
+        self.passes = list(PASSES if passes is None else passes)
+        self.timings = OrderedDict((p.__name__, 0.0) for p in self.passes)
+
+    def run(self, context, functions):
+        for p in self.passes:
+            start = time.perf_counter()
+            for function in functions:
+                if function.blocks:
+                    p(context, function)
+            self.timings[p.__name__] += time.perf_counter() - start
+
+    def report(self):
+        # one line per pass, the time it took over every run so far
+        return '\n'.join(
+            '{:30} {:.3f}ms'.format(name, seconds * 1000)
+            for name, seconds in self.timings.items())
@@ -1,5 +1,7 @@
 import types
 
+from xpython.code import get_line
+
 
 class Rvalue:
     def __init__(self, typ, desc=None, _jit=None):
@@ -22,15 +24,23 @@ class Location:
         self.filename = filename
         self.lineno = lineno
 
+    @property
+    def source_line(self):
+        return get_line(self.filename, self.lineno).strip()
+
     def tojit(self, context):
         return context.location(self.filename, self.lineno, 0)
 
+    def __str__(self):
+        return '{}:{}'.format(self.filename, self.lineno)
+
 
 class Function:
     def __init__(self, qualname, code, annotations):
         self.qualname = qualname
         self.code = code
         self.annotations = annotations
+        self.nogil = False
 
     def __repr__(self):
         return '<Function {0.qualname} ann={0.annotations}>'.format(self)
@@ -40,9 +50,11 @@ class Function:
 
 
 class Class:
-    def __init__(self, qualname, function):
+    def __init__(self, qualname, function, bases=()):
         self.qualname = qualname
         self.function = function
+        self.bases = bases
+        self.compiler = None
 
     def __repr__(self):
         return '<Class {}>'.format(self.qualname)
@@ -112,10 +124,54 @@ class GlobalVar(Rvalue):
         return '<GlobalVar {}: {}>'.format(self.desc, self.typ)
 
 
+class StaticTable(GlobalVar):
+    def __init__(self, typ, desc, _jit, values):
+        super().__init__(typ, desc, _jit)
+        self.values = values
+
+    def __repr__(self):
+        return '<StaticTable {}: {}>'.format(self.desc, self.typ)
+
+
 class Unreachable:
     pass
 
 
+class Subscript:
+    def __init__(self, typ, where, index):
+        self.typ = typ
+        self.where = where
+        self.index = index
+
+    def __repr__(self):
+        return '<Subscript {}[{}]: {}>'.format(
+            self.where, self.index, self.typ)
+
+    def tojit(self, context):
+        # a struct columns row is spread over the columns, there is no
+        # value to store, pass or return
+        assert 0, "Rows of {} aren't values, only their fields are".format(
+            self.typ)
+
+
+class Slice:
+    def __init__(self, start, stop):
+        self.start = start
+        self.stop = stop
+
+    def __repr__(self):
+        return '<Slice {}:{}>'.format(self.start, self.stop)
+
+
+class Method:
+    def __init__(self, where, name):
+        self.where = where
+        self.name = name
+
+    def __repr__(self):
+        return '<Method {}.{}>'.format(self.where, self.name)
+
+
 class Local(Rvalue):
     def __init__(self, function, typ, name):
         self.function = function
@@ -0,0 +1,38 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+
+def split(buffer, parts):
+    # contiguous views of about the same size, the last one takes the rest
+    size = buffer.size
+    parts = max(1, min(parts, size))
+    step = size // parts
+
+    views = []
+    for i in range(parts):
+        start = i * step
+        stop = size if i == parts - 1 else start + step
+        views.append(buffer.view(start, stop))
+
+    return views
+
+
+def map(function, buffers, *args, workers=None):
+    assert getattr(function, 'nogil', False), \
+        "Only nogil functions run concurrently"
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(function, buffer, *args) for buffer in buffers]
+
+        return [future.result() for future in futures]
+
+
+def map_split(function, buffer, *args, workers=None):
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    return map(function, split(buffer, workers), *args, workers=workers)
@@ -0,0 +1,182 @@
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import warnings
+
+
+# instrumented builds count how often blocks run and branches go which way,
+# builds given a profile turn those counts into branch hints
+INSTRUMENT = False
+PROFILE = None
+
+# a branch side taken at most this often is expected not to be taken, one
+# seen fewer times in total than MIN_SAMPLES keeps the static guess
+COLD_RATIO = 0.01
+MIN_SAMPLES = 100
+
+VERSION = 1
+
+
+def fingerprint(instructions):
+    # profiles are keyed by offset, they only apply to the same code
+    digest = hashlib.sha1()
+    for instruction in instructions:
+        digest.update('{0.offset} {0.opname} {0.arg!r}\n'.format(
+            instruction).encode('utf-8'))
+
+    return digest.hexdigest()
+
+
+def profile_path(path):
+    # the profile of a cached library sits next to it
+    return os.path.splitext(path)[0] + '.profile'
+
+
+# the counters of one function, every counter is a global the code bumps,
+# the reader function copies them out and starts them again from zero
+class Counters:
+    def __init__(self, compiler):
+        self.compiler = compiler
+        self.ctype = compiler.types.get_type('ssize').ctype
+        self.keys = []
+        self.lvalues = []
+
+    @property
+    def reader(self):
+        return self.compiler.name + '__profile'
+
+    def count(self, block, key):
+        # updates from several threads may be lost, it is only a profile
+        context = self.compiler.context
+
+        lvalue = context.internal_global(
+            self.ctype, '{}__count{}'.format(
+                self.compiler.name, len(self.keys)), None)
+        self.keys.append(key)
+        self.lvalues.append(lvalue)
+
+        block.add_assignment(lvalue, context.binary(
+            '+', self.ctype, lvalue, context.integer(1, self.ctype)))
+
+    def edge(self, target, key):
+        # a block of its own on the edge, it counts and goes on
+        context = self.compiler.context
+
+        block = context.block(self.compiler.function)
+        self.count(block, key)
+        block.end_with_jump(target)
+
+        return block
+
+    def emit_reader(self):
+        context = self.compiler.context
+
+        out = context.param(context.pointer_type(self.ctype), 'out')
+        function = context.exported_function(
+            context.type('void'), self.reader, [out], None)
+
+        block = context.block(function)
+        for index, lvalue in enumerate(self.lvalues):
+            block.add_assignment(
+                context.array_access(
+                    out, context.integer(index, self.ctype)), lvalue)
+            block.add_assignment(lvalue, context.integer(0, self.ctype))
+        block.end_with_void_return()
+
+
+class FunctionProfile:
+    def __init__(self, fingerprint, counts=None):
+        self.fingerprint = fingerprint
+        self.counts = counts or OrderedDict()
+
+    def block(self, offset):
+        return self.counts.get(str(offset), 0)
+
+    def branch(self, offset):
+        return (self.counts.get('{}:true'.format(offset), 0),
+                self.counts.get('{}:false'.format(offset), 0))
+
+    def expected(self, offset):
+        # the side a branch goes nearly always, None when it isn't biased
+        on_true, on_false = self.branch(offset)
+        total = on_true + on_false
+        if total < MIN_SAMPLES:
+            return None
+
+        if on_false <= total * COLD_RATIO:
+            return True
+        if on_true <= total * COLD_RATIO:
+            return False
+
+        return None
+
+
+class Profile:
+    def __init__(self):
+        self.functions = OrderedDict()
+
+    def collect(self, result, compiler):
+        # adds what ran since the last collect, the counters restart
+        counters = compiler.counters
+        assert counters is not None, \
+            "{} wasn't built with INSTRUMENT".format(compiler.name)
+
+        ffi = compiler.ffi
+        cname = compiler.types.get_type('ssize').cname
+        reader = ffi.cast(
+            'void(*)({}*)'.format(cname), result.code(counters.reader))
+        out = ffi.new('{}[]'.format(cname), max(len(counters.keys), 1))
+        reader(out)
+
+        fingerprint_ = fingerprint(compiler.instruction_map.values())
+        profile = self.functions.get(compiler.name)
+        if profile is None or profile.fingerprint != fingerprint_:
+            profile = self.functions[compiler.name] = FunctionProfile(
+                fingerprint_)
+
+        for index, key in enumerate(counters.keys):
+            profile.counts[key] = profile.counts.get(key, 0) + out[index]
+
+        return profile
+
+    def function(self, compiler):
+        profile = self.functions.get(compiler.name)
+        if profile is None:
+            return None
+
+        if profile.fingerprint != fingerprint(
+                compiler.instruction_map.values()):
+            warnings.warn(
+                'Profile of {} is for different code, ignored'.format(
+                    compiler.name))
+            return None
+
+        return profile
+
+    def save(self, path):
+        data = OrderedDict([('version', VERSION), ('functions', OrderedDict(
+            (name, OrderedDict([
+                ('fingerprint', p.fingerprint), ('counts', p.counts)]))
+            for name, p in self.functions.items()))])
+
+        # replaced in one go, a reader never sees half a profile
+        partial = '{}.{}'.format(path, os.getpid())
+        with open(partial, 'w') as f:
+            json.dump(data, f, indent=1)
+        os.replace(partial, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f, object_pairs_hook=OrderedDict)
+
+        assert data.get('version') == VERSION, \
+            "Unsupported profile version {}".format(data.get('version'))
+
+        profile = cls()
+        for name, function in data['functions'].items():
+            profile.functions[name] = FunctionProfile(
+                function['fingerprint'], function['counts'])
+
+        return profile
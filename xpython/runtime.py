@@ -0,0 +1,34 @@
+from xpython.cpy import PyObject, Py_buffer
+from xpython.errors import ErrorState
+from xpython.types import Types
+
+
+# structs most compiles need, declared once in the runtime
+TYPEDEFS = (PyObject, Py_buffer, ErrorState)
+
+
+# what every compile shares: the base types, common typedefs and the error
+# state are declared once in a base context, so children reuse the type
+# objects instead of making them again; the base is never compiled on its
+# own, a child's unit repeats it as a jit child context does, so C-API
+# declarations and helpers are left to the children that use them
+class Runtime:
+    def __init__(self, context, ffi):
+        self.context = context
+        self.ffi = ffi
+        self.types = Types(context, ffi)
+
+    def build(self):
+        types = self.types
+
+        types.prebuild()
+        for typid in TYPEDEFS:
+            types.get_type(typid)
+
+        return self
+
+    def child(self, context=None):
+        if context is None:
+            context = self.context.new_child_context()
+
+        return context, Types(context, self.ffi, self.types)
@@ -0,0 +1,109 @@
+import os
+import stat
+
+from xpython.buffers import MappedBuffer
+
+
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+
+# one allocation reused for every chunk, the kernel sees only the filled
+# part
+class ChunkBuffer:
+    def __init__(self, ffi, capacity):
+        self._data = ffi.new("char[]", capacity)
+        self._cffi = ffi.new("buffer*")
+        self._cffi.size = 0
+        self._cffi.data = self._data
+        self.capacity = capacity
+        self.ffi = ffi
+
+    @property
+    def data(self):
+        return self.ffi.unpack(self._data, self.size)
+
+    @property
+    def size(self):
+        return self._cffi.size
+
+    @property
+    def cffi(self):
+        return self._cffi
+
+    def readinto(self, f):
+        size = f.readinto(self.ffi.buffer(self._data, self.capacity))
+        self._cffi.size = size or 0
+
+        return self.size
+
+    def fill(self, chunk):
+        assert len(chunk) <= self.capacity, "Chunk larger than the buffer"
+        self.ffi.memmove(self._data, chunk, len(chunk))
+        self._cffi.size = len(chunk)
+
+        return self.size
+
+
+def mapped_chunks(buffer, chunk_size):
+    # views of the mapping, nothing is copied
+    for offset in range(0, buffer.size, chunk_size):
+        stop = min(offset + chunk_size, buffer.size)
+        buffer.prefetch(stop, min(stop + chunk_size, buffer.size))
+
+        yield buffer.view(offset, stop)
+
+
+def file_chunks(ffi, f, chunk_size):
+    chunk = ChunkBuffer(ffi, chunk_size)
+
+    while chunk.readinto(f):
+        yield chunk
+
+
+def iterator_chunks(ffi, iterable, chunk_size):
+    # pieces larger than a chunk are split, smaller ones are passed on
+    chunk = ChunkBuffer(ffi, chunk_size)
+
+    for piece in iterable:
+        piece = memoryview(piece)
+        for offset in range(0, len(piece), chunk_size):
+            chunk.fill(piece[offset:offset + chunk_size])
+            yield chunk
+
+
+def is_regular_file(source):
+    try:
+        fileno = source.fileno()
+    except (AttributeError, OSError, ValueError):
+        return False
+
+    return stat.S_ISREG(os.fstat(fileno).st_mode)
+
+
+# calls function(state, chunk) for every chunk of source, the state struct
+# carries over between calls; source is a path, a binary file, a pipe, a
+# socket file or an iterable of bytes
+def stream(ffi, function, state, source, chunk_size=DEFAULT_CHUNK_SIZE,
+           use_mmap=True):
+    if isinstance(source, (str, bytes, os.PathLike)):
+        with open(source, 'rb') as f:
+            yield from stream(
+                ffi, function, state, f, chunk_size, use_mmap)
+
+        return
+
+    if use_mmap and is_regular_file(source) \
+            and os.fstat(source.fileno()).st_size:
+        with MappedBuffer(ffi, source) as buffer:
+            for chunk in mapped_chunks(buffer, chunk_size):
+                yield function(state, chunk)
+
+        return
+
+    if hasattr(source, 'readinto'):
+        chunks = file_chunks(ffi, source, chunk_size)
+    else:
+        chunks = iterator_chunks(ffi, source, chunk_size)
+
+    for chunk in chunks:
+        yield function(state, chunk)
@@ -0,0 +1,211 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import inspect
+import logging
+import sys
+import textwrap
+import threading
+import time
+
+from xpython import CompilerResult
+from xpython.code import from_string
+from xpython.compiler.trampoline import boxable
+
+
+# calls, or loop back-edges seen while interpreted, before a function is
+# compiled, a None back-edge threshold leaves the interpreter untraced
+CALL_THRESHOLD = 1000
+BACK_EDGE_THRESHOLD = 10000
+
+INTERPRETED = 'interpreted'
+COMPILING = 'compiling'
+NATIVE = 'native'
+FAILED = 'failed'
+
+Event = namedtuple(
+    'Event', ['kind', 'name', 'calls', 'back_edges', 'seconds', 'error'])
+
+executor = None
+
+logger = logging.getLogger(__name__)
+
+
+def get_executor():
+    # one compile at a time, the interpreter keeps running meanwhile
+    global executor
+
+    if executor is None:
+        executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='xpython-tiered')
+
+    return executor
+
+
+def report(event):
+    if event.error is None:
+        logger.info(
+            '%s %s after %d calls, %d back-edges, %.3fs', event.name,
+            event.kind, event.calls, event.back_edges, event.seconds)
+    else:
+        logger.warning('%s %s: %r', event.name, event.kind, event.error)
+
+
+def function_source(function):
+    # the definition alone, decorators would run again when compiled
+    lines = textwrap.dedent(inspect.getsource(function)).splitlines(True)
+    while not lines[0].lstrip().startswith('def '):
+        lines.pop(0)
+
+    return ''.join(lines)
+
+
+# runs a function as Python until it is hot, then compiles it in the
+# background and swaps the compiled version in, a failed compile leaves the
+# plain function in place
+class Tiered:
+    def __init__(self, function, pool, call_threshold=None,
+                 back_edge_threshold=None, on_event=None):
+        self.function = function
+        self.code = function.__code__
+        self.pool = pool
+        self.name = function.__name__
+
+        self.call_threshold = call_threshold or CALL_THRESHOLD
+        if back_edge_threshold is None:
+            back_edge_threshold = BACK_EDGE_THRESHOLD
+        self.back_edge_threshold = back_edge_threshold
+        self.on_event = on_event or report
+
+        self.calls = 0
+        self.back_edges = 0
+        self.state = INTERPRETED
+        self.lock = threading.Lock()
+        self.future = None
+        self.result = None
+        self.native = None
+
+        # replaced by one assignment, a call sees either version whole
+        self.target = self.interpret
+
+        functools.update_wrapper(self, function)
+
+    def __call__(self, *args, **kwargs):
+        # compiled code takes positional arguments only, calls with
+        # keywords always run as Python
+        if kwargs:
+            return self.function(*args, **kwargs)
+
+        return self.target(*args)
+
+    def interpret(self, *args):
+        self.calls += 1
+        if self.calls >= self.call_threshold:
+            self.promote()
+
+        # an existing tracer, a debugger say, is left alone
+        if self.state != INTERPRETED or not self.back_edge_threshold or \
+                sys.gettrace() is not None:
+            return self.function(*args)
+
+        sys.settrace(self.trace_call)
+        try:
+            return self.function(*args)
+        finally:
+            sys.settrace(None)
+
+    def trace_call(self, frame, event, arg):
+        if frame.f_code is not self.code:
+            return None
+
+        last = [frame.f_lineno]
+
+        def trace_line(frame, event, arg):
+            if event != 'line':
+                return trace_line
+
+            # going back to an earlier line is a loop going round
+            if frame.f_lineno <= last[0]:
+                self.back_edges += 1
+                if self.back_edges >= self.back_edge_threshold:
+                    self.promote()
+                    frame.f_trace_lines = False
+            last[0] = frame.f_lineno
+
+            return trace_line
+
+        return trace_line
+
+    def promote(self):
+        with self.lock:
+            if self.state != INTERPRETED:
+                return
+            self.state = COMPILING
+
+        self.future = get_executor().submit(self.compile)
+
+    def build(self):
+        from xpython.compiler.namespace import NamespaceCompiler
+
+        code = from_string(function_source(self.function))
+
+        with self.pool.child() as (context, types):
+            compiler = NamespaceCompiler(
+                context, self.pool.ffi, types, code.code)
+            compiler.emit_functions()
+
+            # the fastcall trampoline takes the objects the function does,
+            # the cffi wrapper would want cffi handles
+            function = compiler.functions[self.name]
+            assert boxable(function), \
+                "{} has parameters Python objects can't be unboxed to".format(
+                    self.name)
+
+            self.result = CompilerResult(function, context.compile())
+
+        return self.result.native(self.name)
+
+    def compile(self):
+        start = time.perf_counter()
+        try:
+            native = self.build()
+        except Exception as error:
+            # no more counting or tracing, the function stays as it is
+            self.target = self.function
+            self.state = FAILED
+            self.event(FAILED, start, error)
+
+            return
+
+        self.native = native
+        self.target = self.call_native
+        self.state = NATIVE
+        self.event('promoted', start)
+
+    def call_native(self, *args):
+        # arguments the trampoline can't unbox, floats or ints too wide for
+        # the parameters, and overflows inside the compiled code run as
+        # Python, calls give what they gave before the swap
+        try:
+            return self.native(*args)
+        except (TypeError, OverflowError):
+            return self.function(*args)
+
+    def event(self, kind, start, error=None):
+        self.on_event(Event(
+            kind, self.name, self.calls, self.back_edges,
+            time.perf_counter() - start, error))
+
+    def wait(self):
+        # the state once a pending compile is done
+        if self.future is not None:
+            self.future.result()
+
+        return self.state
+
+
+def tiered(pool, **options):
+    def decorate(function):
+        return Tiered(function, pool, **options)
+
+    return decorate
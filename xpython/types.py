@@ -1,14 +1,110 @@
-from xpython.typing import struct, struct_value
-from xpython.nodes import Rvalue, GlobalVar, Constant
+from xpython.typing import struct, struct_value, struct_array, \
+    struct_columns
+from xpython.nodes import Rvalue, GlobalVar, Constant, Subscript, \
+    StaticTable, Slice
+from xpython import errors
+from xpython.capi import CAPI
+from xpython.cpy import T_INT, T_BYTE, T_UBYTE, T_UINT, T_ULONG, T_PYSSIZET, \
+    Py_buffer, PyBUF_SIMPLE, PyBUF_WRITABLE
 from collections import OrderedDict
+from functools import partialmethod
+import operator
+import sys
+import threading
+import weakref
 
 
 DEFAULT_INTEGER_CTYPE = 'int'
+CACHE_LINE_SIZE = 64
 OVERFLOW_CHECKS = True
 BOUND_CHECKS = True
 
+OVERFLOW_BUILTINS = {
+    '+': '__builtin_add_overflow',
+    '-': '__builtin_sub_overflow',
+    '*': '__builtin_mul_overflow'
+}
+
+
+
+def floor_divide(a, b):
+    assert b != 0, "Constant division by zero"
+
+    return a // b
+
+
+def modulo(a, b):
+    assert b != 0, "Constant division by zero"
+
+    return a % b
+
+
+def shift(function):
+    def shifted(a, b):
+        assert b >= 0, "Constant negative shift count"
+
+        return function(a, b)
+
+    return shifted
+
+
+def power(a, b):
+    assert b >= 0, "Constant negative exponent"
+
+    return a ** b
+
+
+# evaluate constant operands at compile time, with python semantics
+FOLDS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '//': floor_divide,
+    '%': modulo,
+    '&': operator.and_,
+    '|': operator.or_,
+    '^': operator.xor,
+    '<<': shift(operator.lshift),
+    '>>': shift(operator.rshift),
+    '**': power
+}
+
+SHIFTS = ('<<', '>>')
+
+COMPARISONS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '>': operator.gt,
+    '>=': operator.ge
+}
+
+
+# struct typedefs already given to each ffi, redeclaring a name fails
+declared = weakref.WeakKeyDictionary()
+declared_lock = threading.Lock()
+
+
+def cdef(ffi, name, template):
+    with declared_lock:
+        templates = declared.setdefault(ffi, {})
+
+        if name in templates:
+            assert templates[name] == template, \
+                "Struct {} redeclared with another layout".format(name)
+            return
+
+        ffi.cdef(template)
+        templates[name] = template
+
 
 class Type:
+    _size = None
+    _alignment = None
+    # passed to cffi as a pointer to its struct
+    cffi_handle = False
+
     def __init__(self, context, ffi):
         self.context = context
         self.ffi = ffi
@@ -23,8 +119,17 @@ class Type:
         return Constant(self, self.default)
 
     def size(self):
+        if self._size is None:
+            self._size = self.ffi.sizeof(self.cname)
+
         return self._size
 
+    def alignment(self):
+        if self._alignment is None:
+            self._alignment = self.ffi.alignof(self.cname)
+
+        return self._alignment
+
 
 class Void(Type):
     cname = 'void'
@@ -32,9 +137,11 @@ class Void(Type):
     def build(self):
         self.ctype = self.context.type("void")
 
+    def box(self, trampoline, value):
+        return trampoline.none()
+
 
 class Ptr(Type):
-    _size = 8
     needs_temporary = True
     default = None
 
@@ -58,24 +165,469 @@ class ByCopy:
 # abstract
 class Integer(Type, ByCopy):
     default = 0
+    signed = True
 
     def build(self):
         self.ctype = self.context.type(self.cname)
 
+    def bounds(self):
+        bits = self.size() * 8
+
+        if self.signed:
+            return -2 ** (bits - 1), 2 ** (bits - 1) - 1
+
+        return 0, 2 ** bits - 1
+
+    def boxing(self, types):
+        if self.signed:
+            return types.ssize, 'PyLong_AsSsize_t', 'PyLong_FromSsize_t'
+
+        return (
+            types.unsigned, 'PyLong_AsUnsignedLong', 'PyLong_FromUnsignedLong')
+
+    def narrow(self, trampoline, value, wide):
+        context = trampoline.context
+
+        if wide.size() == self.size() and wide.signed == self.signed:
+            return value
+
+        # only the bounds the wide type can go past are checked, negative
+        # values going unsigned included
+        low, high = self.bounds()
+        wide_low, wide_high = wide.bounds()
+        message = 'value out of range for {}'.format(self.cname).encode()
+        if low > wide_low:
+            low_check = context.comparison(
+                '<', value, wide.jit_constant(context, low))
+            trampoline.raise_if(low_check, 'PyExc_OverflowError', message)
+        if high < wide_high:
+            high_check = context.comparison(
+                '>', value, wide.jit_constant(context, high))
+            trampoline.raise_if(high_check, 'PyExc_OverflowError', message)
+
+        return context.cast(value, self.ctype)
+
+    def unbox(self, trampoline, obj):
+        context = trampoline.context
+        wide, unbox, _ = self.boxing(trampoline.types)
+
+        value = trampoline.local(wide, 'unboxed')
+        trampoline.block.add_assignment(
+            value, trampoline.capi.call(unbox, obj))
+
+        # -1 is returned on error, an exception tells it from a real -1
+        error = context.cast(context.integer(-1), wide.ctype)
+        trampoline.check_error(context.comparison('==', value, error))
+
+        return self.narrow(trampoline, value, wide)
+
+    def box(self, trampoline, value):
+        wide, _, box = self.boxing(trampoline.types)
+
+        return trampoline.capi.call(
+            box, trampoline.context.cast(value, wide.ctype))
+
+    def wrap(self, value):
+        low, high = self.bounds()
+        if low <= value <= high:
+            return value
+
+        assert not OVERFLOW_CHECKS, "Constant {} overflows {}".format(
+            value, self.cname)
+
+        # wraps around like the unchecked operation does
+        bits = self.size() * 8
+        value &= 2 ** bits - 1
+        if value > high:
+            value -= 2 ** bits
+
+        return value
+
+    def fold(self, op, a, b):
+        return self.wrap(FOLDS[op](a, b))
+
+    def coerce(self, compiler, value):
+        # constants take the type of the other operand
+        if not isinstance(value, Constant) or value.typ is self:
+            return value
+
+        low, high = self.bounds()
+        assert low <= value.value <= high, \
+            "Constant {} doesn't fit {}".format(value.value, self.cname)
+
+        return Constant(self, value.value)
+
+    def widen(self, compiler, value):
+        if isinstance(value, Constant) or value.typ is self:
+            return value
+
+        return Rvalue(self, value.desc, compiler.context.cast(
+            value.tojit(compiler.context), self.ctype))
+
+    def convert(self, compiler, value):
+        # stores into a narrower type check the value fits, as the
+        # arithmetic does
+        if isinstance(value, Constant):
+            return self.coerce(compiler, value)
+        if value.typ is self:
+            return value
+
+        context = compiler.context
+        if OVERFLOW_CHECKS:
+            low, high = self.bounds()
+            wide_low, wide_high = value.typ.bounds()
+            if low > wide_low:
+                compiler.check(
+                    context.comparison(
+                        '<', value.tojit(context),
+                        value.typ.jit_constant(context, low)),
+                    errors.OVERFLOW)
+            if high < wide_high:
+                compiler.check(
+                    context.comparison(
+                        '>', value.tojit(context),
+                        value.typ.jit_constant(context, high)),
+                    errors.OVERFLOW)
+
+        return self.widen(compiler, value)
+
+    def nonnegative(self, value):
+        # comparisons are typed int, they are 0 or 1
+        if value.typ is int or not value.typ.signed:
+            return True
+
+        return isinstance(value, Constant) and value.value >= 0
+
     def binary(self, compiler, op):
         b = compiler.stack.pop()
         a = compiler.stack.pop()
+
+        types = compiler.types
+        a, b = types.operand(compiler, a), types.operand(compiler, b)
+        assert isinstance(a.typ, Integer) and isinstance(b.typ, Integer), \
+            "Can't {} {} and {}".format(op, a.typ, b.typ)
+
+        # constants take the type of the other operand, shifts the type of
+        # the left one, everything else converts like C does
+        if isinstance(a, Constant) and isinstance(b, Constant):
+            typ = b.typ
+        elif op in SHIFTS or isinstance(b, Constant):
+            typ = types.promoted(a.typ)
+        elif isinstance(a, Constant):
+            typ = types.promoted(b.typ)
+        else:
+            typ = types.common(a.typ, b.typ)
+
+        a = typ.widen(compiler, a)
+        if op not in SHIFTS:
+            b = typ.widen(compiler, b)
+
+        # a constant the type can't hold widens the operation to a type
+        # that holds both, like h & 0xFFFFFFFF for an int h
+        low, high = typ.bounds()
+        wide = [c.value for c in (a, b) if isinstance(c, Constant)
+                and isinstance(c.value, int) and not low <= c.value <= high]
+        if wide and op not in SHIFTS:
+            typ = compiler.types.fitting(wide + [low, high])
+            a, b = (typ.widen(compiler, v) for v in (a, b))
+
+        a = typ.coerce(compiler, a)
+        b = typ.coerce(compiler, b)
+
+        if isinstance(a, Constant) and isinstance(b, Constant):
+            compiler.stack.append(
+                Constant(typ, typ.fold(op, a.value, b.value)))
+
+            return
+
+        compiler.stack.append(typ.emit_binary(compiler, op, a, b))
+
+    def emit_binary(self, compiler, op, a, b):
         context = compiler.context
 
-        if OVERFLOW_CHECKS and op in self.safe_arithmetic:
-            func = self.safe_arithmetic[op]
-            result = context.call(
-                func, [a.tojit(context), b.tojit(context)])
+        if op in ('//', '%'):
+            return self.divide(compiler, op, a, b)
+
+        if op in SHIFTS:
+            return self.shift(compiler, op, a, b)
+
+        if op == '**':
+            return self.power(compiler, a, b)
+
+        if OVERFLOW_CHECKS and op in OVERFLOW_BUILTINS:
+            result = compiler.temporary(Rvalue(self, op))
+            self.checked(compiler, op, result, a, b)
+
+            return result
+
+        result = context.binary(
+            op, self.ctype, a.tojit(context), b.tojit(context))
+
+        return Rvalue(self, op, result)
+
+    def checked(self, compiler, op, result, a, b):
+        context = compiler.context
+
+        if not OVERFLOW_CHECKS:
+            compiler.block.add_assignment(
+                result.tojit(context),
+                context.binary(
+                    op, self.ctype, a.tojit(context), b.tojit(context)))
+
+            return
+
+        builtin = context.builtin_function(OVERFLOW_BUILTINS[op])
+        overflow = context.call(builtin, [
+            a.tojit(context), b.tojit(context),
+            context.address(result.tojit(context))])
+        compiler.check(overflow, errors.OVERFLOW)
+
+    def divide(self, compiler, op, a, b):
+        context = compiler.context
+        ctype = self.ctype
+        zero = self.jit_constant(context, 0)
+
+        if not isinstance(b, Constant):
+            compiler.check(
+                context.comparison('==', b.tojit(context), zero),
+                errors.ZERO_DIVISION)
+        else:
+            assert b.value != 0, "Constant division by zero"
+
+        may_be_minus_one = self.signed and not (
+            isinstance(b, Constant) and b.value != -1)
+
+        if op == '%' and may_be_minus_one:
+            # anything % -1 is 0, but C traps on INT_MIN % -1; dividing by 1
+            # gives the same remainder
+            divisor = compiler.temporary(Rvalue(self, 'divisor'))
+            compiler.block.add_assignment(
+                divisor.tojit(context),
+                context.binary(
+                    '+', ctype, b.tojit(context),
+                    context.binary(
+                        '*', ctype, self.jit_constant(context, 2),
+                        context.cast(context.comparison(
+                            '==', b.tojit(context),
+                            self.jit_constant(context, -1)), ctype))))
+            b = divisor
+        elif may_be_minus_one and not self.nonnegative(a):
+            # the only quotient that doesn't fit
+            low, _ = self.bounds()
+            compiler.check(
+                context.binary(
+                    '&', ctype,
+                    context.cast(context.comparison(
+                        '==', a.tojit(context),
+                        self.jit_constant(context, low)), ctype),
+                    context.cast(context.comparison(
+                        '==', b.tojit(context),
+                        self.jit_constant(context, -1)), ctype)),
+                errors.OVERFLOW)
+
+        quotient = compiler.temporary(Rvalue(self, '//'))
+        remainder = compiler.temporary(Rvalue(self, '%'))
+        compiler.block.add_assignment(
+            quotient.tojit(context),
+            context.binary('/', ctype, a.tojit(context), b.tojit(context)))
+        compiler.block.add_assignment(
+            remainder.tojit(context),
+            context.binary('%', ctype, a.tojit(context), b.tojit(context)))
+
+        if not (self.nonnegative(a) and self.nonnegative(b)):
+            # C truncates toward zero, python floors; the results differ
+            # by one when the remainder and the divisor differ in sign
+            adjust = compiler.temporary(Rvalue(self, 'adjust'))
+            compiler.block.add_assignment(
+                adjust.tojit(context),
+                context.binary(
+                    '&', ctype,
+                    context.cast(context.comparison(
+                        '!=', remainder.tojit(context), zero), ctype),
+                    context.cast(context.comparison(
+                        '<',
+                        context.binary(
+                            '^', ctype,
+                            remainder.tojit(context), b.tojit(context)),
+                        zero), ctype)))
+            compiler.block.add_assignment(
+                quotient.tojit(context),
+                context.binary(
+                    '-', ctype,
+                    quotient.tojit(context), adjust.tojit(context)))
+            compiler.block.add_assignment(
+                remainder.tojit(context),
+                context.binary(
+                    '+', ctype, remainder.tojit(context),
+                    context.binary(
+                        '*', ctype, b.tojit(context), adjust.tojit(context))))
+
+        return quotient if op == '//' else remainder
+
+    def shift(self, compiler, op, a, b):
+        context = compiler.context
+        bits = self.size() * 8
+        zero = self.jit_constant(context, 0)
+        count = context.cast(b.tojit(context), self.ctype)
+
+        if not self.nonnegative(b):
+            compiler.check(
+                context.comparison(
+                    '<', b.tojit(context), b.typ.jit_constant(context, 0)),
+                errors.VALUE)
+
+        # the count is compared at its own width, cast first a large one
+        # could wrap into range; comparisons are 0 or 1 and always are
+        if b.typ is int or isinstance(b, Constant) and b.value < bits:
+            in_range = None
         else:
-            result = context.binary(
-                op, self.ctype, a.tojit(context), b.tojit(context))
+            in_range = context.comparison(
+                '<', b.tojit(context), b.typ.jit_constant(context, bits))
+
+        if op == '>>':
+            shifted = context.binary(
+                '>>', self.ctype, a.tojit(context), count)
+            if in_range is None:
+                return Rvalue(self, op, shifted)
+
+            # python shifts everything out, C leaves it undefined
+            if self.signed:
+                out = context.binary(
+                    '>>', self.ctype, a.tojit(context),
+                    self.jit_constant(context, bits - 1))
+            else:
+                out = self.jit_constant(context, 0)
+
+            return compiler.select(self, in_range, shifted, out)
+
+        if OVERFLOW_CHECKS:
+            if in_range is not None:
+                # shifting everything out only overflows if there was
+                # something to shift, 0 stays 0
+                compiler.check(
+                    context.binary(
+                        '&', self.ctype,
+                        context.cast(context.comparison(
+                            '>=', b.tojit(context),
+                            b.typ.jit_constant(context, bits)), self.ctype),
+                        context.cast(context.comparison(
+                            '!=', a.tojit(context), zero), self.ctype)),
+                    errors.OVERFLOW)
+                count = compiler.select(
+                    self, in_range, count, zero).tojit(context)
+
+            result = compiler.temporary(Rvalue(self, op))
+            compiler.block.add_assignment(
+                result.tojit(context),
+                context.binary('<<', self.ctype, a.tojit(context), count))
+            # bits shifted out show up when shifting back
+            compiler.check(
+                context.comparison(
+                    '!=',
+                    context.binary(
+                        '>>', self.ctype, result.tojit(context), count),
+                    a.tojit(context)),
+                errors.OVERFLOW)
+
+            return result
+
+        shifted = context.binary('<<', self.ctype, a.tojit(context), count)
+        if in_range is None:
+            return Rvalue(self, op, shifted)
+
+        return compiler.select(self, in_range, shifted, zero)
+
+    def power(self, compiler, a, b):
+        # square and multiply, every product is overflow checked
+        context = compiler.context
+        ctype = self.ctype
+        zero = self.jit_constant(context, 0)
+
+        if not self.nonnegative(b):
+            compiler.check(
+                context.comparison(
+                    '<', b.tojit(context), b.typ.jit_constant(context, 0)),
+                errors.VALUE)
+
+        result = compiler.temporary(Rvalue(self, '**'))
+        base = compiler.temporary(Rvalue(self, 'base'))
+        exponent = compiler.temporary(Rvalue(self, 'exponent'))
+        compiler.block.add_assignment(
+            result.tojit(context), self.jit_constant(context, 1))
+        compiler.block.add_assignment(base.tojit(context), a.tojit(context))
+        compiler.block.add_assignment(
+            exponent.tojit(context),
+            context.cast(b.tojit(context), ctype))
+
+        loop_block = context.block(compiler.function)
+        test_block = context.block(compiler.function)
+        odd_block = context.block(compiler.function)
+        shift_block = context.block(compiler.function)
+        square_block = context.block(compiler.function)
+        done_block = context.block(compiler.function)
+
+        compiler.block.end_with_jump(loop_block)
+        loop_block.end_with_conditonal(
+            context.comparison('==', exponent.tojit(context), zero),
+            done_block, test_block)
+        test_block.end_with_conditonal(
+            context.comparison(
+                '!=',
+                context.binary(
+                    '&', ctype, exponent.tojit(context),
+                    self.jit_constant(context, 1)),
+                zero),
+            odd_block, shift_block)
+
+        compiler.block = odd_block
+        self.checked(compiler, '*', result, result, base)
+        compiler.block.end_with_jump(shift_block)
+
+        shift_block.add_assignment(
+            exponent.tojit(context),
+            context.binary(
+                '>>', ctype, exponent.tojit(context),
+                self.jit_constant(context, 1)))
+        shift_block.end_with_conditonal(
+            context.comparison('==', exponent.tojit(context), zero),
+            done_block, square_block)
+
+        compiler.block = square_block
+        self.checked(compiler, '*', base, base, base)
+        compiler.block.end_with_jump(loop_block)
+
+        compiler.block = done_block
+
+        return result
+
+    def unary_negative(self, compiler):
+        a = compiler.stack.pop()
+
+        if isinstance(a, Constant):
+            compiler.stack.append(Constant(self, self.wrap(-a.value)))
+
+            return
+
+        compiler.stack.append(
+            self.emit_binary(compiler, '-', Constant(self, 0), a))
+
+    def unary_invert(self, compiler):
+        # unsigned values complement within their width, ~x == -x - 1
+        # would never fit
+        a = compiler.stack.pop()
+        context = compiler.context
+
+        if isinstance(a, Constant):
+            if self.signed:
+                value = ~a.value
+            else:
+                value = a.value ^ self.bounds()[1]
+            compiler.stack.append(Constant(self, value))
 
-        compiler.stack.append(Rvalue(self, op, result))
+            return
+
+        compiler.stack.append(Rvalue(
+            self, '~', context.unary('~', self.ctype, a.tojit(context))))
 
     def binary_add(self, compiler):
         self.binary(compiler, '+')
@@ -93,78 +645,92 @@ class Integer(Type, ByCopy):
     inplace_multiply = binary_multiply
 
     def binary_floor_divide(self, compiler):
-        # FIXME: this only works for positive numbers!
-        # http://stackoverflow.com/questions/828092/python-style-integer-division-modulus-in-c
-        self.binary(compiler, '/')
+        self.binary(compiler, '//')
 
     inplace_floor_divide = binary_floor_divide
 
-    def jit_constant(self, context, value):
-        return context.integer(
-            value, self.ctype)
+    def binary_modulo(self, compiler):
+        self.binary(compiler, '%')
 
+    inplace_modulo = binary_modulo
 
-class Default(Integer):
-    cname = DEFAULT_INTEGER_CTYPE
+    def binary_power(self, compiler):
+        self.binary(compiler, '**')
 
-    def build(self):
-        super().build()
+    inplace_power = binary_power
+
+    def binary_and(self, compiler):
+        self.binary(compiler, '&')
+
+    inplace_and = binary_and
+
+    def binary_or(self, compiler):
+        self.binary(compiler, '|')
+
+    inplace_or = binary_or
 
-        # arithmetic check code
-        self.safe_arithmetic = {}
-        false = self.context.false()
-        abort = self.context.imported_function("void", "abort")
-        for op, name in {'+': 'add', '-': 'sub', '*': 'mul'}.items():
-            a = self.context.param(self.ctype, 'a')
-            b = self.context.param(self.ctype, 'b')
-            builtin = self.context.builtin_function(
-                '__builtin_{}_overflow'.format(name))
+    def binary_xor(self, compiler):
+        self.binary(compiler, '^')
 
-            f = self.context.internal_function(
-                self.ctype, "safe_{}".format(name), [a, b])
-            result = self.context.local(
-                f, self.ctype, 'result')
-            result_p = self.context.address(result)
-            overflow = self.context.local(
-                f, 'bool', 'overflow')
+    inplace_xor = binary_xor
 
-            cmp_block = self.context.block(f)
-            abort_block = self.context.block(f)
-            ret_block = self.context.block(f)
+    def binary_lshift(self, compiler):
+        self.binary(compiler, '<<')
 
-            builtin_call = self.context.call(builtin, [a, b, result_p])
-            cmp_block.add_assignment(overflow, builtin_call)
-            comparison = self.context.comparison('==', overflow, false)
-            cmp_block.end_with_conditonal(comparison, ret_block, abort_block)
+    inplace_lshift = binary_lshift
 
-            abort_call = self.context.call(abort)
-            abort_block.add_eval(abort_call)
-            abort_block.end_with_jump(ret_block)
+    def binary_rshift(self, compiler):
+        self.binary(compiler, '>>')
 
-            ret_block.end_with_return(result)
+    inplace_rshift = binary_rshift
 
-            self.safe_arithmetic[op] = f
+    def jit_constant(self, context, value):
+        return context.integer(
+            value, self.ctype)
+
+
+class Default(Integer):
+    cname = DEFAULT_INTEGER_CTYPE
+    # structmember code matching DEFAULT_INTEGER_CTYPE
+    member_type = T_INT
 
 
 class SSize(Integer):
-    _size = 8
     cname = 'ssize_t'
+    member_type = T_PYSSIZET
 
 
 class Byte(Integer):
     cname = 'char'
+    member_type = T_BYTE
+
+
+class UByte(Integer):
+    cname = 'unsigned char'
+    signed = False
+    member_type = T_UBYTE
+
+
+class UShort(Integer):
+    cname = 'unsigned short'
+    signed = False
 
 
 class UInt(Integer):
     cname = 'unsigned int'
+    signed = False
+    member_type = T_UINT
 
 
 class Int(Integer):
     cname = 'int'
+    member_type = T_INT
 
 
 class Unsigned(Integer):
     cname = 'unsigned long'
+    signed = False
+    member_type = T_ULONG
 
 
 class ByRef:
@@ -201,6 +767,60 @@ class Field:
         self.cfield = cfield
 
 
+def align_up(offset, alignment):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+class Layout:
+    def __init__(self, fields):
+        fields = list(fields)
+        self.offsets = OrderedDict()
+        self.alignment = 1
+
+        offset = 0
+        for name, typ in fields:
+            alignment = typ.alignment()
+            offset = align_up(offset, alignment)
+            self.offsets[name] = offset
+            offset += typ.size()
+            self.alignment = max(self.alignment, alignment)
+
+        self.size = align_up(offset, self.alignment)
+        self.padding = self.size - sum(typ.size() for _, typ in fields)
+
+    def check(self, ffi, name):
+        assert ffi.sizeof(name) == self.size, \
+            "size of {} is {}, ffi says {}".format(
+                name, self.size, ffi.sizeof(name))
+
+        for field, offset in self.offsets.items():
+            assert ffi.offsetof(name, field) == offset, \
+                "offset of {}.{} is {}, ffi says {}".format(
+                    name, field, offset, ffi.offsetof(name, field))
+
+    def __repr__(self):
+        return '<Layout size={} alignment={} padding={}>'.format(
+            self.size, self.alignment, self.padding)
+
+
+def compact_order(fields, hot=(), pinned=0):
+    # decreasing alignment leaves no interior padding, if that pushes a hot
+    # field past the first cache line hot fields are moved to the front
+    head, rest = fields[:pinned], fields[pinned:]
+
+    order = head + sorted(
+        rest, key=lambda f: (-f[0].alignment(), f[1] not in hot))
+
+    layout = Layout((name, typ) for typ, name in order)
+    if not all(
+            layout.offsets[name] + typ.size() <= CACHE_LINE_SIZE
+            for typ, name in order if name in hot):
+        order = head + sorted(
+            rest, key=lambda f: (f[1] not in hot, -f[0].alignment()))
+
+    return order
+
+
 class AbstractStruct(Type):
     def store_attribute(self, compiler, where, name, what):
         context = compiler.context
@@ -263,21 +883,32 @@ class ValueStruct(AbstractStruct):
         return GlobalVar(self, name, lvalue)
 
     def size(self):
-        ### CRITICAL FIXME: implement struct alignment and padding
-        return sum(f.typ.size() for f in self.fields.values())
+        return self.layout.size
+
+    def alignment(self):
+        return self.layout.alignment
 
 
 class Struct(Ptr, AbstractStruct):
     needs_temporary = False
+    layout_mode = 'declared'
+    hot = ()
+    pinned = 0
 
     def build(self):
+        fields = list(self.fields)
+        if self.layout_mode == 'compact':
+            fields = compact_order(fields, self.hot, self.pinned)
+
         self.fields = OrderedDict(
             (name, Field(name, typ, self.context.field(typ.ctype, name)))
-            for typ, name in self.fields)
+            for typ, name in fields)
 
         value_ctype = self.context.struct_type(
             self.name, list(f.cfield for f in self.fields.values()))
         self.ctype = self.context.pointer_type(value_ctype)
+        self.layout = Layout(
+            (name, field.typ) for name, field in self.fields.items())
         self.access_field = self.context.dereference_field
         self.access_field_lvalue = self.access_field
 
@@ -285,6 +916,7 @@ class Struct(Ptr, AbstractStruct):
         self.value.fields = self.fields
         self.value.ctype = value_ctype
         self.value.cname = self.name
+        self.value.layout = self.layout
         self.value.access_field = self.context.access_field
         self.value.access_field_lvalue = self.context.access_field_lvalue
 
@@ -293,7 +925,8 @@ class Struct(Ptr, AbstractStruct):
             cffi_template += "    {} {};\n".format(field.typ.cname, name)
         cffi_template += '} ' + self.name + ';'
 
-        self.ffi.cdef(cffi_template)
+        cdef(self.ffi, self.name, cffi_template)
+        self.layout.check(self.ffi, self.name)
 
     @property
     def cname(self):
@@ -302,54 +935,192 @@ class Struct(Ptr, AbstractStruct):
     def __str__(self):
         return self.name
 
+    @property
+    def is_pyobject(self):
+        return next(iter(self.fields)) == 'ob_base'
 
-class Buffer(Struct):
-    name = 'buffer'
-    fields = [(Default, 'size'), (RawMem, 'data')]
+    def unbox(self, trampoline, obj):
+        context = trampoline.context
+
+        assert self in trampoline.type_objects, \
+            "Don't know the python type of {}".format(self)
+
+        trampoline.raise_if(
+            trampoline.not_instance(obj, trampoline.type_objects[self]),
+            'PyExc_TypeError', 'expected {}'.format(self.name).encode())
+
+        return context.cast(obj, self.ctype)
+
+    def box(self, trampoline, value):
+        assert self.is_pyobject, "Can't box {}".format(self)
+
+        obj = trampoline.context.cast(value, trampoline.types.opaque.ctype)
+        trampoline.incref(obj)
+
+        return obj
 
+
+class Pointer(Ptr):
     def build(self):
-        super().build()
+        self.ctype = self.context.pointer_type(self.item.ctype)
+
+    @property
+    def cname(self):
+        return self.item.cname + '*'
 
-        abort = self.context.imported_function("void", "abort")
+    def __str__(self):
+        return str(self.item) + '*'
 
-        # bound check code
-        buffer_param = self.context.param(self.ctype, 'buffer')
-        index_param = self.context.param(
-            self.fields['size'].typ.ctype, 'index')
-        self.bound_check = self.context.internal_function(
-             "void", "bound_check", [buffer_param, index_param])
 
-        cmp_block = self.context.block(self.bound_check)
-        abort_block = self.context.block(self.bound_check)
-        ret_block = self.context.block(self.bound_check)
+# read-only array baked into the compiled code, items read as Default
+class Table(Type):
+    needs_temporary = False
 
-        size = self.context.dereference_field(
-            buffer_param, self.fields['size'].cfield)
-        comparison = self.context.comparison('<', index_param, size)
-        cmp_block.end_with_conditonal(comparison, ret_block, abort_block)
+    def build(self):
+        self.ctype = self.context.array_type(self.item.ctype, self.length)
 
-        abort_call = self.context.call(abort)
-        abort_block.add_eval(abort_call)
-        abort_block.end_with_void_return()
+    @property
+    def cname(self):
+        return '{}[{}]'.format(self.item.cname, self.length)
 
-        ret_block.end_with_void_return()
+    def __str__(self):
+        return '{}[{}]'.format(self.item, self.length)
+
+    def store_name(self, compiler, instruction, values):
+        name = instruction.argval
+        context = compiler.context
+        location = compiler.location.tojit(context)
+
+        lvalue = context.internal_global(self.ctype, name, location)
+        data = self.ffi.new('{}[]'.format(self.item.cname), list(values))
+        context.set_initializer(lvalue, bytes(self.ffi.buffer(data)))
+
+        return StaticTable(self, name, lvalue, values)
+
+    def binary_subscr(self, compiler, instruction):
+        index = compiler.stack.pop()
+        where = compiler.stack.pop()
+        context = compiler.context
+
+        assert isinstance(index.typ, Integer), "index must be integer"
+
+        if isinstance(index, Constant):
+            assert 0 <= index.value < self.length, \
+                "Index {} out of range for {}".format(index.value, where.desc)
+            compiler.stack.append(
+                Constant(self.item, where.values[index.value]))
+
+            return
+
+        if BOUND_CHECKS:
+            unsigned = compiler.types.unsigned
+            failed = context.comparison(
+                '>=',
+                context.cast(index.tojit(context), unsigned.ctype),
+                unsigned.jit_constant(context, self.length))
+            compiler.check(failed, errors.INDEX)
+
+        rvalue = Rvalue(self.item, '[]', context.array_access(
+            where.tojit(context), index.tojit(context)))
+
+        tmp = compiler.temporary(rvalue)
+        compiler.block.add_assignment(
+            tmp.tojit(context), rvalue.tojit(context))
+        compiler.stack.append(tmp)
+
+    def store_subscr(self, compiler, instruction):
+        assert 0, "{} is read-only".format(compiler.stack[-2].desc)
+
+    def len_call(self, compiler, argument):
+        return Constant(compiler.types.default, self.length)
+
+
+# abstract, a struct with a size field that can be subscripted
+class Container(Struct):
+    cffi_handle = True
+
+    def emit_bound_check(self, compiler, where, index):
+        if not BOUND_CHECKS:
+            return
+
+        context = compiler.context
+        size = self.load_attribute(compiler, where, 'size')
+
+        # compared as unsigned so negative indexes fail too
+        unsigned = compiler.types.unsigned.ctype
+        failed = context.comparison(
+            '>=',
+            context.cast(index.tojit(context), unsigned),
+            context.cast(size.tojit(context), unsigned))
+        compiler.check(failed, errors.INDEX)
 
     def len_call(self, compiler, argument):
         return self.load_attribute(compiler, argument, 'size')
 
+
+NATIVE_ORDER = 'le' if sys.byteorder == 'little' else 'be'
+
+# the type of buf.u32le(i) loads and stores, and the type loads yield
+WIDE_ACCESS = {
+    'u16': (UShort, Default),
+    'u32': (UInt, UInt),
+    'u64': (Unsigned, Unsigned)
+}
+
+
+class Buffer(Container):
+    name = 'buffer'
+    fields = [(Default, 'size'), (RawMem, 'data')]
+
+    def unbox(self, trampoline, obj, writable=False):
+        context = trampoline.context
+        types = trampoline.types
+
+        py_buffer = types.get_type(Py_buffer).value
+        view = trampoline.local(py_buffer, 'view')
+        view_p = context.address(view)
+        flags = PyBUF_WRITABLE if writable else PyBUF_SIMPLE
+
+        failed = context.comparison(
+            '!=',
+            trampoline.capi.call(
+                'PyObject_GetBuffer', obj, view_p, context.integer(flags)),
+            context.integer(0))
+        trampoline.check(failed)
+        trampoline.cleanup(
+            lambda block: block.add_eval(
+                trampoline.capi.call('PyBuffer_Release', view_p)))
+
+        buffer = trampoline.local(self.value, 'buffer')
+        size = context.access_field(
+            view, py_buffer.fields['len'].cfield)
+        # the range checks end the current block, assign in the next one
+        size = self.fields['size'].typ.narrow(trampoline, size, types.ssize)
+        trampoline.block.add_assignment(
+            context.access_field_lvalue(buffer, self.fields['size'].cfield),
+            size)
+        data = context.access_field(
+            view, py_buffer.fields['buf'].cfield)
+        trampoline.block.add_assignment(
+            context.access_field_lvalue(buffer, self.fields['data'].cfield),
+            context.cast(data, self.fields['data'].typ.ctype))
+
+        return context.address(buffer)
+
     def binary_subscr(self, compiler, instruction):
         index = compiler.stack.pop()
         where = compiler.stack.pop()
         context = compiler.context
 
+        if isinstance(index, Slice):
+            compiler.stack.append(self.slice(compiler, where, index))
+
+            return
+
         assert isinstance(index.typ, Default), "index must be integer"
         assert isinstance(where.typ, Buffer), "where must be buffer"
 
-        if BOUND_CHECKS:
-            bound_check_call = context.call(
-                self.bound_check,
-                [where.tojit(context), index.tojit(context)])
-            compiler.block.add_eval(bound_check_call)
+        self.emit_bound_check(compiler, where, index)
 
         data = self.load_attribute(compiler, where, 'data')
 
@@ -373,28 +1144,415 @@ class Buffer(Struct):
 
         assert isinstance(index.typ, Default), "index must be integer"
         assert isinstance(where.typ, Buffer), "where must be buffer"
-        assert isinstance(what.typ, Byte), "what must be byte"
+        assert isinstance(what.typ, Integer), "what must be integer"
+
+        self.mutate(compiler, where)
+        what = compiler.types.byte.convert(compiler, what)
 
         data = self.load_attribute(compiler, where, 'data')
 
-        if BOUND_CHECKS:
-            bound_check_call = context.call(
-                self.bound_check,
-                [where.tojit(context), index.tojit(context)])
-            compiler.block.add_eval(bound_check_call)
+        self.emit_bound_check(compiler, where, index)
 
         lvalue = context.array_access(
             data.tojit(self.context), index.tojit(self.context))
 
         compiler.block.add_assignment(lvalue, what.tojit(self.context))
 
+    def widen(self, compiler, value):
+        # negative ints turn into large unsigned values, they fail the
+        # range checks and the sums can't wrap
+        context = compiler.context
+        types = compiler.types
+
+        return context.cast(
+            context.cast(value.tojit(context), types.uint.ctype),
+            types.unsigned.ctype)
+
+    def emit_range_check(self, compiler, where, start, length):
+        # start + length <= size
+        if not BOUND_CHECKS:
+            return
+
+        context = compiler.context
+        size = self.load_attribute(compiler, where, 'size')
+
+        end = context.binary(
+            '+', compiler.types.unsigned.ctype,
+            self.widen(compiler, start), length)
+        compiler.check(
+            context.comparison('>', end, self.widen(compiler, size)),
+            errors.INDEX)
+
+    def address_of(self, compiler, where, index):
+        context = compiler.context
+        data = self.load_attribute(compiler, where, 'data')
+
+        return context.cast(
+            context.address(context.array_access(
+                data.tojit(context), index.tojit(context))),
+            compiler.types.opaque.ctype)
+
+    def mutate(self, compiler, where):
+        compiler.mutate(where)
+
+    def slice(self, compiler, where, index):
+        # a new buffer struct pointing into the parent, nothing is copied
+        context = compiler.context
+        types = compiler.types
+
+        size = self.load_attribute(compiler, where, 'size')
+        start, stop = index.start, index.stop
+        if isinstance(start, Constant) and start.value is None:
+            start = Constant(types.default, 0)
+        if isinstance(stop, Constant) and stop.value is None:
+            stop = size
+
+        assert isinstance(start.typ, Default) and \
+            isinstance(stop.typ, Default), "slice bounds must be integer"
+
+        if BOUND_CHECKS:
+            uint = types.uint.ctype
+            compiler.check(
+                context.comparison(
+                    '>', context.cast(stop.tojit(context), uint),
+                    context.cast(size.tojit(context), uint)),
+                errors.INDEX)
+            compiler.check(
+                context.comparison(
+                    '>', context.cast(start.tojit(context), uint),
+                    context.cast(stop.tojit(context), uint)),
+                errors.INDEX)
+
+        data = self.load_attribute(compiler, where, 'data')
+        view = compiler.temporary(Rvalue(self.value, 'slice'))
+        compiler.block.add_assignment(
+            context.access_field_lvalue(
+                view.tojit(context), self.fields['data'].cfield),
+            context.address(context.array_access(
+                data.tojit(context), start.tojit(context))))
+        compiler.block.add_assignment(
+            context.access_field_lvalue(
+                view.tojit(context), self.fields['size'].cfield),
+            context.binary(
+                '-', types.default.ctype,
+                stop.tojit(context), start.tojit(context)))
+
+        sliced = Rvalue(self, 'slice', context.address(view.tojit(context)))
+        # writes through the slice write the parent
+        sliced.parent = where
+
+        return sliced
+
+    def byte_order(self, compiler, width, value, order):
+        if order == NATIVE_ORDER or width.size() == 1:
+            return value
+
+        bswap = compiler.context.builtin_function(
+            '__builtin_bswap{}'.format(width.size() * 8))
+
+        return compiler.context.call(bswap, [value])
+
+    def copy_bytes(self, compiler, dst, src, width):
+        context = compiler.context
+        memcpy = context.builtin_function('__builtin_memcpy')
+
+        compiler.block.add_eval(context.call(memcpy, [
+            dst, src,
+            compiler.types.unsigned.jit_constant(context, width.size())]))
+
+    def load_wide(self, width, order, compiler, where, index):
+        # unaligned loads through memcpy, gcc turns them into one move
+        context = compiler.context
+        types = compiler.types
+        width_type, result_type = WIDE_ACCESS[width]
+        width = types.get_type(width_type)
+        result_type = types.get_type(result_type)
+
+        assert isinstance(index.typ, Default), "index must be integer"
+
+        self.emit_range_check(
+            compiler, where, index,
+            types.unsigned.jit_constant(context, width.size()))
+
+        loaded = compiler.temporary(Rvalue(width, 'load'))
+        self.copy_bytes(
+            compiler,
+            context.cast(
+                context.address(loaded.tojit(context)), types.opaque.ctype),
+            self.address_of(compiler, where, index), width)
+
+        rvalue = Rvalue(result_type, 'wide', context.cast(
+            self.byte_order(compiler, width, loaded.tojit(context), order),
+            result_type.ctype))
+        result = compiler.temporary(rvalue)
+        compiler.block.add_assignment(
+            result.tojit(context), rvalue.tojit(context))
+
+        return result
+
+    def store_wide(self, width, order, compiler, where, index, value):
+        context = compiler.context
+        types = compiler.types
+        width = types.get_type(WIDE_ACCESS[width][0])
+
+        assert isinstance(index.typ, Default), "index must be integer"
+        assert isinstance(value.typ, Integer), "value must be integer"
+        self.mutate(compiler, where)
+
+        self.emit_range_check(
+            compiler, where, index,
+            types.unsigned.jit_constant(context, width.size()))
+
+        stored = compiler.temporary(Rvalue(width, 'store'))
+        compiler.block.add_assignment(
+            stored.tojit(context),
+            self.byte_order(
+                compiler, width,
+                context.cast(value.tojit(context), width.ctype), order))
+        self.copy_bytes(
+            compiler, self.address_of(compiler, where, index),
+            context.cast(
+                context.address(stored.tojit(context)), types.opaque.ctype),
+            width)
+
+    def copy_method(self, compiler, where, offset, src):
+        # memmove, views of the same buffer may overlap
+        context = compiler.context
+        types = compiler.types
+
+        assert isinstance(src.typ, Buffer), "can only copy from a buffer"
+        self.mutate(compiler, where)
+
+        size = self.load_attribute(compiler, src, 'size')
+        self.emit_range_check(
+            compiler, where, offset, self.widen(compiler, size))
+
+        compiler.block.add_eval(compiler.c.memmove(
+            self.address_of(compiler, where, offset),
+            self.address_of(compiler, src, Constant(types.default, 0)),
+            context.cast(size.tojit(context), types.unsigned.ctype)))
+
+    def fill_method(self, compiler, where, value):
+        context = compiler.context
+        types = compiler.types
+
+        assert isinstance(value.typ, Integer), "value must be integer"
+        self.mutate(compiler, where)
+
+        size = self.load_attribute(compiler, where, 'size')
+        compiler.block.add_eval(compiler.c.memset(
+            self.address_of(compiler, where, Constant(types.default, 0)),
+            context.cast(value.tojit(context), types.int.ctype),
+            context.cast(size.tojit(context), types.unsigned.ctype)))
+
+    def find_method(self, compiler, where, value, start=None):
+        # index of the first value at or after start, -1 if there is none
+        context = compiler.context
+        types = compiler.types
+
+        if start is None:
+            start = Constant(types.default, 0)
+        assert isinstance(value.typ, Integer), "value must be integer"
+
+        self.emit_range_check(
+            compiler, where, start, types.unsigned.jit_constant(context, 0))
+
+        size = self.load_attribute(compiler, where, 'size')
+        remaining = context.binary(
+            '-', types.default.ctype,
+            size.tojit(context), start.tojit(context))
+        found = compiler.temporary(Rvalue(types.opaque, 'found'))
+        compiler.block.add_assignment(found.tojit(context), compiler.c.memchr(
+            self.address_of(compiler, where, start),
+            context.cast(value.tojit(context), types.int.ctype),
+            context.cast(remaining, types.unsigned.ctype)))
+
+        ssize = types.ssize.ctype
+        base = self.address_of(compiler, where, Constant(types.default, 0))
+        index = context.binary(
+            '-', ssize,
+            context.cast(found.tojit(context), ssize),
+            context.cast(base, ssize))
+
+        return compiler.select(
+            types.default,
+            context.comparison(
+                '==', found.tojit(context), context.null(types.opaque.ctype)),
+            types.default.jit_constant(context, -1),
+            context.cast(index, types.default.ctype))
+
+    def compare_method(self, compiler, where, other):
+        # like comparing bytes objects: -1, 0 or 1
+        context = compiler.context
+        types = compiler.types
+        default = types.default.ctype
+
+        assert isinstance(other.typ, Buffer), "can only compare buffers"
+
+        size = self.load_attribute(compiler, where, 'size')
+        other_size = self.load_attribute(compiler, other, 'size')
+        shorter = compiler.select(
+            types.default,
+            context.comparison(
+                '<', size.tojit(context), other_size.tojit(context)),
+            size.tojit(context), other_size.tojit(context))
+
+        compared = compiler.temporary(Rvalue(types.default, 'memcmp'))
+        compiler.block.add_assignment(
+            compared.tojit(context), compiler.c.memcmp(
+                self.address_of(compiler, where, Constant(types.default, 0)),
+                self.address_of(compiler, other, Constant(types.default, 0)),
+                context.cast(shorter.tojit(context), types.unsigned.ctype)))
+
+        def sign(a, b):
+            return context.binary(
+                '-', default,
+                context.cast(context.comparison('>', a, b), default),
+                context.cast(context.comparison('<', a, b), default))
+
+        zero = types.default.jit_constant(context, 0)
+
+        return compiler.select(
+            types.default,
+            context.comparison('==', compared.tojit(context), zero),
+            sign(size.tojit(context), other_size.tojit(context)),
+            sign(compared.tojit(context), zero))
+
+
+for _width in ('u16', 'u32', 'u64'):
+    for _order in ('le', 'be'):
+        setattr(Buffer, _width + _order + '_method',
+                partialmethod(Buffer.load_wide, _width, _order))
+        setattr(Buffer, 'set_' + _width + _order + '_method',
+                partialmethod(Buffer.store_wide, _width, _order))
+
+
+# array of structs, arr[i] is the i-th struct value
+class StructArray(Container):
+    def build(self):
+        super().build()
+
+        self.element = self.fields['data'].typ.value
+
+    def binary_subscr(self, compiler, instruction):
+        index = compiler.stack.pop()
+        where = compiler.stack.pop()
+        context = compiler.context
+
+        assert isinstance(index.typ, Default), "index must be integer"
+
+        self.emit_bound_check(compiler, where, index)
+
+        data = self.load_attribute(compiler, where, 'data')
+
+        compiler.stack.append(Rvalue(
+            self.element, "[]",
+            context.array_access(data.tojit(context), index.tojit(context))))
+
+
+# struct of arrays, every struct field is stored in its own column,
+# arr[i].field reads field[i]
+class StructColumns(Container):
+    def build(self):
+        super().build()
+
+        self.row = ColumnsRow(self)
+
+    def binary_subscr(self, compiler, instruction):
+        index = compiler.stack.pop()
+        where = compiler.stack.pop()
+
+        assert isinstance(index.typ, Default), "index must be integer"
+
+        self.emit_bound_check(compiler, where, index)
+
+        compiler.stack.append(Subscript(self.row, where, index))
+
+
+class ColumnsRow:
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __str__(self):
+        return self.columns.name + '[]'
+
+    def field_lvalue(self, compiler, row, name):
+        context = compiler.context
+
+        column = self.columns.load_attribute(compiler, row.where, name)
+
+        return context.array_access(
+            column.tojit(context), row.index.tojit(context))
+
+    def load_attr(self, compiler, instruction):
+        row = compiler.stack.pop()
+        name = instruction.argval
+        context = compiler.context
+
+        typ = self.columns.fields[name].typ.item
+        rvalue = Rvalue(
+            typ, '.' + name, self.field_lvalue(compiler, row, name))
+
+        if typ.needs_temporary:
+            tmp = compiler.temporary(rvalue)
+
+            compiler.block.add_assignment(
+                tmp.tojit(context),
+                rvalue.tojit(context))
+
+            rvalue = tmp
+
+        compiler.stack.append(rvalue)
+
+    def store_attr(self, compiler, instruction):
+        row = compiler.stack.pop()
+        what = compiler.stack.pop()
+        name = instruction.argval
+        context = compiler.context
+
+        compiler.block.add_assignment(
+            self.field_lvalue(compiler, row, name), what.tojit(context))
+
+
+# built once in a base context and shared by its child contexts
+BASE_TYPES = (
+    Void, Opaque, Default, SSize, Byte, UByte, UInt, Int, Unsigned, CStr,
+    Buffer)
+
 
 class Types:
-    def __init__(self, context, ffi):
+    def __init__(self, context, ffi, parent=None):
         self.context = context
         self.ffi = ffi
         self.cache = {}
         self.name_cache = {}
+        self._errors = None
+
+        # types of the parent were built in the parent context, the child
+        # context can use them; a family shares one lock since it shares
+        # the ffi
+        self.parent = parent
+        self.lock = threading.RLock() if parent is None else parent.lock
+
+        if parent is None:
+            self.capi = CAPI(self)
+        else:
+            self.capi = parent.capi.child(self)
+
+    def prebuild(self):
+        for typ in BASE_TYPES:
+            self._get_type(typ)
+
+    @property
+    def errors(self):
+        with self.lock:
+            if self._errors is None and self.parent is not None:
+                self._errors = self.parent.errors.child(self)
+            elif self._errors is None:
+                self._errors = errors.Errors(self)
+                self._errors.build()
+
+        return self._errors
 
     @property
     def opaque(self):
@@ -444,33 +1602,145 @@ class Types:
             'ssize': SSize,
             'default': Default,
             'byte': Byte,
+            'ubyte': UByte,
             'buffer': Buffer,
             'cstr': CStr
         }
 
+        if isinstance(typid, Constant):
+            typid = typid.value
+
         if isinstance(typid, struct):
             fields = [(self.get_type(t), n) for n, t in typid.fields.items()]
-            typ = type(
-                typid.name, (Struct,), {"name": typid.name, "fields": fields})
+            typ = type(typid.name, (Struct,), {
+                "name": typid.name, "fields": fields,
+                "layout_mode": typid.layout, "hot": typid.hot,
+                "pinned": typid.pinned})
 
             return self._get_type(typ)
         elif isinstance(typid, struct_value):
             return self.get_type(typid.instance).value
+        elif isinstance(typid, struct_array):
+            element = self.get_type(typid.struct)
+            fields = [(Default, 'size'), (element, 'data')]
+            typ = type(
+                typid.name, (StructArray,),
+                {"name": typid.name, "fields": fields})
+
+            return self._get_type(typ)
+        elif isinstance(typid, struct_columns):
+            element = self.get_type(typid.struct)
+            assert 'size' not in element.fields, \
+                "struct columns can't have a field named size"
+            fields = [(Default, 'size')] + [
+                (self.pointer(field.typ), name)
+                for name, field in element.fields.items()]
+            typ = type(
+                typid.name, (StructColumns,),
+                {"name": typid.name, "fields": fields})
+
+            return self._get_type(typ)
         elif type(typid) is type and issubclass(typid, Type):
             return self._get_type(typid)
 
         return self._get_type(str_to_typ[typid])
 
-    def _get_type(self, typ):
-        if isinstance(typ, Type):
-            return typ
+    def operand(self, compiler, value):
+        # comparisons are typed int, in arithmetic they are ints
+        if value.typ is not int:
+            return value
+
+        return Rvalue(self.int, value.desc, compiler.context.cast(
+            value.tojit(compiler.context), self.int.ctype))
+
+    def promoted(self, typ):
+        # C computes in int at least
+        if typ.size() < self.int.size():
+            return self.int
 
+        return typ
+
+    def common(self, a, b):
+        # C's usual arithmetic conversions: the wider type, the unsigned
+        # one of the same width
+        a, b = self.promoted(a), self.promoted(b)
+        if a.size() != b.size():
+            return a if a.size() > b.size() else b
+        if a.signed != b.signed:
+            return a if not a.signed else b
+
+        return b
+
+    def fitting(self, values):
+        # the narrowest of default, ssize and unsigned all the values fit
+        for typ in (self.default, self.ssize, self.unsigned):
+            low, high = typ.bounds()
+            if all(low <= v <= high for v in values):
+                return typ
+
+        assert 0, "Values don't fit {}".format(self.unsigned)
+
+    def table(self, values):
+        if isinstance(values, bytes):
+            item = self._get_type(UByte)
+        else:
+            item = self.fitting(values)
+
+        key = (Table, item, len(values))
+
+        with self.lock:
+            instance = self._lookup(key)
+            if instance is not None:
+                return instance
+
+            instance = Table(self.context, self.ffi)
+            instance.item = item
+            instance.length = len(values)
+            instance.build()
+            self.cache[key] = instance
+
+            return instance
+
+    def pointer(self, typ):
+        key = (Pointer, typ)
+
+        with self.lock:
+            instance = self._lookup(key)
+            if instance is not None:
+                return instance
+
+            instance = Pointer(self.context, self.ffi)
+            instance.item = typ
+            instance.build()
+            self.cache[key] = instance
+
+            return instance
+
+    def _lookup(self, typ):
         if typ in self.cache:
             return self.cache[typ]
 
-        if issubclass(typ, Struct) and typ.__name__ in self.name_cache:
+        if type(typ) is type and issubclass(typ, Struct) \
+                and typ.__name__ in self.name_cache:
             return self.name_cache[typ.__name__]
 
+        if self.parent is not None:
+            return self.parent._lookup(typ)
+
+        return None
+
+    def _get_type(self, typ):
+        if isinstance(typ, Type):
+            return typ
+
+        with self.lock:
+            instance = self._lookup(typ)
+            if instance is not None:
+                return instance
+
+            return self._build_type(typ)
+
+    def _build_type(self, typ):
         instance = typ(self.context, self.ffi)
 
         if issubclass(typ, Struct):
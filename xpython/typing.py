@@ -1,6 +1,10 @@
 from collections import OrderedDict
 
 
+def nogil(function):
+    return function
+
+
 def byte(x):
     assert 0 <= x <= 0xff
 
@@ -9,11 +13,24 @@ def unsigned(x):
     assert 0 <= x <= 0xffff_ffff_ffff_ffff
 
 
+LAYOUTS = ('declared', 'compact')
+
+
 class struct:
-    def __init__(self, name, *fields):
+    # number of leading fields that keep their position in compact layout
+    pinned = 0
+
+    def __init__(self, name, *fields, layout='declared', hot=()):
         self.name = name
         self.fields = OrderedDict(fields)
 
+        assert layout in LAYOUTS, "Unknown struct layout " + layout
+        self.layout = layout
+
+        for field in hot:
+            assert field in self.fields, "Unknown hot field " + field
+        self.hot = tuple(hot)
+
     def __call__(self, **kwargs):
         for name in kwargs:
             assert name in self.fields
@@ -24,6 +41,14 @@ class struct:
     def value(self):
         return struct_value(self)
 
+    @property
+    def array(self):
+        return struct_array(self)
+
+    @property
+    def columns(self):
+        return struct_columns(self)
+
     def __repr__(self):
         r = '<struct {} '.format(self.name)
         r += ','.join(n + ': ' + str(t) for n, t in self.fields.items())
@@ -40,6 +65,30 @@ class struct_value:
         return '<struct_value {}>'.format(self.instance)
 
 
+class struct_array:
+    def __init__(self, struct):
+        self.struct = struct
+
+    @property
+    def name(self):
+        return self.struct.name + '_array'
+
+    def __repr__(self):
+        return '<struct_array {}>'.format(self.struct)
+
+
+class struct_columns:
+    def __init__(self, struct):
+        self.struct = struct
+
+    @property
+    def name(self):
+        return self.struct.name + '_columns'
+
+    def __repr__(self):
+        return '<struct_columns {}>'.format(self.struct)
+
+
 class struct_instance:
     def __init__(self, typ, values):
         self.__type = typ